@@ -1,14 +1,20 @@
 import os
 import openai
-import requests
-from io import BytesIO
-from PIL import Image
 # from display import epd_display # Removed to avoid GPIO conflict in web app
 import datetime
+import json
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from tavily import TavilyClient
 from dotenv import load_dotenv
 
+from api import classifier
+from api import image_download
+from api import search_cache
+from storage import media_writer
+
 # .envファイルから環境変数を読み込む
 load_dotenv()
 
@@ -64,25 +70,18 @@ def generate_image(prompt):
     return image_url
 
 
-def download_and_resize_image(image_url, target_size=(800, 480)):
+def download_and_resize_image(image_url, target_size=(800, 480), crop=False, output="image"):
     """
     画像をダウンロードし、800x480にリサイズ
+    - crop: True ならパネルの縦横比に合わせて中央を切り抜く（False なら従来どおり引き伸ばす）
+    - output="buffer" ならパネルにそのまま送れる1bitバッファを返す
+    接続の使い回し・ストリーミング受信・デコーダ段階の縮小は image_download を参照
     """
-    response = requests.get(image_url)
-    image = Image.open(BytesIO(response.content))
-
-    # 画像を正確に800x480にリサイズ（アスペクト比は保持しない）
-    try:
-        # Pillow 9.0.0以降
-        from PIL.Image import Resampling
-
-        image = image.resize(target_size, Resampling.LANCZOS)
-    except (ImportError, AttributeError):
-        # 古いバージョンのPillow
-        image = image.resize(target_size, Image.LANCZOS)
+    image = image_download.download_image(image_url, target_size, crop=crop, output=output)
 
     # サイズを確認（デバッグ用）
-    print(f"リサイズ後の画像サイズ: {image.size}")
+    if output == "image":
+        print(f"リサイズ後の画像サイズ: {image.size}")
 
     return image
 
@@ -117,6 +116,8 @@ def sanitize_filename(text, max_length=500):
 def save_image(image, prompt):
     """
     画像を入力文字列と日付を含むファイル名で保存
+    保存はバックグラウンドで行い、保存先のパスをすぐに返す（media_writer を参照）
+    旧来の保存方法。main.py の画像生成は image_store.ImageStore.add で保存している
     """
     # 画像保存用のディレクトリを作成（存在しない場合）
     images_dir = os.path.join(
@@ -133,72 +134,260 @@ def save_image(image, prompt):
     # ファイルパスを作成
     filepath = os.path.join(images_dir, filename)
 
-    # 画像を保存
-    image.save(filepath)
-    print(f"画像を保存しました: {filepath}")
+    # 画像の保存はバックグラウンドで行う（表示を待たせない）
+    media_writer.get_writer().submit(image, filepath)
+    print(f"画像の保存を開始しました: {filepath}")
 
     return filepath
 
 
-def chat_with_gpt(prompt, history):
+# 応答と判定（検索の要否・質問かどうか）を1回の呼び出しでまとめて受け取る構造化モード
+# False なら従来どおり「検索の要否」「応答」「質問かどうか」の3往復で処理する
+STRUCTURED_CHAT = True
+
+# 最新情報が必要なときだけモデルが呼ぶ検索ツール
+SEARCH_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "search_latest_info",
+        "description": "最新のニュース・時事問題・天気・株価・最近の出来事・現在の状況など、"
+                       "一般的な知識では答えられない最新情報が必要なときだけ呼ぶWeb検索",
+        "parameters": {
+            "type": "object",
+            "properties": {"query": {"type": "string", "description": "検索する内容"}},
+            "required": ["query"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+# 構造化モードの応答の形式（answer を先に出力させ、生成中の文章を逐次表示できるようにする）
+REPLY_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "reply",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "answer": {"type": "string", "description": "ユーザーへの応答"},
+                "is_question": {"type": "boolean", "description": "応答がユーザーに追加の応答を求める質問なら true"},
+            },
+            "required": ["answer", "is_question"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+# 「最新情報が必要か」「質問か」をまずローカルで判定し、確信度が低いときだけ GPT に問い合わせる
+USE_LOCAL_CLASSIFIER = True
+
+# 検索が必要かの判断と並行して、Tavily の検索を先に始めておく方針
+# "always": 毎回 / "keyword": ローカル判定で必要そうなときだけ / "never": 先に始めない
+SPECULATIVE_SEARCH = "keyword"
+# "keyword" のとき、ローカル判定の「最新情報が必要」の確率がこれ以上なら先に始める
+SPECULATIVE_MIN_PROBABILITY = 0.3
+
+# 検索結果をキャッシュして、有効期間内の同じ検索では Tavily を呼ばない
+USE_SEARCH_CACHE = True
+
+# 1ターンの所要時間（方式ごと、秒）
+_turn_latency = {"structured": [], "legacy": []}
+
+
+class _JsonFieldStream:
     """
-    OpenAI API にテキストを送信し、GPT-4oの応答を取得し、その応答が質問かどうかを判定する
-    会話履歴を考慮する
+    ストリーミングで届く JSON から、1つの文字列フィールドの値を届いた分だけ取り出す
     """
-    # 1. プロンプトが最新情報を求めているかどうかを判断
-    needs_latest_info = check_if_needs_latest_info(prompt)
-    
-    # 最新情報が必要な場合のみTavily APIを使用
-    if needs_latest_info:
-        # Tavily APIを使用して、プロンプトに関連する最新情報を検索（include_answer=Trueを追加）
-        search_results = tavily_client.search(prompt, history=history, include_answer=True)
 
-        # answerからtitles_textを作成
-        titles_text = ""
-        if isinstance(search_results, dict) and 'answer' in search_results and search_results['answer']:
-            titles_text = search_results['answer']
-        else:
-            # フォールバック: answerがない場合は従来通りresultsから作成
-            titles = []
-            if isinstance(search_results, dict) and 'results' in search_results:
-                for result in search_results['results']:
-                    if 'content' in result:
-                        titles.append(result['content'])
-            
-            # タイトルのリストを文字列に変換
-            titles_text = "\n- ".join(titles)
-            if titles:
-                titles_text = "- " + titles_text
-
-        # 検索結果をプロンプトに追加
-        prompt_with_context = f"{prompt}\n\n以下の関連情報を参考にして,なるべく要約せず具体的な回答をしてください:\n{titles_text}\n\n詳細情報:\n{search_results}"
-        print(f"最新情報が必要と判断しました。検索結果タイトル:\n{titles_text}")
-    else:
-        # 最新情報が不要な場合は元のプロンプトをそのまま使用
-        prompt_with_context = prompt
-        print("最新情報は不要と判断しました。Tavily APIは使用しません。")
+    def __init__(self, field):
+        self._start = re.compile(r'"' + re.escape(field) + r'"\s*:\s*"')
+        self._raw = ""
+        self._pos = None  # 値の中の、まだ取り出していない位置
+        self.text = ""    # これまでに取り出した値
+        self.done = False
+
+    def feed(self, chunk):
+        """JSON の断片を受け取り、新たに確定した値の部分を返す"""
+        self._raw += chunk
+        if self.done:
+            return ""
+        if self._pos is None:
+            match = self._start.search(self._raw)
+            if match is None:
+                return ""
+            self._pos = match.end()
+        raw, i, out = self._raw, self._pos, []
+        while i < len(raw):
+            c = raw[i]
+            if c == '"':
+                self.done = True
+                break
+            if c != "\\":
+                out.append(c)
+                i += 1
+                continue
+            # エスケープは最後まで届いてからまとめて読む（\uXXXX のサロゲートペアも含む）
+            end = i + 2
+            if raw[i + 1:i + 2] == "u":
+                end = i + 6
+                if len(raw) >= end and 0xD800 <= int(raw[i + 2:end], 16) < 0xDC00:
+                    end = i + 12
+            if len(raw) < end:
+                break
+            out.append(json.loads('"' + raw[i:end] + '"'))
+            i = end
+        self._pos = i
+        text = "".join(out)
+        self.text += text
+        return text
+
+
+def _emit_delta(on_delta, delta):
+    """表示側へ応答の断片を渡す（表示側のエラーで応答を止めない）"""
+    try:
+        on_delta(delta)
+    except Exception as e:
+        print(f"応答の逐次処理中にエラーが発生しました: {e}")
+
 
-    # 3. 会話履歴にユーザーのプロンプトを追加
-    # システムプロンプトが含まれていない場合は追加する
+def _build_messages(history, content):
+    """会話履歴にユーザーのプロンプトを追加する（システムプロンプトがなければ先頭に入れる）"""
     if not history or history[0].get("role") != "system":
-        current_history = [{"role": "system", "content": SYSTEM_PROMPT}] + history + [{"role": "user", "content": prompt_with_context}]
+        return [{"role": "system", "content": SYSTEM_PROMPT}] + history + [{"role": "user", "content": content}]
+    return history + [{"role": "user", "content": content}]
+
+
+def tavily_search(query, history):
+    """
+    Tavily APIを使用して、プロンプトに関連する最新情報を検索（include_answer=Trueを追加）
+    同じ内容の検索は有効期間内ならキャッシュの結果を使う（search_cache を参照）
+    """
+    def search():
+        return tavily_client.search(query, history=history, include_answer=True)
+
+    if not USE_SEARCH_CACHE:
+        return search()
+    return search_cache.get_cache().get_or_search(query, search)
+
+
+def search_latest_info(prompt, history, query=None, search_results=None):
+    """
+    Tavily API で最新情報を検索し、検索結果を添えたプロンプトを返す
+    query を省略するとプロンプトそのもので検索する
+    search_results を渡すと（先に始めておいた検索の結果など）検索せずにそれを使う
+    """
+    if search_results is None:
+        search_results = tavily_search(query or prompt, history)
+
+    # answerからtitles_textを作成
+    titles_text = ""
+    if isinstance(search_results, dict) and 'answer' in search_results and search_results['answer']:
+        titles_text = search_results['answer']
     else:
-        current_history = history + [{"role": "user", "content": prompt_with_context}]
+        # フォールバック: answerがない場合は従来通りresultsから作成
+        titles = []
+        if isinstance(search_results, dict) and 'results' in search_results:
+            for result in search_results['results']:
+                if 'content' in result:
+                    titles.append(result['content'])
 
-    # 4. ユーザーのプロンプトに対する応答を取得 (会話履歴全体を渡す)
-    response_obj = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=current_history
-    )
-    gpt_response_content = response_obj.choices[0].message.content
+        # タイトルのリストを文字列に変換
+        titles_text = "\n- ".join(titles)
+        if titles:
+            titles_text = "- " + titles_text
 
-    # 3. 会話履歴にGPTの応答を追加
-    updated_history = current_history + [{"role": "assistant", "content": gpt_response_content}]
+    print(f"最新情報が必要と判断しました。検索結果タイトル:\n{titles_text}")
+    # 検索結果をプロンプトに追加
+    return f"{prompt}\n\n以下の関連情報を参考にして,なるべく要約せず具体的な回答をしてください:\n{titles_text}\n\n詳細情報:\n{search_results}"
 
-    # 4. 取得した応答が質問かどうかをGPTに判断させる
+
+_search_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="tavily")
+# 先に始めた検索の統計
+_speculation = {"launched": 0, "used": 0, "wasted": 0, "cancelled": 0, "saved_s": 0.0}
+_speculation_lock = threading.Lock()
+
+
+def _timed_search(query, history):
+    result = tavily_search(query, history)
+    return result, time.monotonic()
+
+
+def start_speculative_search(prompt, history, policy=None):
+    """
+    方針に従って、要否の判断を待たずに検索を始める
+    戻り値: use_speculative_search / discard_speculative_search に渡す値（始めなかったら None）
+    """
+    policy = policy or SPECULATIVE_SEARCH
+    if policy == "never":
+        return None
+    if policy == "keyword":
+        prediction = classifier.predict(classifier.TASK_LATEST_INFO, prompt)
+        if prediction.probability < SPECULATIVE_MIN_PROBABILITY:
+            return None
+    elif policy != "always":
+        raise ValueError(f"未対応の方針です: {policy}")
+    with _speculation_lock:
+        _speculation["launched"] += 1
+    return _search_pool.submit(_timed_search, prompt, history), time.monotonic()
+
+
+def use_speculative_search(speculation):
+    """
+    先に始めた検索の結果を返す（始めていない・失敗した場合は None）
+    要否の判断にかかった時間のうち、検索と重なった分を短縮できた時間として記録する
+    """
+    if speculation is None:
+        return None
+    future, started = speculation
+    decided = time.monotonic()
+    try:
+        result, finished = future.result()
+    except Exception as e:
+        print(f"先に始めた検索に失敗しました: {e}")
+        return None
+    # 要否が決まってから検索した場合との差（検索時間を上限とする）
+    saved = min(decided, finished) - started
+    with _speculation_lock:
+        _speculation["used"] += 1
+        _speculation["saved_s"] += saved
+    print(f"先に始めた検索の結果を使います（約{saved:.1f}秒短縮）")
+    return result
+
+
+def discard_speculative_search(speculation):
+    """不要だった検索を取り消す（すでに始まっていれば結果を捨てる）"""
+    if speculation is None:
+        return
+    future, _ = speculation
+    cancelled = future.cancel()
+    with _speculation_lock:
+        _speculation["cancelled" if cancelled else "wasted"] += 1
+
+
+def speculation_summary():
+    """先に始めた検索の統計（始めた数・使った数・無駄になった検索の数・短縮できた合計秒数）"""
+    with _speculation_lock:
+        return dict(_speculation)
+
+
+def check_if_question(text):
+    """
+    応答がユーザーに追加の応答を求める質問かどうかを判断する
+    文末などから明らかな場合はローカルで判定し、それ以外はGPTに判断させる（classifier を参照）
+    """
+    if USE_LOCAL_CLASSIFIER:
+        return classifier.classify(classifier.TASK_QUESTION, text, _ask_if_question)
+    return _ask_if_question(text)
+
+
+def _ask_if_question(text):
+    """
+    応答がユーザーに追加の応答を求める質問かどうかをGPTに判断させる
+    """
     messages_for_check = [
         {"role": "system", "content": "あなたはテキストがユーザーに追加の応答を求める質問であるかどうかを判断するAIです。「はい」か「いいえ」のみで答えてください。"},
-        {"role": "user", "content": f"以下のテキストはユーザーに追加の応答を求める質問ですか？\n\n{gpt_response_content}"}
+        {"role": "user", "content": f"以下のテキストはユーザーに追加の応答を求める質問ですか？\n\n{text}"}
     ]
     check_response_obj = client.chat.completions.create(
         model="gpt-4o-mini", # より高速なモデルでも良いかもしれない
@@ -206,9 +395,200 @@ def chat_with_gpt(prompt, history):
         max_tokens=5 # 「はい」か「いいえ」だけを期待
     )
     check_result = check_response_obj.choices[0].message.content.strip()
+    return "はい" in check_result
 
-    # 質問かどうかを判定
-    is_question = "はい" in check_result
+
+def chat_with_gpt(prompt, history, on_delta=None, structured=None, on_reset=None):
+    """
+    OpenAI API にテキストを送信し、GPT-4oの応答を取得し、その応答が質問かどうかを判定する
+    会話履歴を考慮する
+    on_delta を指定すると応答をストリーミングで受け取り、届いた断片ごとに on_delta(断片) を呼ぶ
+    structured: True なら1回の呼び出しで応答と判定を受け取る（省略時は STRUCTURED_CHAT）。
+    失敗したときは従来の3往復の方式で応答する。
+    on_reset: 構造化応答が途中まで on_delta に流れてから失敗したときに呼ぶ関数。
+    呼び出し側はここで表示・読み上げをやり直せる状態に戻し、従来の方式の応答を最初から受け取る
+    （省略時は従来の方式の応答を on_delta に流さない）。
+    戻り値: (応答, 質問かどうか, 更新された会話履歴)
+    """
+    if structured is None:
+        structured = STRUCTURED_CHAT
+    started = time.monotonic()
+    if structured:
+        sent = []
+
+        def forward(delta):
+            sent.append(delta)
+            on_delta(delta)
+
+        try:
+            result = _chat_structured(prompt, history, forward if on_delta is not None else None)
+        except Exception as e:
+            print(f"構造化応答に失敗したため、従来の方式で応答します: {e}")
+            if sent:
+                # 途中まで流した応答とは別の応答になるので、表示・読み上げをやり直してもらう
+                if on_reset is not None:
+                    on_reset()
+                else:
+                    on_delta = None  # 表示済みの途中の応答に重ねて表示しない
+        else:
+            _record_latency("structured", started)
+            return result
+    result = _chat_legacy(prompt, history, on_delta)
+    _record_latency("legacy", started)
+    return result
+
+
+def _record_latency(mode, started):
+    elapsed = time.monotonic() - started
+    _turn_latency[mode].append(elapsed)
+    print(f"応答の所要時間: {elapsed:.2f}秒（{mode}）")
+
+
+def chat_latency_summary():
+    """方式ごとの1ターンの所要時間の統計（回数・平均・最大、秒）"""
+    return {
+        mode: {"count": len(times), "avg_s": sum(times) / len(times), "max_s": max(times)}
+        for mode, times in _turn_latency.items() if times
+    }
+
+
+def _complete_reply(messages, on_delta, tools=None):
+    """
+    構造化モードの呼び出しを1回行う
+    戻り値: (応答, 質問かどうか, ツール呼び出しのリスト)。ツールが呼ばれた場合は応答は None
+    JSON が壊れていても応答の文章が取り出せていれば、質問かどうかを None にして返す
+    """
+    kwargs = {"model": "gpt-4o-mini", "messages": messages, "response_format": REPLY_FORMAT}
+    if tools:
+        kwargs["tools"] = tools
+    answer = _JsonFieldStream("answer")
+    if on_delta is None:
+        message = client.chat.completions.create(**kwargs).choices[0].message
+        raw = message.content or ""
+        tool_calls = [{"id": c.id, "name": c.function.name, "arguments": c.function.arguments}
+                      for c in message.tool_calls or []]
+        answer.feed(raw)
+    else:
+        # answer の文章は生成された部分から順に表示側へ渡す
+        parts = []
+        calls = {}
+        stream = client.chat.completions.create(stream=True, **kwargs)
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+            for call in delta.tool_calls or []:
+                entry = calls.setdefault(call.index, {"id": None, "name": "", "arguments": ""})
+                if call.id:
+                    entry["id"] = call.id
+                if call.function is not None:
+                    entry["name"] += call.function.name or ""
+                    entry["arguments"] += call.function.arguments or ""
+            if delta.content:
+                parts.append(delta.content)
+                text = answer.feed(delta.content)
+                if text:
+                    _emit_delta(on_delta, text)
+        raw = "".join(parts)
+        tool_calls = [calls[i] for i in sorted(calls)]
+
+    if tool_calls:
+        return None, None, tool_calls
+    try:
+        reply = json.loads(raw)
+        return reply["answer"], bool(reply["is_question"]), []
+    except (ValueError, KeyError, TypeError):
+        if not answer.text:
+            raise ValueError(f"応答を解釈できませんでした: {raw[:100]}")
+        return answer.text, None, []
+
+
+def _chat_structured(prompt, history, on_delta):
+    """
+    1回の呼び出しで応答と「質問かどうか」を受け取る
+    最新情報が必要ならモデルが検索ツールを呼ぶので、そのときだけ検索と2回目の呼び出しを行う
+    """
+    prompt_with_context = prompt
+    speculation = start_speculative_search(prompt, history)
+    try:
+        answer, is_question, tool_calls = _complete_reply(_build_messages(history, prompt), on_delta,
+                                                          tools=[SEARCH_TOOL])
+    except BaseException:
+        discard_speculative_search(speculation)
+        raise
+    if tool_calls:
+        try:
+            query = json.loads(tool_calls[0]["arguments"]).get("query")
+        except (ValueError, AttributeError):
+            query = None
+        search_results = use_speculative_search(speculation)
+        prompt_with_context = search_latest_info(prompt, history, query, search_results)
+        answer, is_question, _ = _complete_reply(_build_messages(history, prompt_with_context), on_delta)
+    else:
+        discard_speculative_search(speculation)
+        print("最新情報は不要と判断しました。Tavily APIは使用しません。")
+
+    if is_question is None:
+        is_question = check_if_question(answer)
+    # 会話履歴は従来の方式と同じ形（検索結果を添えたプロンプトと応答の文章）で残す
+    updated_history = _build_messages(history, prompt_with_context) + [{"role": "assistant", "content": answer}]
+    return answer, is_question, updated_history
+
+
+def _chat_legacy(prompt, history, on_delta):
+    """
+    従来の方式: 検索の要否・応答・質問かどうかをそれぞれ別の呼び出しで判断する
+    """
+    # 1. プロンプトが最新情報を求めているかどうかを判断（方針によっては検索を並行して先に始める）
+    speculation = start_speculative_search(prompt, history)
+    try:
+        needs_latest_info = check_if_needs_latest_info(prompt)
+    except BaseException:
+        discard_speculative_search(speculation)
+        raise
+
+    # 最新情報が必要な場合のみTavily APIを使用
+    if needs_latest_info:
+        prompt_with_context = search_latest_info(prompt, history, search_results=use_speculative_search(speculation))
+    else:
+        # 最新情報が不要な場合は元のプロンプトをそのまま使用
+        discard_speculative_search(speculation)
+        prompt_with_context = prompt
+        print("最新情報は不要と判断しました。Tavily APIは使用しません。")
+
+    # 2. 会話履歴にユーザーのプロンプトを追加
+    current_history = _build_messages(history, prompt_with_context)
+
+    # 3. ユーザーのプロンプトに対する応答を取得 (会話履歴全体を渡す)
+    if on_delta is None:
+        response_obj = client.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=current_history
+        )
+        gpt_response_content = response_obj.choices[0].message.content
+    else:
+        # 生成された部分から順に受け取り、表示側へ渡す
+        parts = []
+        stream = client.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=current_history,
+            stream=True
+        )
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if not delta:
+                continue
+            parts.append(delta)
+            _emit_delta(on_delta, delta)
+        gpt_response_content = "".join(parts)
+
+    # 会話履歴にGPTの応答を追加
+    updated_history = current_history + [{"role": "assistant", "content": gpt_response_content}]
+
+    # 4. 取得した応答が質問かどうかをGPTに判断させる
+    is_question = check_if_question(gpt_response_content)
 
     return gpt_response_content, is_question, updated_history
 
@@ -305,6 +685,16 @@ def generate_farewell():
 def check_if_needs_latest_info(prompt):
     """
     ユーザーのプロンプトが最新情報を求めているかどうかを判断する
+    「天気」「ニュース」などから明らかな場合はローカルで判定し、それ以外はGPTに判断させる（classifier を参照）
+    """
+    if USE_LOCAL_CLASSIFIER:
+        return classifier.classify(classifier.TASK_LATEST_INFO, prompt, _ask_if_needs_latest_info)
+    return _ask_if_needs_latest_info(prompt)
+
+
+def _ask_if_needs_latest_info(prompt):
+    """
+    ユーザーのプロンプトが最新情報を求めているかどうかをGPTに判断させる
     """
     check_prompt = f"""
     以下のユーザーの質問やプロンプトが、最新のニュース、時事問題、最近の出来事、現在の状況など、
@@ -352,4 +742,18 @@ if __name__ == "__main__":
     # テスト用: 挨拶を生成して表示
     # print(generate_greeting())
     # print(generate_farewell()) # テスト用に追加
-    pass # mainブロックは特に何もしないように変更
+
+    # 1ターンの所要時間を、従来の方式（3往復）と構造化モード（1回）で比べる
+    # python -m api.chat
+    samples = ["水の沸点は？", "しりとりしよか", "今日の大阪の天気は？"]
+    for structured in (False, True):
+        for sample in samples:
+            chat_with_gpt(sample, [], structured=structured)
+    for mode, stat in chat_latency_summary().items():
+        print(f"{mode:10s}: {stat['count']}回 平均{stat['avg_s']:.2f}秒 最大{stat['max_s']:.2f}秒")
+    cache = search_cache.get_cache().stats()
+    print(f"検索キャッシュ: ヒット率 {cache['hit_rate']:.0%} (ヒット {cache['hits']}回, 期限切れで更新 {cache['stale_hits']}回, "
+          f"ミス {cache['misses']}回, {cache['entries']}件)")
+    spec = speculation_summary()
+    print(f"先に始めた検索: {spec['launched']}回 (使用 {spec['used']}回, 無駄 {spec['wasted']}回, "
+          f"取り消し {spec['cancelled']}回, 短縮 計{spec['saved_s']:.1f}秒)")
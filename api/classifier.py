@@ -0,0 +1,321 @@
+"""
+「最新情報が必要か」「応答が質問か」のローカル判定
+
+どちらも、はい/いいえを得るためだけに LLM へ1往復していた。ほとんどは文面から明らか
+（応答の最後の文の「？」「。」、プロンプトの「株価」「今日の天気」など）なので、
+まずルールで判定し、ルールで決まらなければリポジトリに同梱した小さな文字 n-gram の
+ナイーブベイズで判定する。どちらの確信度も低いときだけ LLM に問い合わせる。
+LLM に問い合わせたときはローカルの判定と一致したかを記録し、しきい値の調整に使う
+（python -m api.classifier で集計）。
+"""
+import collections
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+import unicodedata
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULE_DIR = os.path.dirname(os.path.abspath(__file__))
+# 学習済みモデルと学習用の例文
+MODEL_PATH = os.path.join(MODULE_DIR, "classifier_model.json")
+EXAMPLES_PATH = os.path.join(MODULE_DIR, "classifier_examples.json")
+# LLM との一致を記録するログ
+AGREEMENT_LOG = os.path.join(PROJECT_ROOT, "cache", "classifier", "agreement.jsonl")
+
+TASK_LATEST_INFO = "latest_info"
+TASK_QUESTION = "question"
+
+# モデルの確率がこの範囲の外ならローカルで決める（HIGH 以上ではい、LOW 以下でいいえ）
+HIGH_CONFIDENCE = 0.95
+LOW_CONFIDENCE = 0.05
+# ローカルで決めた判定のうち、この割合は LLM にも問い合わせて一致率を測る
+AUDIT_RATE = 0.05
+# 応答が質問かどうかは文末で決まるので、末尾のこの文字数だけを見る
+QUESTION_TAIL = 30
+
+# 最新情報が必要なことがほぼ確実な言葉
+_LATEST_KEYWORDS = ("速報", "株価", "為替", "遅延", "運休")
+# 仕組みや一般的なことを聞く質問にも出てくる言葉（「天気ってどうやって決まるの」「最新の恐竜の研究は」）。
+# 時を表す言葉と一緒のときだけ必要とみなし、それ以外はモデルに任せる
+_CURRENT_NOUNS = ("ニュース", "天気", "予報", "最新", "地震", "台風", "花粉", "気温", "降水", "渋滞", "運行")
+_TIME_WORDS = ("今日", "明日", "昨日", "きのう", "あした", "さっき", "今朝", "今夜", "今週", "週末", "現在", "今",
+               "最近")
+_QUESTION_MARKS = "？?"
+_STATEMENT_ENDS = "。！!"
+_TRAILING = re.compile(r"[\s」』）)…・.〜~]+$")
+_PUNCTUATION = re.compile(r"[？?！!。、,.\s]")
+
+Prediction = collections.namedtuple("Prediction", ["label", "probability", "source"])
+
+
+def _normalize(text):
+    return unicodedata.normalize("NFKC", text).lower()
+
+
+def question_rule(text):
+    """
+    応答が質問かどうかのルール判定
+    最後の文だけを見る。「？」で終わるなら質問、「。」「！」で終わるなら質問ではない
+    （「知ってる？ 実はパンダは竹を食べるんや。」は途中に「？」があっても質問ではない）。
+    それ以外（「か」で終わる、句読点がないなど）は None（決めない）
+    """
+    body = _TRAILING.sub("", _normalize(text))
+    if not body:
+        return None
+    if body[-1] in _QUESTION_MARKS:
+        return True
+    if body[-1] in _STATEMENT_ENDS:
+        return False
+    return None
+
+
+def latest_info_rule(text):
+    """
+    プロンプトが最新情報を必要とするかのルール判定
+    株価・速報などの言葉を含めば必要。天気・ニュース・地震などは「今日」「さっき」などと
+    一緒のときだけ必要。それ以外は None（モデルに任せる）
+    """
+    body = _normalize(text)
+    if any(keyword in body for keyword in _LATEST_KEYWORDS):
+        return True
+    if any(noun in body for noun in _CURRENT_NOUNS) and any(word in body for word in _TIME_WORDS):
+        return True
+    return None
+
+
+def _features(text):
+    """文字 1-gram と 2-gram"""
+    body = _normalize(text)
+    return list(body) + [body[i:i + 2] for i in range(len(body) - 1)]
+
+
+class NaiveBayes:
+    """
+    文字 n-gram の多項ナイーブベイズ（2クラス）
+    """
+
+    def __init__(self, log_prior, log_prob, log_unseen):
+        self.log_prior = log_prior    # [いいえ, はい]
+        self.log_prob = log_prob      # 特徴 → [いいえ, はい]
+        self.log_unseen = log_unseen  # 学習データにない特徴 → [いいえ, はい]
+
+    @classmethod
+    def train(cls, examples, alpha=1.0):
+        """(文, 0/1) のリストから学習する（alpha はラプラス平滑化の係数）"""
+        counts = [collections.Counter(), collections.Counter()]
+        docs = [0, 0]
+        for text, label in examples:
+            counts[label].update(_features(text))
+            docs[label] += 1
+        vocab = set(counts[0]) | set(counts[1])
+        totals = [sum(c.values()) + alpha * (len(vocab) + 1) for c in counts]
+        log_prob = {f: [math.log((counts[k][f] + alpha) / totals[k]) for k in (0, 1)] for f in vocab}
+        log_unseen = [math.log(alpha / totals[k]) for k in (0, 1)]
+        log_prior = [math.log(docs[k] / sum(docs)) for k in (0, 1)]
+        return cls(log_prior, log_prob, log_unseen)
+
+    def probability(self, text):
+        """「はい」の確率"""
+        score = list(self.log_prior)
+        for f in _features(text):
+            lp = self.log_prob.get(f, self.log_unseen)
+            score[0] += lp[0]
+            score[1] += lp[1]
+        diff = max(min(score[0] - score[1], 50.0), -50.0)
+        return 1.0 / (1.0 + math.exp(diff))
+
+    def to_dict(self):
+        return {
+            "log_prior": self.log_prior,
+            "log_unseen": self.log_unseen,
+            "log_prob": {f: [round(v, 4) for v in lp] for f, lp in sorted(self.log_prob.items())},
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["log_prior"], data["log_prob"], data["log_unseen"])
+
+
+_RULES = {TASK_LATEST_INFO: latest_info_rule, TASK_QUESTION: question_rule}
+
+_models = None
+_models_lock = threading.Lock()
+_log_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = collections.defaultdict(collections.Counter)
+
+
+def get_models():
+    """同梱の学習済みモデルを読み込む（なければルールだけで判定する）"""
+    global _models
+    with _models_lock:
+        if _models is None:
+            try:
+                with open(MODEL_PATH, encoding="utf-8") as f:
+                    data = json.load(f)
+                _models = {task: NaiveBayes.from_dict(model) for task, model in data.items()}
+            except (OSError, ValueError, KeyError) as e:
+                print(f"判定モデルを読み込めませんでした: {e}")
+                _models = {}
+        return _models
+
+
+def _model_input(task, text):
+    """モデルに渡す部分（質問かどうかは文末だけ、最新情報の要否は記号を除いた全文）"""
+    if task == TASK_QUESTION:
+        return text[-QUESTION_TAIL:]
+    return _PUNCTUATION.sub("", text)
+
+
+def predict(task, text):
+    """
+    ローカルで判定する
+    戻り値: Prediction(label, probability, source)
+    label は True / False、確信度が低ければ None。source は "rule" / "model"
+    """
+    rule = _RULES[task](text)
+    if rule is not None:
+        return Prediction(rule, 1.0 if rule else 0.0, "rule")
+    model = get_models().get(task)
+    if model is None:
+        return Prediction(None, 0.5, "model")
+    p = model.probability(_model_input(task, text))
+    if p >= HIGH_CONFIDENCE:
+        return Prediction(True, p, "model")
+    if p <= LOW_CONFIDENCE:
+        return Prediction(False, p, "model")
+    return Prediction(None, p, "model")
+
+
+def classify(task, text, llm):
+    """
+    ローカルで判定し、確信度が低いときだけ llm(text) に問い合わせる
+    ローカルで決めた判定も AUDIT_RATE の割合で LLM に問い合わせ、一致したかを記録する。
+    この問い合わせは結果を待たないよう、バックグラウンドのスレッドで行う
+    """
+    prediction = predict(task, text)
+    if prediction.label is None:
+        answer = llm(text)
+        with _stats_lock:
+            _stats[task]["llm"] += 1
+        _log_agreement(task, text, prediction, answer)
+        return answer
+    with _stats_lock:
+        _stats[task]["local_" + prediction.source] += 1
+    if random.random() < AUDIT_RATE:
+        threading.Thread(target=_audit, args=(task, text, prediction, llm), name="classifier-audit",
+                         daemon=True).start()
+    return prediction.label
+
+
+def _audit(task, text, prediction, llm):
+    """ローカルで決めた判定を LLM にも問い合わせ、一致したかを記録する（バックグラウンド）"""
+    try:
+        answer = llm(text)
+    except Exception as e:
+        print(f"判定の確認に失敗しました: {e}")
+        return
+    with _stats_lock:
+        stats = _stats[task]
+        stats["llm"] += 1
+        stats["audited"] += 1
+        stats["agreed"] += prediction.label == answer
+    _log_agreement(task, text, prediction, answer)
+
+
+def _log_agreement(task, text, prediction, answer):
+    """LLM の判定とローカルの判定を記録する（失敗しても判定には影響させない）"""
+    record = {
+        "time": time.time(),
+        "task": task,
+        "text": text[-200:],
+        "local": prediction.label,
+        "probability": round(prediction.probability, 4),
+        "source": prediction.source,
+        "llm": answer,
+    }
+    with _log_lock:
+        try:
+            os.makedirs(os.path.dirname(AGREEMENT_LOG), exist_ok=True)
+            with open(AGREEMENT_LOG, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except OSError as e:
+            print(f"判定ログを書き込めませんでした: {e}")
+
+
+def stats():
+    """判定ごとの件数（ローカルで決めた数・LLM に問い合わせた数・一致数）"""
+    with _stats_lock:
+        return {task: dict(counter) for task, counter in _stats.items()}
+
+
+def train(examples_path=None, model_path=None):
+    """同梱の例文からモデルを学習して保存する"""
+    with open(examples_path or EXAMPLES_PATH, encoding="utf-8") as f:
+        examples = json.load(f)
+    models = {}
+    for task, rows in examples.items():
+        rows = [(_model_input(task, text), label) for text, label in rows]
+        models[task] = NaiveBayes.train(rows).to_dict()
+    with open(model_path or MODEL_PATH, "w", encoding="utf-8") as f:
+        json.dump(models, f, ensure_ascii=False, separators=(",", ":"))
+    return models
+
+
+def agreement_report(log_path=None, buckets=(0.1, 0.3, 0.5, 0.7, 0.9)):
+    """
+    一致ログを集計する
+    戻り値: {判定: {確率の区間: (件数, LLM が「はい」と答えた割合)}}
+    """
+    counts = collections.defaultdict(lambda: collections.defaultdict(lambda: [0, 0]))
+    try:
+        with open(log_path or AGREEMENT_LOG, encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                p = record["probability"]
+                label = next((f"<{b:.1f}" for b in buckets if p < b), f">={buckets[-1]:.1f}")
+                entry = counts[record["task"]][label]
+                entry[0] += 1
+                entry[1] += bool(record["llm"])
+    except OSError:
+        return {}
+    return {task: {label: (n, yes / n) for label, (n, yes) in sorted(rows.items())}
+            for task, rows in counts.items()}
+
+
+# テスト用のメイン処理
+# python -m api.classifier --train  例文からモデルを学習し直す
+# python -m api.classifier          例文ごとの交差検証（ローカルで決まる割合と正解率）と一致ログの集計
+if __name__ == "__main__":
+    import sys
+
+    if "--train" in sys.argv:
+        for task, model in train().items():
+            print(f"{task}: 特徴 {len(model['log_prob'])}個")
+        sys.exit(0)
+
+    with open(EXAMPLES_PATH, encoding="utf-8") as f:
+        examples = json.load(f)
+    for task, rows in examples.items():
+        decided = correct = 0
+        start = time.perf_counter()
+        for i, (text, label) in enumerate(rows):
+            # 1件ずつ外して学習し、外した1件を判定する
+            rest = [(_model_input(task, t), l) for j, (t, l) in enumerate(rows) if j != i]
+            _models = {task: NaiveBayes.train(rest)}
+            prediction = predict(task, text)
+            if prediction.label is not None:
+                decided += 1
+                correct += prediction.label == bool(label)
+        elapsed = (time.perf_counter() - start) * 1000 / len(rows)
+        print(f"{task:12s}: ローカルで決定 {decided}/{len(rows)}件, 正解 {correct}/{decided}件 "
+              f"(学習込み {elapsed:.2f} ms/件)")
+
+    for task, rows in agreement_report().items():
+        print(f"{task}: LLM に問い合わせた判定（ローカルの確率の区間: 件数, LLM が「はい」の割合）")
+        for label, (n, rate) in rows.items():
+            print(f"  {label}: {n}件, {rate:.0%}")
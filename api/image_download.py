@@ -0,0 +1,211 @@
+"""
+画像のダウンロードと電子ペーパー用の縮小
+
+DALL·E の画像（1792x1024 の PNG）を、使い回しの HTTP セッションでストリーミング
+しながら受け取り、デコーダ段階での縮小（JPEG は draft、それ以外は reduce）で
+データ量を減らしてから LANCZOS で 800x480 に仕上げる。パネルの縦横比に合わせた
+中央の切り抜きと、パネル形式のバッファへの直接変換も選べる。
+"""
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from PIL import Image
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 電子ペーパーのサイズ
+PANEL_SIZE = (800, 480)
+# (接続, 読み込み) のタイムアウト（秒）
+DOWNLOAD_TIMEOUT = (5, 60)
+# ストリーミングで一度に読むバイト数
+CHUNK_SIZE = 64 * 1024
+# 最終サイズのこの倍率までは reduce() で粗く縮小してから LANCZOS をかける
+REDUCING_GAP = 2.0
+
+try:
+    # Pillow 9.0.0以降
+    from PIL.Image import Resampling
+    _LANCZOS = Resampling.LANCZOS
+except (ImportError, AttributeError):
+    # 古いバージョンのPillow
+    _LANCZOS = Image.LANCZOS
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """接続を使い回す（keep-alive）プロセス共通の requests.Session を返す"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4, max_retries=2)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+
+def fetch_bytes(url, timeout=DOWNLOAD_TIMEOUT):
+    """URL の内容をストリーミングで読み込む（Content-Length があれば一度に確保する）"""
+    with get_session().get(url, stream=True, timeout=timeout) as response:
+        response.raise_for_status()
+        length = int(response.headers.get("Content-Length") or 0)
+        data = bytearray(length)
+        view = memoryview(data)
+        received = 0
+        for chunk in response.iter_content(CHUNK_SIZE):
+            end = received + len(chunk)
+            if end <= length:
+                view[received:end] = chunk
+            else:
+                # 宣言より長い（または長さ不明の）場合は末尾に足していく
+                view.release()
+                del data[received:]
+                data += chunk
+                view = memoryview(data)
+                length = len(data)
+            received = end
+        view.release()
+        del data[received:]
+    return data
+
+
+def crop_box(size, target_size=PANEL_SIZE):
+    """画像の中央からパネルと同じ縦横比の範囲を切り出す矩形 (left, top, right, bottom)"""
+    width, height = size
+    target_w, target_h = target_size
+    if width * target_h > height * target_w:
+        new_w = height * target_w / target_h
+        left = (width - new_w) / 2
+        return (left, 0, left + new_w, height)
+    new_h = width * target_h / target_w
+    top = (height - new_h) / 2
+    return (0, top, width, top + new_h)
+
+
+def decode_and_resize(data, target_size=PANEL_SIZE, crop=False, mode=None):
+    """
+    画像データをデコードして target_size に縮小する
+    - crop: True ならパネルの縦横比に合わせて中央を切り抜く（False なら従来どおり引き伸ばす）
+    - mode: "L" などを指定すると縮小の途中で変換する（データ量が減る）
+    """
+    image = Image.open(io.BytesIO(data))
+    box = crop_box(image.size, target_size) if crop else (0, 0) + image.size
+
+    # JPEG はデコーダで 1/2, 1/4, 1/8 に縮小して読み込める
+    if image.format == "JPEG":
+        scale_w = (box[2] - box[0]) / image.width
+        scale_h = (box[3] - box[1]) / image.height
+        # draft は指定サイズを下回らない範囲で最も小さい縮小率を選ぶ
+        draft_size = (int(target_size[0] / scale_w), int(target_size[1] / scale_h))
+        full_size = image.size
+        image.draft(mode or image.mode, draft_size)
+        if image.size != full_size:
+            rx, ry = image.width / full_size[0], image.height / full_size[1]
+            box = (box[0] * rx, box[1] * ry, box[2] * rx, box[3] * ry)
+
+    # 整数倍で粗く縮小（reduce）してから LANCZOS で仕上げる
+    factor = int(min((box[2] - box[0]) / target_size[0], (box[3] - box[1]) / target_size[1]) / REDUCING_GAP)
+    if factor > 1:
+        int_box = tuple(int(round(v)) for v in box)
+        image = image.reduce(factor, box=int_box)
+        box = (0, 0) + image.size
+    if mode is not None and image.mode != mode:
+        image = image.convert(mode)
+    return image.resize(target_size, _LANCZOS, box=box)
+
+
+def download_image(url, target_size=PANEL_SIZE, crop=False, output="image", dither_method=None):
+    """
+    画像をダウンロードして電子ペーパー用に縮小する
+    - output="image": PIL画像を返す
+    - output="buffer": パネルにそのまま送れる1bitバッファ（getbuffer と同じ形式）を返す
+    """
+    data = fetch_bytes(url)
+    if output == "buffer":
+        from display import dither
+        image = decode_and_resize(data, target_size, crop, mode="L")
+        return dither.dither_1bit(image, dither_method or dither.DEFAULT_METHOD, *target_size)
+    if output != "image":
+        raise ValueError(f"未対応の出力形式です: {output}")
+    return decode_and_resize(data, target_size, crop)
+
+
+def _legacy_download(url, target_size=PANEL_SIZE):
+    """ベンチマーク比較用: 従来の download_and_resize_image と同じ処理"""
+    response = requests.get(url)
+    image = Image.open(io.BytesIO(response.content))
+    return image.resize(target_size, _LANCZOS)
+
+
+def _serve_sample():
+    """ベンチマーク用に 1792x1024 の PNG をローカルで配信し、その URL を返す"""
+    import http.server
+    import numpy as np
+
+    rng = np.random.default_rng(0)
+    x = np.linspace(0, 255, 1792, dtype=np.float32)
+    pixels = np.clip(x[None, :, None] + rng.normal(0, 20, (1024, 1792, 3)), 0, 255).astype(np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(pixels, "RGB").save(buf, "PNG")
+    body = buf.getvalue()
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Type", "image/png")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}/sample.png"
+
+
+def _run_variant(variant, url):
+    """1つの方式で URL → パネル用バッファまでの時間を測る（ピークRSSはプロセス単位なので別プロセスで呼ぶ）"""
+    sys.path.insert(0, PROJECT_ROOT)
+    from display import epd_buffer
+
+    start = time.perf_counter()
+    if variant == "legacy":
+        buffer = epd_buffer.pack_1bit(_legacy_download(url))
+    elif variant == "stream":
+        buffer = epd_buffer.pack_1bit(download_image(url))
+    elif variant == "stream_crop":
+        buffer = epd_buffer.pack_1bit(download_image(url, crop=True))
+    else:
+        buffer = download_image(url, output="buffer")
+    elapsed = (time.perf_counter() - start) * 1000
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({"ms": elapsed, "peak_rss_kb": peak_kb, "bytes": len(buffer)}))
+
+
+# テスト用のメイン処理（従来方式との比較: URL 省略時はローカルで配信したサンプル画像を使う）
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == "--variant":
+        _run_variant(sys.argv[2], sys.argv[3])
+        sys.exit(0)
+
+    url = sys.argv[1] if len(sys.argv) > 1 else _serve_sample()
+    for variant in ("legacy", "stream", "stream_crop", "stream_buffer"):
+        result = subprocess.run([sys.executable, os.path.abspath(__file__), "--variant", variant, url],
+                                capture_output=True, text=True, check=True)
+        stats = json.loads(result.stdout.strip().splitlines()[-1])
+        print(f"{variant:14s}: パネル用バッファまで {stats['ms']:7.1f} ms, ピークRSS {stats['peak_rss_kb'] / 1024:6.1f} MB")
@@ -0,0 +1,224 @@
+"""
+生成画像のストア（プロンプトをキーにした DALL·E 画像のキャッシュ）
+
+同じ絵をもう一度頼まれても、これまでは毎回 DALL·E に 10〜20 秒かけて生成し直していた。
+ここでは正規化したプロンプトをキーに、元の画像・パネルにそのまま送れる1bitバッファ・
+メタデータ（SQLite の索引）を generated_images に保存し、同じ依頼にはすぐに応える。
+「新しく」などの言葉を含む依頼は保存済みの画像を使わずに生成し直す（結果は上書き）。
+合計サイズに上限があり、超えたら最も長く使われていないものから消す。
+"""
+import collections
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+from api import image_download
+from display import dither
+from storage import media_writer
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# 画像と索引の保存先（旧来の save_image と同じディレクトリ）
+STORE_DIR = os.path.join(PROJECT_ROOT, "generated_images")
+INDEX_NAME = "index.sqlite3"
+# 保存する画像の合計サイズの上限（バイト）
+MAX_STORE_BYTES = 200 * 1024 * 1024
+# この言葉を含む依頼は保存済みの画像を使わずに生成し直す
+FRESH_PHRASES = ("新しく", "新しい絵", "描き直して", "違う絵", "別の絵")
+# キーを作るときに取り除く、依頼の言い回しによる違い
+_POLITE_SUFFIXES = ("お願いします", "お願い", "ください", "下さい", "ちょうだい", "くれる", "くれない", "ほしい", "欲しい")
+_IGNORED_CHARS = re.compile(r"[\s、。，．,.!！?？「」『』（）()\"'…〜~]")
+
+ORIGINAL_SUFFIX = ".png"
+BUFFER_SUFFIX = ".epd"
+
+StoredImage = collections.namedtuple("StoredImage", ["key", "prompt", "original_path", "buffer_path", "created", "hits"])
+
+
+def normalize_prompt(prompt, fresh_phrases=FRESH_PHRASES):
+    """
+    依頼文をキャッシュのキー用に正規化する
+    全角・半角と大文字・小文字をそろえ、記号・空白・「ください」などの言い回しと
+    生成し直しの言葉を取り除く
+    """
+    text = unicodedata.normalize("NFKC", prompt).lower()
+    for phrase in fresh_phrases:
+        text = text.replace(unicodedata.normalize("NFKC", phrase).lower(), "")
+    for suffix in _POLITE_SUFFIXES:
+        text = text.replace(suffix, "")
+    return _IGNORED_CHARS.sub("", text)
+
+
+class ImageStore:
+    """
+    正規化したプロンプトをキーに、元画像とパネル用バッファを保存するストア
+    """
+
+    def __init__(self, directory=None, max_bytes=MAX_STORE_BYTES, fresh_phrases=FRESH_PHRASES):
+        self.directory = directory if directory is not None else STORE_DIR
+        self.max_bytes = max_bytes
+        self.fresh_phrases = tuple(fresh_phrases)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(self.directory, INDEX_NAME), check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS images ("
+            " key TEXT PRIMARY KEY,"
+            " prompt TEXT NOT NULL,"
+            " normalized TEXT NOT NULL,"
+            " source_url TEXT,"
+            " width INTEGER, height INTEGER,"
+            " bytes INTEGER NOT NULL,"
+            " created REAL NOT NULL,"
+            " last_used REAL NOT NULL,"
+            " hits INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS images_last_used ON images (last_used)")
+        self._db.commit()
+
+    def key(self, prompt):
+        """プロンプトのキー（正規化した文字列のハッシュ。ファイル名にも使う）"""
+        normalized = normalize_prompt(prompt, self.fresh_phrases)
+        return hashlib.sha256(normalized.encode("utf-8")).hexdigest()[:32]
+
+    def wants_fresh(self, prompt):
+        """生成し直しを求める依頼かどうか"""
+        text = unicodedata.normalize("NFKC", prompt).lower()
+        return any(unicodedata.normalize("NFKC", p).lower() in text for p in self.fresh_phrases)
+
+    def _paths(self, key):
+        return (os.path.join(self.directory, key + ORIGINAL_SUFFIX),
+                os.path.join(self.directory, key + BUFFER_SUFFIX))
+
+    def lookup(self, prompt):
+        """
+        保存済みの画像を返す。なければ（または生成し直しの依頼なら）None
+        """
+        if self.wants_fresh(prompt):
+            return None
+        key = self.key(prompt)
+        with self._lock:
+            row = self._db.execute("SELECT prompt, created, hits FROM images WHERE key = ?", (key,)).fetchone()
+            original_path, buffer_path = self._paths(key)
+            if row is not None and not (os.path.exists(original_path) and os.path.exists(buffer_path)):
+                # ファイルが消されていたら索引からも消す
+                self._delete(key)
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE images SET last_used = ?, hits = hits + 1 WHERE key = ?", (time.time(), key))
+            self._db.commit()
+            self.hits += 1
+            return StoredImage(key, row[0], original_path, buffer_path, row[1], row[2] + 1)
+
+    def add(self, prompt, original, image, source_url=None, dither_method=None, buffer=None):
+        """
+        生成した画像を保存する（同じキーがあれば上書き）
+        - original: ダウンロードした元画像のバイト列
+        - image: パネルサイズに縮小済みの PIL 画像
+        - buffer: 表示に使ったパネル用バッファ（省略時は image からディザリングして作る）
+        ファイルの書き込みはメディアライターのスレッドで行い、両方を書き終えてから索引に登録する
+        （書き終えるまでは lookup() で見つからない）。保存に失敗しても例外にしない。
+        戻り値: 保存先の StoredImage（書き込みはまだ終わっていないことがある）
+        """
+        key = self.key(prompt)
+        if buffer is None:
+            buffer = dither.dither_1bit(image, dither_method or dither.DEFAULT_METHOD)
+        buffer = bytes(buffer)
+        original_path, buffer_path = self._paths(key)
+        now = time.time()
+        writer = media_writer.get_writer()
+        futures = [writer.submit(original, original_path), writer.submit(buffer, buffer_path)]
+        row = (key, prompt, normalize_prompt(prompt, self.fresh_phrases), source_url,
+               image.width, image.height, len(original) + len(buffer), now, now)
+
+        def on_written(_):
+            # ライターは登録順に書くので、後の buffer の完了時には元画像の書き込みも終わっている
+            if any(f.exception() is not None for f in futures):
+                print(f"生成画像を保存できませんでした: {original_path}")
+                return
+            self._register(row)
+            print(f"生成画像を保存しました: {original_path}")
+
+        futures[-1].add_done_callback(on_written)
+        return StoredImage(key, prompt, original_path, buffer_path, now, 0)
+
+    def _register(self, row):
+        """書き終えた画像を索引に登録し、上限を超えた分を消す"""
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO images (key, prompt, normalized, source_url, width, height, bytes,"
+                " created, last_used, hits) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 0)",
+                row,
+            )
+            self._evict()
+            self._db.commit()
+
+    def _evict(self):
+        """合計サイズが上限を超えていたら、最も長く使われていないものから消す（最新の1枚は残す）"""
+        total = self._db.execute("SELECT COALESCE(SUM(bytes), 0) FROM images").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._db.execute("SELECT key, bytes FROM images ORDER BY last_used").fetchall()
+        for key, size in rows[:-1]:
+            if total <= self.max_bytes:
+                break
+            self._delete(key)
+            total -= size
+            self.evictions += 1
+
+    def _delete(self, key):
+        for path in self._paths(key):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self._db.execute("DELETE FROM images WHERE key = ?", (key,))
+
+    def read_buffer(self, entry):
+        """保存済みのパネル用バッファを読み込む"""
+        with open(entry.buffer_path, "rb") as f:
+            return f.read()
+
+    def load_image(self, entry, target_size=image_download.PANEL_SIZE):
+        """保存済みの元画像をパネルサイズに縮小して返す"""
+        with open(entry.original_path, "rb") as f:
+            return image_download.decode_and_resize(f.read(), target_size)
+
+    def stats(self):
+        """ヒット・ミス数などの統計"""
+        with self._lock:
+            entries, total = self._db.execute("SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM images").fetchone()
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": entries,
+                "bytes": total,
+            }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """プロセス共通の ImageStore を返す"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ImageStore()
+        return _store
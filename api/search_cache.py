@@ -0,0 +1,229 @@
+"""
+Tavily の検索結果のキャッシュ（TTL付き）
+
+天気・今日のニュース・電車の遅れなど、家族は同じことを何度も聞くが、そのたびに
+Tavily で検索し直していた。ここでは正規化した検索語（全角・半角と記号をそろえ、
+意味の変わらない助詞や「教えて」などの言い回しを除いたもの）をキーに、検索結果を SQLite に保存する。
+有効期間は内容の種類ごとに決める（天気は数十分、ニュースは数時間など）。
+期限切れでも猶予期間内なら古い結果をすぐに返し、裏で検索し直す（stale-while-revalidate）。
+件数に上限があり、超えたら最も長く使われていないものから消す。
+"""
+import datetime
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# キャッシュの保存先
+SEARCH_CACHE_PATH = os.path.join(PROJECT_ROOT, "cache", "search", "search_cache.sqlite3")
+# 保存する件数の上限
+MAX_ENTRIES = 500
+# 有効期間が切れてから、古い結果を返しつつ裏で検索し直す猶予（有効期間に対する倍率）
+STALE_FACTOR = 1.0
+
+# 種類ごとの有効期間（秒）。上から順に、言葉を含むかで種類を決める
+# 日本語は単語の境目で区切れないので、他の言葉の一部になりにくい言葉だけを並べる
+# （「ドル」だけだと「アイドル」にも一致してしまう）
+CATEGORIES = (
+    ("traffic", ("電車", "遅延", "運行", "運休", "渋滞", "通行止め", "道路状況"), 5 * 60),
+    ("market", ("株価", "為替", "円安", "円高", "ドル円", "米ドル", "ドル高", "ドル安", "日経平均"), 10 * 60),
+    ("weather", ("天気", "気温", "雨", "雪", "台風", "花粉", "予報", "暑い", "寒い", "暑さ", "寒さ"), 20 * 60),
+    ("sports", ("試合", "勝った", "負けた", "優勝", "スコア", "順位"), 60 * 60),
+    ("news", ("ニュース", "速報", "事件", "話題", "最新", "最近"), 3 * 60 * 60),
+)
+DEFAULT_CATEGORY = "general"
+DEFAULT_TTL = 12 * 60 * 60
+
+# ひらがなの表記をそろえる言葉
+_SPELLINGS = (("きょう", "今日"), ("あした", "明日"), ("きのう", "昨日"), ("こんしゅう", "今週"))
+# 日付によって答えが変わる言葉（キーにその日の日付を入れる）
+_DATED_WORDS = ("今日", "明日", "昨日", "今夜", "今朝", "今週", "週末")
+# 文末から取り除く言い回し（長いものから順に。「どうぶつ」の「どう」のように語の一部は残す）
+_REQUEST_PHRASES = ("教えてください", "教えてくれる", "教えて", "知りたい", "どうなってる", "どうですか",
+                    "ですか", "ください", "かな", "どう")
+# 内容語（漢字・カタカナ・英数字）の後ろに付いた、取り除いても意味が変わらない助詞
+# （が・に・を などは「阪神が勝った」「阪神に勝った」のように意味が変わるので残す）
+_PARTICLES = re.compile(r"(?<=[一-龯々ァ-ヶーa-z0-9])(?:って|[のは])(?![ぁ-ん])|は$")
+_IGNORED_CHARS = re.compile(r"[\s、。，．,.!！?？「」『』（）()\"'…〜~・]")
+
+
+def normalize_query(query):
+    """検索語をキャッシュのキー用に正規化する"""
+    text = unicodedata.normalize("NFKC", query).lower()
+    text = _IGNORED_CHARS.sub("", text)
+    for spelling, word in _SPELLINGS:
+        text = text.replace(spelling, word)
+    # 「どうかな」「教えてください」のように重なることがあるので、なくなるまで文末から外す
+    stripped = True
+    while stripped:
+        stripped = False
+        for phrase in _REQUEST_PHRASES:
+            if text.endswith(phrase) and len(text) > len(phrase):
+                text = text[:-len(phrase)]
+                stripped = True
+                break
+    return _PARTICLES.sub("", text)
+
+
+def category(query):
+    """検索語の種類と有効期間（秒）"""
+    text = unicodedata.normalize("NFKC", query)
+    for name, words, ttl in CATEGORIES:
+        if any(word in text for word in words):
+            return name, ttl
+    return DEFAULT_CATEGORY, DEFAULT_TTL
+
+
+def cache_key(query, today=None):
+    """キャッシュのキー（「今日」などを含む検索語は日付ごとに別のキーにする）"""
+    key = normalize_query(query)
+    if any(word in key for word in _DATED_WORDS):
+        key = f"{(today or datetime.date.today()).isoformat()}:{key}"
+    return key
+
+
+class SearchCache:
+    """
+    正規化した検索語をキーに、検索結果を有効期間付きで保存するキャッシュ
+    """
+
+    def __init__(self, path=None, max_entries=MAX_ENTRIES, stale_factor=STALE_FACTOR):
+        self.path = path if path is not None else SEARCH_CACHE_PATH
+        self.max_entries = max_entries
+        self.stale_factor = stale_factor
+        self.hits = 0          # 有効期間内の結果を返した数
+        self.stale_hits = 0    # 期限切れの結果を返して裏で検索し直した数
+        self.misses = 0        # 検索した数
+        self.refreshes = 0     # 裏で検索し直した数
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="search-refresh")
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " key TEXT PRIMARY KEY,"
+            " query TEXT NOT NULL,"
+            " category TEXT NOT NULL,"
+            " result TEXT NOT NULL,"
+            " fetched REAL NOT NULL,"
+            " expires REAL NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+        self._db.commit()
+
+    def get_or_search(self, query, search):
+        """
+        キャッシュにあればそれを、なければ search() の結果を保存して返す
+        有効期間切れでも猶予期間内なら古い結果を返し、裏で search() を呼んで更新する
+        """
+        key = cache_key(query)
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT result, fetched, expires FROM results WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                result, fetched, expires = row
+                stale_until = expires + (expires - fetched) * self.stale_factor
+                if now < stale_until:
+                    self._db.execute("UPDATE results SET last_used = ? WHERE key = ?", (now, key))
+                    self._db.commit()
+                    if now < expires:
+                        self.hits += 1
+                    else:
+                        self.stale_hits += 1
+                        self._refresh_later(key, query, search)
+                    return json.loads(result)
+            self.misses += 1
+        result = search()
+        self._store(key, query, result)
+        return result
+
+    def _refresh_later(self, key, query, search):
+        """裏で検索し直す（同じキーの更新は1つだけ）"""
+        if key in self._refreshing:
+            return
+        self._refreshing.add(key)
+        self._pool.submit(self._refresh, key, query, search)
+
+    def _refresh(self, key, query, search):
+        try:
+            result = search()
+            self._store(key, query, result)
+            with self._lock:
+                self.refreshes += 1
+        except Exception as e:
+            print(f"検索結果の更新に失敗しました: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _store(self, key, query, result):
+        """結果を保存し、上限を超えた分を古いものから消す（保存できなくても例外にしない）"""
+        try:
+            data = json.dumps(result, ensure_ascii=False)
+        except (TypeError, ValueError):
+            return
+        name, ttl = category(query)
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO results (key, query, category, result, fetched, expires, last_used)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, query, name, data, now, now + ttl, now),
+            )
+            count = self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+            if count > self.max_entries:
+                excess = count - self.max_entries
+                self._db.execute(
+                    "DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY last_used LIMIT ?)", (excess,))
+                self.evictions += excess
+            self._db.commit()
+
+    def stats(self):
+        """ヒット率などの統計"""
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+            lookups = self.hits + self.stale_hits + self.misses
+            return {
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.stale_hits) / lookups if lookups else 0.0,
+                "refreshes": self.refreshes,
+                "evictions": self.evictions,
+                "entries": entries,
+            }
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+        with self._lock:
+            self._db.close()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """プロセス共通の SearchCache を返す"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = SearchCache()
+        return _cache
+
+
+# テスト用のメイン処理（検索語の正規化と種類の確認）
+if __name__ == "__main__":
+    samples = ["今日の天気は？", "今日の天気教えて", "きょうの 天気は?", "電車遅れてる？", "最近のニュースは？",
+               "阪神が昨日勝った？", "阪神に昨日勝った？", "富士山の高さは？", "アイドルのニュース"]
+    for sample in samples:
+        name, ttl = category(sample)
+        print(f"{sample:12s} → {cache_key(sample):20s} {name:8s} 有効 {ttl // 60}分")
@@ -0,0 +1,236 @@
+"""
+生成中の応答を文ごとに読み上げる逐次読み上げ
+
+これまでは応答の全文がそろってから MP3 を合成し、WAV に変換して再生していたので、
+最初の声が出るまでに「応答の生成 + 合成 + 変換」のすべてを待っていた。
+ここでは応答の断片を受け取りながら「。！？」で文に区切り、文ごとに TTS を
+PCM（24kHz・16bit・モノラル）のストリーミングで合成して、届いた音声から順に
+1本の出力ストリームへ書き込む。後ろの文は前の文の再生中に合成しておくので、
+文と文の間に無音のすき間ができない。
+"""
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import sounddevice as sd
+from openai import OpenAI
+
+from api import tts_voice
+
+# OpenAI TTS の pcm 出力の形式
+SAMPLE_RATE = 24000
+CHANNELS = 1
+# 文の区切りとみなす文字
+SENTENCE_END = "。！？!?\n"
+# 区切りの直後に続いていれば同じ文に含める文字
+_SENTENCE_TAIL = "。！？!?」』）)"
+# これより短い文は次の文とまとめて読む（合成の回数を減らし、抑揚も自然になる）
+MIN_SENTENCE_CHARS = 6
+# 区切りが来なくても、この文字数たまったら「、」で切って読み始める
+MAX_PENDING_CHARS = 80
+# 同時に合成する文の数（再生中の文の次の文を先に合成しておく）
+PREFETCH = 2
+# 合成した音声を受け取る単位（バイト、24kHz・16bit で 100ms）
+CHUNK_BYTES = 4800
+
+_END = object()
+
+
+def find_sentence_end(text):
+    """
+    text の先頭の文の終わりの位置を返す（まだ文が終わっていなければ -1）
+    """
+    for i, c in enumerate(text):
+        if c in SENTENCE_END and len(text[:i + 1].strip()) >= MIN_SENTENCE_CHARS:
+            while i + 1 < len(text) and text[i + 1] in _SENTENCE_TAIL:
+                i += 1
+            return i
+    if len(text) >= MAX_PENDING_CHARS:
+        i = text.rfind("、")
+        return i if i > 0 else len(text) - 1
+    return -1
+
+
+class SpeechStream:
+    """
+    feed() で受け取った応答を文ごとに合成して、途切れなく読み上げる
+    finish() で残りを読み上げ終えるまで待つ
+    """
+
+    def __init__(self, client=None, prefetch=PREFETCH):
+        self._client = client if client is not None else OpenAI()
+        self._pool = ThreadPoolExecutor(max_workers=prefetch, thread_name_prefix="tts-synth")
+        self._sentences = queue.Queue()  # 読み上げる順の (文, 音声の断片のキュー)
+        self._pending = ""               # まだ文の区切りが来ていない文字
+        self._lock = threading.Lock()
+        self._closed = False
+        self._stopped = threading.Event()
+        self.spoken = 0                  # 読み上げた文の数
+        self.failed = 0                  # 合成に失敗した文の数
+        self.missed = []                 # 読み上げられなかった文（finish() の後で呼び出し側が読み上げる）
+        self.first_audio = None          # 開始から最初の音声を再生するまでの秒数
+        self._started = time.monotonic()
+        self._player = threading.Thread(target=self._play, name="tts-player", daemon=True)
+        self._player.start()
+
+    def feed(self, delta):
+        """応答の続きを受け取る（チャットのストリーミングのコールバックとして渡す）"""
+        with self._lock:
+            if self._closed or not delta:
+                return
+            self._pending += delta
+            while True:
+                cut = find_sentence_end(self._pending)
+                if cut < 0:
+                    break
+                sentence, self._pending = self._pending[:cut + 1], self._pending[cut + 1:]
+                self._speak(sentence)
+
+    def _speak(self, sentence):
+        """文の合成を依頼し、読み上げの順番に並べる"""
+        if not sentence.strip():
+            return
+        audio = queue.Queue()
+        self._sentences.put((sentence, audio))
+        self._pool.submit(self._synthesize, sentence, audio)
+
+    def _synthesize(self, sentence, audio):
+        """
+        合成スレッド: 文を PCM で合成し、届いた分から音声のキューに入れる
+        ストリーミングの合成が音声を1つも返さずに失敗したときは、通常の合成で1回だけやり直す。
+        それでも読めなかった文（途中で切れた文を含む）は missed に残す
+        """
+        received = False
+        try:
+            if self._stopped.is_set():
+                return
+            with self._client.audio.speech.with_streaming_response.create(
+                model=tts_voice.TTS_MODEL,
+                input=sentence,
+                voice=tts_voice.TTS_VOICE,
+                instructions=tts_voice.TTS_INSTRUCTIONS,
+                response_format="pcm",
+            ) as response:
+                for chunk in response.iter_bytes(CHUNK_BYTES):
+                    if self._stopped.is_set():
+                        break
+                    audio.put(chunk)
+                    received = True
+        except Exception as e:
+            print(f"読み上げの音声合成に失敗しました: {e}")
+            if received or not self._retry(sentence, audio):
+                with self._lock:
+                    self.failed += 1
+                    self.missed.append(sentence)
+        finally:
+            audio.put(_END)
+
+    def _retry(self, sentence, audio):
+        """ストリーミングを使わずに合成し直す（成功したら True）"""
+        if self._stopped.is_set():
+            return True  # 打ち切られたので読み上げなくてよい
+        try:
+            data = self._client.audio.speech.create(
+                model=tts_voice.TTS_MODEL,
+                input=sentence,
+                voice=tts_voice.TTS_VOICE,
+                instructions=tts_voice.TTS_INSTRUCTIONS,
+                response_format="pcm",
+            ).content
+        except Exception as e:
+            print(f"読み上げの音声合成をやり直しましたが失敗しました: {e}")
+            return False
+        for i in range(0, len(data), CHUNK_BYTES):
+            audio.put(data[i:i + CHUNK_BYTES])
+        return True
+
+    def _play(self):
+        """再生スレッド: 文の順に音声を1本の出力ストリームへ書き込む"""
+        stream = None
+        try:
+            while True:
+                item = self._sentences.get()
+                if item is _END:
+                    break
+                _, audio = item
+                carry = b""  # 16bit の途中で切れた断片（文の境目では持ち越さない）
+                wrote = False
+                while not self._stopped.is_set():
+                    try:
+                        chunk = audio.get(timeout=0.2)
+                    except queue.Empty:
+                        continue  # 合成を待つ（打ち切られたら抜ける）
+                    if chunk is _END:
+                        break
+                    data = carry + chunk
+                    size = len(data) & ~1
+                    carry = data[size:]
+                    if not size:
+                        continue
+                    if stream is None:
+                        stream = sd.RawOutputStream(samplerate=SAMPLE_RATE, channels=CHANNELS, dtype="int16")
+                        stream.start()
+                    stream.write(data[:size])
+                    wrote = True
+                    if self.first_audio is None:
+                        self.first_audio = time.monotonic() - self._started
+                        print(f"読み上げを開始しました（{self.first_audio:.1f}秒）")
+                if self._stopped.is_set():
+                    break
+                self.spoken += wrote
+        except Exception as e:
+            print(f"読み上げの再生中にエラーが発生しました: {e}")
+        finally:
+            if stream is not None:
+                if self._stopped.is_set():
+                    stream.abort()
+                else:
+                    stream.stop()  # 書き込んだ音声を最後まで鳴らしてから止める
+                stream.close()
+
+    def finish(self, timeout=None):
+        """
+        応答の終わりを通知し、最後まで読み上げるのを待つ
+        戻り値: 1文でも読み上げられたか（False なら呼び出し側で従来の読み上げに切り替える）
+        True でも合成に失敗した文は missed に残るので、呼び出し側で読み上げる
+        """
+        with self._lock:
+            if not self._closed:
+                self._closed = True
+                self._speak(self._pending)
+                self._pending = ""
+                self._sentences.put(_END)
+        self._player.join(timeout)
+        self._pool.shutdown(wait=False)
+        return self.first_audio is not None
+
+    def stop(self):
+        """読み上げを打ち切る（合成中の文も捨てる）"""
+        self._stopped.set()
+        with self._lock:
+            if not self._closed:
+                self._closed = True
+                self._sentences.put(_END)
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+# テスト用のメイン処理（応答が少しずつ届く状況で、最初の声が出るまでの時間を従来の方式と比べる）
+if __name__ == "__main__":
+    sample = ("まいど！今日はええ天気やなあ。こんな日は公園でボール遊びでもしたら気持ちええで。"
+              "たけまさくんは何して遊びたい？")
+
+    start = time.monotonic()
+    speech = SpeechStream()
+    for i in range(0, len(sample), 4):
+        speech.feed(sample[i:i + 4])
+        time.sleep(0.05)  # 応答の生成速度の目安（1断片あたり）
+    speech.finish()
+    streamed_first = speech.first_audio
+    streamed_total = time.monotonic() - start
+
+    start = time.monotonic()
+    tts_voice.text_to_speech(sample)
+    legacy_total = time.monotonic() - start
+    print(f"逐次読み上げ: 最初の声まで {streamed_first:.2f}秒, 読み終わりまで {streamed_total:.2f}秒")
+    print(f"従来の方式:   読み終わりまで {legacy_total:.2f}秒（最初の声は合成と変換の後）")
@@ -15,6 +15,16 @@ SOUNDS_DIR = os.path.join(PROJECT_ROOT, "sounds")
 # ディレクトリが存在しない場合は作成
 os.makedirs(SOUNDS_DIR, exist_ok=True)
 
+# 読み上げのモデル・声・話し方（tts_stream の逐次読み上げでも使う）
+TTS_MODEL = "gpt-4o-mini-tts" # 最新のTTSモデル
+TTS_VOICE = "nova"
+TTS_INSTRUCTIONS = """
+        - 日本人の関西人のような訛りを入れて、はきはきと元気に話してください。
+        - 「願いましては、○円なり…では」というような、そろばん問題の場合は、
+        ○円なり、の間毎に、5秒間隔をあけて、とてもゆっくりと発話してください。
+        
+        """
+
 def text_to_speech(text, mp3_filename=None, wav_filename=None):
     """
     OpenAIのTTS APIを使って、日本語音声を生成し、MP3をWAVに変換して再生する。
@@ -34,15 +44,10 @@ def text_to_speech(text, mp3_filename=None, wav_filename=None):
     client = OpenAI()
     
     response = client.audio.speech.create(
-        model="gpt-4o-mini-tts", # 最新のTTSモデル
+        model=TTS_MODEL,
         input=text,
-        voice="nova",
-        instructions="""
-        - 日本人の関西人のような訛りを入れて、はきはきと元気に話してください。
-        - 「願いましては、○円なり…では」というような、そろばん問題の場合は、
-        ○円なり、の間毎に、5秒間隔をあけて、とてもゆっくりと発話してください。
-        
-        """,
+        voice=TTS_VOICE,
+        instructions=TTS_INSTRUCTIONS,
         response_format="mp3",
     )
     
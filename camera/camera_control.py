@@ -9,6 +9,9 @@ sys.path.append('/home/yutapi/scripts')  # プロジェクトのルートディ
 # 音声読み上げは削除、ビープ音機能だけを残す
 import simpleaudio as sa
 import wave
+# storage パッケージを読み込めるよう、このファイルを直接実行したときもプロジェクトのルートをパスに追加
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from storage import media_writer  # 写真の保存をバックグラウンドで行う
 
 # 写真保存ディレクトリ
 PHOTOS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "photos")
@@ -74,7 +77,7 @@ def capture_photo(filename=None):
     """
     Raspberry Piカメラで写真を撮影し、指定されたファイル名で保存
     カウントダウンと撮影時にビープ音によるフィードバックを提供
-    戻り値: 保存したファイルのパスとPIL Imageオブジェクト
+    戻り値: 保存先のファイルのパスとPIL Imageオブジェクト（保存はバックグラウンドで続く）
     """
     print("カメラを準備中...")
     
@@ -135,9 +138,9 @@ def capture_photo(filename=None):
     # 写真の保存パス
     filepath = os.path.join(PHOTOS_DIR, filename)
     
-    # 写真を保存
-    img.save(filepath)
-    print(f"写真を保存しました: {filepath}")
+    # 写真の保存はバックグラウンドで行い、表示を待たせない
+    media_writer.get_writer().submit(img, filepath)
+    print(f"写真の保存を開始しました: {filepath}")
     
     return filepath, img
 
@@ -165,3 +168,6 @@ if __name__ == "__main__":
     # 電子ペーパー用にリサイズ
     img_epaper = resize_for_epaper(img)
     print(f"リサイズ後サイズ: {img_epaper.size}")
+    
+    # バックグラウンドの保存が終わるまで待ってから終了する（ワーカーはデーモンスレッドのため）
+    media_writer.shutdown()
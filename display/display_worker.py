@@ -0,0 +1,110 @@
+"""
+電子ペーパー描画用のバックグラウンドワーカー
+
+パネルの更新（ReadBusy やスリープ待ちで数秒かかる）を会話スレッドから切り離す。
+1本のワーカースレッドだけがパネルを操作し、描画ジョブを受け付ける。
+まだ描画されていないジョブがある状態で新しいジョブが来た場合、古いジョブは
+描画せずに捨てて最新のものだけを描く（古いジョブの Future は最新ジョブの完了時に
+同じ結果で完了する）。
+"""
+import logging
+import threading
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+class DisplayWorker:
+    """
+    描画ジョブを1本のスレッドで順に実行するワーカー
+    未処理のジョブは最新の1件にまとめられる。
+    """
+
+    def __init__(self, name="epd-display"):
+        self._cond = threading.Condition()
+        self._pending = None   # (func, args, kwargs, [Future, ...])
+        self._busy = False
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, func, *args, **kwargs):
+        """
+        描画ジョブを登録し、完了を表す Future を返す
+        func はワーカースレッド上で func(*args, **kwargs) として呼ばれる。
+        """
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("DisplayWorker は終了しています")
+            futures = [future]
+            if self._pending is not None:
+                # 未描画のジョブは描かずに、その Future を最新ジョブに引き継ぐ
+                logger.debug("display job superseded by a newer frame")
+                futures = self._pending[3] + futures
+            self._pending = (func, args, kwargs, futures)
+            self._cond.notify_all()
+        return future
+
+    def flush(self, timeout=None):
+        """
+        登録済みのジョブがすべて終わるまで待つ
+        戻り値: timeout 内に終わったかどうか
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: self._pending is None and not self._busy, timeout)
+
+    def shutdown(self, wait=True, timeout=None):
+        """新しいジョブの受付を止める。wait=True なら残りのジョブの完了を待つ"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if wait:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending is not None or self._closed)
+                if self._pending is None:
+                    return  # 終了要求があり、残りのジョブもない
+                func, args, kwargs, futures = self._pending
+                self._pending = None
+                self._busy = True
+
+            futures = [f for f in futures if f.set_running_or_notify_cancel()]
+            try:
+                result = func(*args, **kwargs)
+            except BaseException as e:
+                logger.exception("display job failed")
+                for f in futures:
+                    f.set_exception(e)
+            else:
+                for f in futures:
+                    f.set_result(result)
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self._cond.notify_all()
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def get_worker():
+    """プロセス共通の DisplayWorker を返す（初回呼び出し時にスレッドを起動）"""
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = DisplayWorker()
+        return _worker
+
+
+def shutdown(timeout=None):
+    """ワーカーが起動していれば、残りのジョブを描き終えてから終了させる"""
+    global _worker
+    with _worker_lock:
+        worker, _worker = _worker, None
+    if worker is not None:
+        worker.shutdown(wait=True, timeout=timeout)
@@ -0,0 +1,186 @@
+"""
+写真・生成画像用のディザリング
+
+display_image はこれまで Pillow 標準の convert("1")（Floyd–Steinberg）しか使えず、
+4階調モード向けの出力もなかった。ここでは次の方式を選べるようにし、
+どれもパネルにそのまま送れるバッファ（1bit または 4階調の2プレーン）を返す。
+
+方式と 800x480 1フレームあたりの目安（python -m display.dither で計測。
+x86 の開発機での値で、Raspberry Pi ではおおむね数倍かかる）:
+                      2値       4階調
+- "pillow":          約 4 ms   -       Pillow の C 実装の Floyd–Steinberg（従来と同じ）
+- "threshold":       約 1 ms   約 3 ms  単純なしきい値（ディザなし、文字や線画向け）
+- "bayer":           約 4 ms   約 7 ms  8x8 Bayer 行列の組織的ディザ（NumPy で一括処理）
+- "floyd_steinberg": 約 3 ms   約 10 ms Pillow の C 実装の誤差拡散（4階調は4色パレットへの quantize）
+- "atkinson":        約 60 ms  約 75 ms 誤差拡散（誤差の 3/4 だけを拡散、明るくコントラストが高い）
+"atkinson" は Pillow に実装がないため NumPy で斜めの波面ごとに処理しており、他の方式より
+一桁以上遅い（Raspberry Pi では数百 ms）。写真は "pillow" か "floyd_steinberg"、
+コントラスト重視なら "atkinson"、規則的な模様でよければ "bayer"。
+"""
+import functools
+import time
+
+import numpy as np
+from PIL import Image
+
+from display import epd_buffer
+
+METHODS = ("pillow", "threshold", "bayer", "floyd_steinberg", "atkinson")
+# display_image で指定がないときの方式（従来の表示と同じ）
+DEFAULT_METHOD = "pillow"
+
+# 8x8 Bayer 行列（0-63）
+_BAYER_8 = np.array([
+    [0, 32, 8, 40, 2, 34, 10, 42],
+    [48, 16, 56, 24, 50, 18, 58, 26],
+    [12, 44, 4, 36, 14, 46, 6, 38],
+    [60, 28, 52, 20, 62, 30, 54, 22],
+    [3, 35, 11, 43, 1, 33, 9, 41],
+    [51, 19, 59, 27, 49, 17, 57, 25],
+    [15, 47, 7, 39, 13, 45, 5, 37],
+    [63, 31, 55, 23, 61, 29, 53, 21],
+], dtype=np.float32)
+
+# 誤差拡散の係数: (dx, dy, 重み)（Floyd–Steinberg は Pillow の C 実装を使う）
+_KERNELS = {
+    "atkinson": ((1, 0, 1 / 8), (2, 0, 1 / 8), (-1, 1, 1 / 8), (0, 1, 1 / 8), (1, 1, 1 / 8), (0, 2, 1 / 8)),
+}
+
+
+def _gray(source, width, height):
+    """画像をパネルの向きのグレースケール配列（float32, 0-255）にする"""
+    image = epd_buffer.orient(epd_buffer.to_image(source), width, height)
+    if image is None:
+        raise ValueError(f"Wrong image dimensions: must be {width}x{height}")
+    return np.asarray(image.convert("L"), dtype=np.float32)
+
+
+def _bayer(gray, levels):
+    """組織的ディザ: 画素ごとに Bayer 行列のしきい値を足して量子化する"""
+    height, width = gray.shape
+    threshold = (_BAYER_8 + 0.5) / 64
+    tiled = np.tile(threshold, (height // 8 + 1, width // 8 + 1))[:height, :width]
+    codes = np.floor(gray * ((levels - 1) / 255) + tiled)
+    return np.clip(codes, 0, levels - 1).astype(np.uint8)
+
+
+def _error_diffusion(gray, levels, kernel):
+    """
+    誤差拡散（斜めの波面ごとに NumPy でまとめて処理する）
+    拡散先はどれも x + 2y が元の画素より大きいので、x + 2y が同じ画素どうしは
+    互いの結果に依存しない。そこで x + 2y = t の画素を t の順に1列ずつまとめて量子化し、
+    誤差を拡散先ごとに一括で足し込む。結果は1画素ずつ左上から処理した場合と同じになる。
+    """
+    height, width = gray.shape
+    step = 255 / (levels - 1)
+    top = levels - 1
+    depth = max(dy for _, dy, _ in kernel)
+    pad = 2  # 左右の拡散先のための余白
+    stride = width + 2 * pad
+    buf = np.zeros((height + depth, stride), dtype=np.float32)
+    buf[:height, pad:pad + width] = gray
+    flat = buf.reshape(-1)
+    codes = np.empty(height * width, dtype=np.uint8)
+    # 同じ波面の中では画素ごとに拡散先が異なるので、拡散先ごとの += は重ならない
+    offsets = [(dy * stride + dx, np.float32(w)) for dx, dy, w in kernel]
+    rows = np.arange(height)
+    for t in range(width + 2 * (height - 1)):
+        ys = rows[max(0, (t - width + 2) // 2):min(height - 1, t // 2) + 1]
+        xs = t - 2 * ys
+        index = ys * stride + xs + pad
+        v = flat[index]
+        q = np.clip(np.floor(v * (1 / step) + 0.5), 0, top)
+        e = v - q * step
+        codes[ys * width + xs] = q
+        for offset, w in offsets:
+            flat[index + offset] += e * w
+    return codes.reshape(height, width)
+
+
+def _pillow_floyd_steinberg(source, levels, width, height):
+    """Pillow の C 実装の Floyd–Steinberg（4階調は4色のパレットへの量子化）"""
+    image = epd_buffer.orient(epd_buffer.to_image(source), width, height)
+    if image is None:
+        raise ValueError(f"Wrong image dimensions: must be {width}x{height}")
+    gray = image.convert("L")
+    if levels == 2:
+        return np.asarray(gray.convert("1"), dtype=np.uint8)
+    # quantize は L 画像をそのまま返すので RGB にしてからパレットへ割り当てる
+    quantized = gray.convert("RGB").quantize(palette=_gray_palette(levels), dither=Image.Dither.FLOYDSTEINBERG)
+    return np.asarray(quantized, dtype=np.uint8)
+
+
+@functools.lru_cache(maxsize=None)
+def _gray_palette(levels):
+    """黒から白まで等間隔の levels 色のパレット画像（インデックスがそのまま階調コードになる）"""
+    palette = Image.new("P", (1, 1))
+    colors = []
+    for i in range(levels):
+        v = round(i * 255 / (levels - 1))
+        colors += [v, v, v]
+    palette.putpalette(colors)
+    return palette
+
+
+def dither_codes(source, method=DEFAULT_METHOD, levels=2,
+                 width=epd_buffer.PANEL_WIDTH, height=epd_buffer.PANEL_HEIGHT):
+    """
+    画像を量子化し、階調コードの配列（height x width, 0=黒 ... levels-1=白）を返す
+    levels は 2（白黒）か 4（4階調）
+    """
+    if levels not in (2, 4):
+        raise ValueError(f"levels は 2 か 4: {levels}")
+    if method == "pillow":
+        if levels != 2:
+            raise ValueError("pillow は2値のみ対応しています")
+        return _pillow_floyd_steinberg(source, 2, width, height)
+    if method == "floyd_steinberg":
+        return _pillow_floyd_steinberg(source, levels, width, height)
+    gray = _gray(source, width, height)
+    if method == "threshold":
+        return np.clip(np.floor(gray * ((levels - 1) / 255) + 0.5), 0, levels - 1).astype(np.uint8)
+    if method == "bayer":
+        return _bayer(gray, levels)
+    if method in _KERNELS:
+        return _error_diffusion(gray, levels, _KERNELS[method])
+    raise ValueError(f"未対応のディザリング方式です: {method}")
+
+
+def dither_1bit(source, method=DEFAULT_METHOD, width=epd_buffer.PANEL_WIDTH, height=epd_buffer.PANEL_HEIGHT):
+    """画像をディザリングし、パネル用の1bitバッファ（getbuffer と同じ形式）を返す"""
+    if method == "pillow":
+        return epd_buffer.pack_1bit(source, width, height)
+    codes = dither_codes(source, method, 2, width, height)
+    return np.packbits(codes == 0, axis=1).tobytes()
+
+
+def dither_4gray(source, method="bayer", width=epd_buffer.PANEL_WIDTH, height=epd_buffer.PANEL_HEIGHT):
+    """画像を4階調にディザリングし、display_4Gray にそのまま渡せる (0x10, 0x13) プレーンを返す"""
+    return epd_buffer.gray_code_planes(dither_codes(source, method, 4, width, height))
+
+
+# テスト用のメイン処理（800x480 の画像で方式ごとの ms/フレームを計測）
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    # なめらかなグラデーションに少しノイズを加えた写真風の画像
+    x = np.linspace(0, 255, epd_buffer.PANEL_WIDTH, dtype=np.float32)
+    y = np.linspace(0, 1, epd_buffer.PANEL_HEIGHT, dtype=np.float32)[:, None]
+    photo = np.clip(x[None, :] * (0.5 + y) + rng.normal(0, 12, (epd_buffer.PANEL_HEIGHT, epd_buffer.PANEL_WIDTH)), 0, 255)
+    image = Image.fromarray(photo.astype(np.uint8), "L")
+
+    for method in METHODS:
+        for levels in (2, 4):
+            if method == "pillow" and levels == 4:
+                continue
+            repeat = 1 if method in _KERNELS else 10
+            start = time.perf_counter()
+            for _ in range(repeat):
+                if levels == 2:
+                    dither_1bit(image, method)
+                else:
+                    dither_4gray(image, method)
+            elapsed = (time.perf_counter() - start) * 1000 / repeat
+            codes = dither_codes(image, method, levels)
+            # 元画像との平均輝度の差（階調の再現性の目安）
+            mean_error = abs(codes.mean() * 255 / (levels - 1) - photo.mean())
+            print(f"{method:16s} {levels}階調: {elapsed:7.1f} ms/フレーム  平均輝度の差 {mean_error:.1f}")
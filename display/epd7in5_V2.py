@@ -28,20 +28,74 @@
 #
 
 
+import collections
+import functools
 import logging
+import time
 from display import epdconfig
+from display import epd_buffer
 
 # Display resolution
-EPD_WIDTH       = 800
-EPD_HEIGHT      = 480
+EPD_WIDTH       = epd_buffer.PANEL_WIDTH
+EPD_HEIGHT      = epd_buffer.PANEL_HEIGHT
 
 GRAY1  = 0xff #white
 GRAY2  = 0xC0
 GRAY3  = 0x80 #gray
 GRAY4  = 0x00 #Blackest
 
+# Hard limit for a single busy period (a full refresh takes about 4 s)
+BUSY_TIMEOUT_MS = 15000
+# The BUSY pin is waited on by edge; status (0x71) is re-issued at this interval
+BUSY_POLL_MS    = 200
+
+# Label used in the busy-time statistics, by the command that started the busy period
+BUSY_LABELS = {
+    0x04: "power_on",
+    0x12: "refresh",
+    0x02: "power_off",
+}
+
 logger = logging.getLogger(__name__)
 
+class EPDBusyTimeout(TimeoutError):
+    """The controller kept BUSY low longer than BUSY_TIMEOUT_MS."""
+
+class BusyStats:
+    """Records how long each operation kept the controller busy."""
+    def __init__(self, history=100):
+        self.count = 0
+        self.timeouts = 0
+        self.total_s = 0.0
+        self.by_label = {}      # label -> [count, total seconds, max seconds]
+        self.history = collections.deque(maxlen=history)    # (label, seconds, timed_out)
+
+    def record(self, label, seconds, timed_out=False):
+        self.count += 1
+        self.total_s += seconds
+        if timed_out:
+            self.timeouts += 1
+        entry = self.by_label.setdefault(label, [0, 0.0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+        entry[2] = max(entry[2], seconds)
+        self.history.append((label, seconds, timed_out))
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "timeouts": self.timeouts,
+            "total_s": self.total_s,
+            "by_label": {
+                label: {"count": c, "avg_s": total / c, "max_s": peak}
+                for label, (c, total, peak) in self.by_label.items()
+            },
+        }
+
+@functools.lru_cache(maxsize=4)
+def _constant_plane(value, size):
+    return bytes([value]) * size
+
 class EPD:
     def __init__(self):
         self.reset_pin = epdconfig.RST_PIN
@@ -54,6 +108,12 @@ class EPD:
         self.GRAY2  = GRAY2
         self.GRAY3  = GRAY3 #gray
         self.GRAY4  = GRAY4 #Blackest
+        self.busy_stats = BusyStats()
+        self.refresh_mode = None    # set by the init_* methods
+        self._last_command = None
+        # Preallocated transfer planes, reused for every frame
+        self._old_plane = bytearray(self.width // 8 * self.height)
+        self._partial_plane = bytearray(self.width // 8 * self.height)
     
     # Hardware reset
     def reset(self):
@@ -64,80 +124,72 @@ class EPD:
         epdconfig.digital_write(self.reset_pin, 1)
         epdconfig.delay_ms(20)   
 
-    def send_command(self, command):
-        epdconfig.digital_write(self.dc_pin, 0)
-        epdconfig.digital_write(self.cs_pin, 0)
-        epdconfig.spi_writebyte([command])
-        epdconfig.digital_write(self.cs_pin, 1)
+    # Command framing: a command byte and all of its parameter bytes go out as
+    # one command transfer plus one data transfer (CS is driven by spidev).
+    def send_command(self, command, data=None):
+        self._last_command = command
+        epdconfig.spi_write_command(command, data)
 
     def send_data(self, data):
-        epdconfig.digital_write(self.dc_pin, 1)
-        epdconfig.digital_write(self.cs_pin, 0)
-        epdconfig.spi_writebyte([data])
-        epdconfig.digital_write(self.cs_pin, 1)
+        epdconfig.spi_write_data((data,))
 
     def send_data2(self, data):
-        epdconfig.digital_write(self.dc_pin, 1)
-        epdconfig.digital_write(self.cs_pin, 0)
-        epdconfig.SPI.writebytes2(data)
-        epdconfig.digital_write(self.cs_pin, 1)
-
-    def ReadBusy(self):
+        epdconfig.spi_write_data(data)
+
+    def ReadBusy(self, timeout_ms=BUSY_TIMEOUT_MS, label=None):
+        # Sleeps on the BUSY edge instead of spinning. The status command (0x71)
+        # is still re-issued every BUSY_POLL_MS in case the pin needs it.
+        # Refreshes pass their own label (the kind of refresh issued, not the last init mode).
+        if label is None:
+            label = BUSY_LABELS.get(self._last_command, "busy")
         logger.debug("e-Paper busy")
+        start = time.monotonic()
+        deadline = start + timeout_ms / 1000.0
         self.send_command(0x71)
-        busy = epdconfig.digital_read(self.busy_pin)
-        while(busy == 0):
+        while not epdconfig.digital_wait(self.busy_pin, 1, BUSY_POLL_MS / 1000.0):
+            if time.monotonic() >= deadline:
+                elapsed = time.monotonic() - start
+                self.busy_stats.record(label, elapsed, timed_out=True)
+                logger.error("e-Paper busy timeout after %.1f s (%s), resetting controller", elapsed, label)
+                # Recovery: hardware reset so the next init_* starts from a known state
+                self.reset()
+                self.refresh_mode = None
+                raise EPDBusyTimeout("e-Paper busy timeout after %.1f s (%s)" % (elapsed, label))
             self.send_command(0x71)
-            busy = epdconfig.digital_read(self.busy_pin)
+        elapsed = time.monotonic() - start
+        self.busy_stats.record(label, elapsed)
         epdconfig.delay_ms(20)
-        logger.debug("e-Paper busy release")
+        logger.debug("e-Paper busy release (%s %.3f s)", label, elapsed)
         
     def init(self):
         if (epdconfig.module_init() != 0):
             return -1
+        self.refresh_mode = "full"
         # EPD hardware init start
         self.reset()
         
-        self.send_command(0x06)     # btst
-        self.send_data(0x17)
-        self.send_data(0x17)
-        self.send_data(0x28)        # If an exception is displayed, try using 0x38
-        self.send_data(0x17)
+        # btst; if an exception is displayed, try using 0x38 as the third byte
+        self.send_command(0x06, [0x17, 0x17, 0x28, 0x17])
         
-        self.send_command(0x01)			#POWER SETTING
-        self.send_data(0x07)
-        self.send_data(0x07)    #VGH=20V,VGL=-20V
-        self.send_data(0x28)		#VDH=15V
-        self.send_data(0x17)		#VDL=-15V
+        #POWER SETTING: VGH=20V,VGL=-20V, VDH=15V, VDL=-15V
+        self.send_command(0x01, [0x07, 0x07, 0x28, 0x17])
 
         self.send_command(0x04) #POWER ON
         epdconfig.delay_ms(100)
         self.ReadBusy()
 
-        self.send_command(0X00)			#PANNEL SETTING
-        self.send_data(0x1F)   #KW-3f   KWR-2F	BWROTP 0f	BWOTP 1f
+        self.send_command(0X00, [0x1F])			#PANNEL SETTING: KW-3f   KWR-2F	BWROTP 0f	BWOTP 1f
 
-        self.send_command(0x61)        	#tres
-        self.send_data(0x03)		#source 800
-        self.send_data(0x20)
-        self.send_data(0x01)		#gate 480
-        self.send_data(0xE0)
+        self.send_command(0x61, [0x03, 0x20, 0x01, 0xE0])        	#tres: source 800, gate 480
 
-        self.send_command(0X15)
-        self.send_data(0x00)
+        self.send_command(0X15, [0x00])
 
         # If the screen appears gray, use the annotated initialization command
-        self.send_command(0X50)
-        self.send_data(0x10)
-        self.send_data(0x07)
-        # self.send_command(0X50)
-        # self.send_data(0x10)
-        # self.send_data(0x17)
-        # self.send_command(0X52)		
-        # self.send_data(0x03)
-
-        self.send_command(0X60)			#TCON SETTING
-        self.send_data(0x22)
+        self.send_command(0X50, [0x10, 0x07])
+        # self.send_command(0X50, [0x10, 0x17])
+        # self.send_command(0X52, [0x03])
+
+        self.send_command(0X60, [0x22])			#TCON SETTING
 
         # EPD hardware init end
         return 0
@@ -145,37 +197,26 @@ class EPD:
     def init_fast(self):
         if (epdconfig.module_init() != 0):
             return -1
+        self.refresh_mode = "fast"
         # EPD hardware init start
         self.reset()
         
-        self.send_command(0X00)			#PANNEL SETTING
-        self.send_data(0x1F)   #KW-3f   KWR-2F	BWROTP 0f	BWOTP 1f
+        self.send_command(0X00, [0x1F])			#PANNEL SETTING: KW-3f   KWR-2F	BWROTP 0f	BWOTP 1f
 
         # If the screen appears gray, use the annotated initialization command
-        self.send_command(0X50)
-        self.send_data(0x10)
-        self.send_data(0x07)
-        # self.send_command(0X50)
-        # self.send_data(0x10)
-        # self.send_data(0x17)
-        # self.send_command(0X52)		
-        # self.send_data(0x03)
+        self.send_command(0X50, [0x10, 0x07])
+        # self.send_command(0X50, [0x10, 0x17])
+        # self.send_command(0X52, [0x03])
 
         self.send_command(0x04) #POWER ON
         epdconfig.delay_ms(100) 
         self.ReadBusy()        #waiting for the electronic paper IC to release the idle signal
 
         #Enhanced display drive(Add 0x06 command)
-        self.send_command(0x06)			#Booster Soft Start 
-        self.send_data (0x27)
-        self.send_data (0x27)   
-        self.send_data (0x18)		
-        self.send_data (0x17)		
+        self.send_command(0x06, [0x27, 0x27, 0x18, 0x17])			#Booster Soft Start 
 
-        self.send_command(0xE0)
-        self.send_data(0x02)
-        self.send_command(0xE5)
-        self.send_data(0x5A)
+        self.send_command(0xE0, [0x02])
+        self.send_command(0xE5, [0x5A])
 
         # EPD hardware init end
         return 0
@@ -183,20 +224,18 @@ class EPD:
     def init_part(self):
         if (epdconfig.module_init() != 0):
             return -1
+        self.refresh_mode = "partial"
         # EPD hardware init start
         self.reset()
 
-        self.send_command(0X00)			#PANNEL SETTING
-        self.send_data(0x1F)   #KW-3f   KWR-2F	BWROTP 0f	BWOTP 1f
+        self.send_command(0X00, [0x1F])			#PANNEL SETTING: KW-3f   KWR-2F	BWROTP 0f	BWOTP 1f
 
         self.send_command(0x04) #POWER ON
         epdconfig.delay_ms(100) 
         self.ReadBusy()        #waiting for the electronic paper IC to release the idle signal
 
-        self.send_command(0xE0)
-        self.send_data(0x02)
-        self.send_command(0xE5)
-        self.send_data(0x6E)
+        self.send_command(0xE0, [0x02])
+        self.send_command(0xE5, [0x6E])
 
         # EPD hardware init end
         return 0
@@ -205,120 +244,62 @@ class EPD:
     def init_4Gray(self):
         if (epdconfig.module_init() != 0):
             return -1
+        self.refresh_mode = "4gray"
         # EPD hardware init start
         self.reset()
 
-        self.send_command(0X00)			#PANNEL SETTING
-        self.send_data(0x1F)   #KW-3f   KWR-2F	BWROTP 0f	BWOTP 1f
+        self.send_command(0X00, [0x1F])			#PANNEL SETTING: KW-3f   KWR-2F	BWROTP 0f	BWOTP 1f
         
-        self.send_command(0X50)
-        self.send_data(0x10)
-        self.send_data(0x07)
+        self.send_command(0X50, [0x10, 0x07])
 
         self.send_command(0x04) #POWER ON
         epdconfig.delay_ms(100) 
         self.ReadBusy()        #waiting for the electronic paper IC to release the idle signal
 
         #Enhanced display drive(Add 0x06 command)
-        self.send_command(0x06)			#Booster Soft Start 
-        self.send_data (0x27)
-        self.send_data (0x27)   
-        self.send_data (0x18)		
-        self.send_data (0x17)	
+        self.send_command(0x06, [0x27, 0x27, 0x18, 0x17])			#Booster Soft Start 
 
-        self.send_command(0xE0)
-        self.send_data(0x02)
-        self.send_command(0xE5)
-        self.send_data(0x5F)
+        self.send_command(0xE0, [0x02])
+        self.send_command(0xE5, [0x5F])
 
         # EPD hardware init end
         return 0
 
     def getbuffer(self, image):
-        img = image
-        imwidth, imheight = img.size
-        if(imwidth == self.width and imheight == self.height):
-            img = img.convert('1')
-        elif(imwidth == self.height and imheight == self.width):
-            # image has correct dimensions, but needs to be rotated
-            img = img.rotate(90, expand=True).convert('1')
-        else:
-            logger.warning("Wrong image dimensions: must be " + str(self.width) + "x" + str(self.height))
-            # return a blank buffer
-            return [0x00] * (int(self.width/8) * self.height)
-
-        buf = bytearray(img.tobytes('raw'))
-        # The bytes need to be inverted, because in the PIL world 0=black and 1=white, but
-        # in the e-paper world 0=white and 1=black.
-        for i in range(len(buf)):
-            buf[i] ^= 0xFF
-        return buf
+        # Accepts a PIL image or NumPy array in landscape or portrait orientation.
+        # Rotation, 1-bit conversion, inversion (PIL 0=black -> e-paper 1=black)
+        # and bit packing are done in a single vectorized pass.
+        return epd_buffer.pack_1bit(image, self.width, self.height)
     
     def getbuffer_4Gray(self, image):
-        # logger.debug("bufsiz = ",int(self.width/8) * self.height)
-        buf = [0xFF] * (int(self.width / 4) * self.height)
-        image_monocolor = image.convert('L')
-        imwidth, imheight = image_monocolor.size
-        pixels = image_monocolor.load()
-        i=0
-        # logger.debug("imwidth = %d, imheight = %d",imwidth,imheight)
-        if(imwidth == self.width and imheight == self.height):
-            logger.debug("Vertical")
-            for y in range(imheight):
-                for x in range(imwidth):
-                    # Set the bits for the column of pixels at the current position.
-                    if(pixels[x, y] == 0xC0):
-                        pixels[x, y] = 0x80
-                    elif (pixels[x, y] == 0x80):
-                        pixels[x, y] = 0x40
-                    i= i+1
-                    if(i%4 == 0):
-                        buf[int((x + (y * self.width))/4)] = ((pixels[x-3, y]&0xc0) | (pixels[x-2, y]&0xc0)>>2 | (pixels[x-1, y]&0xc0)>>4 | (pixels[x, y]&0xc0)>>6)
-                        
-        elif(imwidth == self.height and imheight == self.width):
-            logger.debug("Horizontal")
-            for x in range(imwidth):
-                for y in range(imheight):
-                    newx = y
-                    newy = self.height - x - 1
-                    if(pixels[x, y] == 0xC0):
-                        pixels[x, y] = 0x80
-                    elif (pixels[x, y] == 0x80):
-                        pixels[x, y] = 0x40
-                    i= i+1
-                    if(i%4 == 0):
-                        buf[int((newx + (newy * self.width))/4)] = ((pixels[x, y-3]&0xc0) | (pixels[x, y-2]&0xc0)>>2 | (pixels[x, y-1]&0xc0)>>4 | (pixels[x, y]&0xc0)>>6) 
-        return buf
+        # 2 bits per pixel, MSB first. Gray levels are mapped through a lookup
+        # table (0xC0 -> 0x80, 0x80 -> 0x40) and packed in NumPy.
+        return epd_buffer.pack_4gray(image, self.width, self.height)
+
+    def _full_refresh_label(self):
+        # A whole-frame refresh uses the fast waveform after init_fast(), the full one otherwise
+        return "refresh_fast" if self.refresh_mode == "fast" else "refresh_full"
 
     def display(self, image):
-        if(self.width % 8 == 0):
-            Width = self.width // 8
-        else:
-            Width = self.width // 8 +1
-        Height = self.height
-        image1 = [0xFF] * int(self.width * self.height / 8)
-        for j in range(Height):
-                for i in range(Width):
-                    image1[i + j * Width] = ~image[i + j * Width]
-        self.send_command(0x10)
-        self.send_data2(image1)
-
-        self.send_command(0x13)
-        self.send_data2(image)
+        # "Old data" (0x10) is the inverted frame, "new data" (0x13) is the frame itself.
+        # The inverted plane is written into a buffer that is reused across frames.
+        old_plane = epd_buffer.invert_into(image, self._old_plane)
+        self.send_command(0x10, old_plane)
+        self.send_command(0x13, image)
 
         self.send_command(0x12)
         epdconfig.delay_ms(100)
-        self.ReadBusy()
+        self.ReadBusy(label=self._full_refresh_label())
 
     def Clear(self):
-        self.send_command(0x10)
-        self.send_data2([0xFF] * int(self.width * self.height / 8))
-        self.send_command(0x13)
-        self.send_data2([0x00] * int(self.width * self.height / 8))
+        # The clear planes are constant and shared between calls
+        frame_size = self.width // 8 * self.height
+        self.send_command(0x10, _constant_plane(0xFF, frame_size))
+        self.send_command(0x13, _constant_plane(0x00, frame_size))
 
         self.send_command(0x12)
         epdconfig.delay_ms(100)
-        self.ReadBusy()
+        self.ReadBusy(label=self._full_refresh_label())
 
     def display_Partial(self, Image, Xstart, Ystart, Xend, Yend):
         if((Xstart % 8 + Xend % 8 == 8 & Xstart % 8 > Xend % 8) | Xstart % 8 + Xend % 8 == 0 | (Xend - Xstart)%8 == 0):
@@ -334,115 +315,48 @@ class EPD:
         Width = (Xend - Xstart) // 8
         Height = Yend - Ystart
 	
-        self.send_command(0x50)
-        self.send_data(0xA9)
-        self.send_data(0x07)
+        self.send_command(0x50, [0xA9, 0x07])
 
         self.send_command(0x91)		#This command makes the display enter partial mode
-        self.send_command(0x90)		#resolution setting
-        self.send_data (Xstart//256)
-        self.send_data (Xstart%256)   #x-start    
+        self.send_command(0x90, [		#resolution setting
+            Xstart//256, Xstart%256,            #x-start
+            (Xend-1)//256, (Xend-1)%256,        #x-end
+            Ystart//256, Ystart%256,            #y-start
+            (Yend-1)//256, (Yend-1)%256,        #y-end
+            0x01,
+        ])
 
-        self.send_data ((Xend-1)//256)		
-        self.send_data ((Xend-1)%256)  #x-end	
+        # Only the window (Width x Height bytes) is inverted and sent.
+        plane = epd_buffer.invert_into(epd_buffer.as_array(Image)[:Width * Height], self._partial_plane)
 
-        self.send_data (Ystart//256)  #
-        self.send_data (Ystart%256)   #y-start    
-
-        self.send_data ((Yend-1)//256)		
-        self.send_data ((Yend-1)%256)  #y-end
-        self.send_data (0x01)
-
-        image1 = [0xFF] * int(self.width * self.height / 8)
-        for j in range(Height):
-                for i in range(Width):
-                    image1[i + j * Width] = ~Image[i + j * Width]
-
-        self.send_command(0x13)   #Write Black and White image to RAM
-        self.send_data2(image1)
+        self.send_command(0x13, plane)   #Write Black and White image to RAM
 
         self.send_command(0x12)
         epdconfig.delay_ms(100)
-        self.ReadBusy()
+        self.ReadBusy(label="refresh_partial")
 
     def display_4Gray(self, image):
-        self.send_command(0x10)
-        for i in range(0, 48000):     
-            temp3=0
-            for j in range(0, 2):
-                temp1 = image[i*2+j]
-                for k in range(0, 2):
-                    temp2 = temp1&0xC0 
-                    if(temp2 == 0xC0):
-                        temp3 |= 0x00
-                    elif(temp2 == 0x00):
-                        temp3 |= 0x01  
-                    elif(temp2 == 0x80): 
-                        temp3 |= 0x01 
-                    else: #0x40
-                        temp3 |= 0x00 
-                    temp3 <<= 1	
-                    
-                    temp1 <<= 2
-                    temp2 = temp1&0xC0 
-                    if(temp2 == 0xC0): 
-                        temp3 |= 0x00
-                    elif(temp2 == 0x00): 
-                        temp3 |= 0x01
-                    elif(temp2 == 0x80):
-                        temp3 |= 0x01
-                    else :   #0x40
-                        temp3 |= 0x00	
-                    if(j!=1 or k!=1):				
-                        temp3 <<= 1
-                    temp1 <<= 2
-            self.send_data(temp3)
-            
-        self.send_command(0x13)	       
-        for i in range(0, 48000):       
-            temp3=0
-            for j in range(0, 2):
-                temp1 = image[i*2+j]
-                for k in range(0, 2):
-                    temp2 = temp1&0xC0 
-                    if(temp2 == 0xC0):
-                        temp3 |= 0x00
-                    elif(temp2 == 0x00):
-                        temp3 |= 0x01
-                    elif(temp2 == 0x80):
-                        temp3 |= 0x00
-                    else: #0x40
-                        temp3 |= 0x01 
-                    temp3 <<= 1	
-                    
-                    temp1 <<= 2
-                    temp2 = temp1&0xC0 
-                    if(temp2 == 0xC0): 
-                        temp3 |= 0x00
-                    elif(temp2 == 0x00): 
-                        temp3 |= 0x01
-                    elif(temp2 == 0x80):
-                        temp3 |= 0x00 
-                    else:    #0x40
-                            temp3 |= 0x01	
-                    if(j!=1 or k!=1):					
-                        temp3 <<= 1
-                    temp1 <<= 2
-            self.send_data(temp3)
-        
+        # image is either a getbuffer_4Gray() buffer or a ready
+        # (0x10 plane, 0x13 plane) tuple from epd_buffer.pack_4gray_planes().
+        if isinstance(image, tuple):
+            old_plane, new_plane = image
+        else:
+            old_plane, new_plane = epd_buffer.split_4gray(image)
+
+        self.send_command(0x10, old_plane)
+        self.send_command(0x13, new_plane)
+
         self.send_command(0x12)
         epdconfig.delay_ms(100)
-        self.ReadBusy()
+        self.ReadBusy(label="refresh_4gray")
 
     def sleep(self):
-        self.send_command(0x50)
-        self.send_data(0XF7)
+        self.send_command(0x50, [0XF7])
         
         self.send_command(0x02) # POWER_OFF
         self.ReadBusy()
         
-        self.send_command(0x07) # DEEP_SLEEP
-        self.send_data(0XA5)
+        self.send_command(0x07, [0XA5]) # DEEP_SLEEP
         
         epdconfig.delay_ms(2000)
         self.send_data(0XA5)
@@ -0,0 +1,62 @@
+"""
+電子ペーパーのSPI転送ベンチマーク
+
+初期化・全面更新・部分更新のそれぞれについて、送信バイト数、SPIトランザクション数、
+コマンド数、SPI転送に費やした時間と転送速度（bytes/s）を表示する。
+BUSY待ちの時間はSPI転送時間には含まれない。
+
+使い方:
+    python -m display.epd_benchmark                 # 現在のSPIクロックで計測
+    python -m display.epd_benchmark 4000000 10000000 # クロックを変えて計測
+    EPD_BACKEND=virtual EPD_VIRTUAL_TIME_SCALE=0 python -m display.epd_benchmark  # 実機なしで計測
+"""
+import sys
+import time
+
+import numpy as np
+
+from display import epdconfig
+from display import epd7in5_V2
+
+
+def _measure(label, func):
+    epdconfig.spi_reset_stats()
+    start = time.perf_counter()
+    func()
+    wall = time.perf_counter() - start
+    stats = epdconfig.spi_get_stats()
+    rate = stats["bytes"] / stats["seconds"] if stats["seconds"] else 0.0
+    print(f"  {label:<10} {stats['bytes']:>7} bytes  {stats['transactions']:>4} transactions  "
+          f"{stats['commands']:>3} commands  SPI {stats['seconds'] * 1000:7.1f} ms  "
+          f"{rate / 1000:8.1f} kB/s  (wall {wall:.2f} s)")
+    return stats
+
+
+def run(speed_hz=None):
+    if speed_hz is not None:
+        epdconfig.spi_set_speed(speed_hz)
+    # spi_speed_hz / spi_bufsiz はバックエンドの属性を読む（モジュールに写した値は初回の値のまま）
+    backend = epdconfig.get_implementation()
+    print(f"SPI clock: {backend.spi_speed_hz} Hz, chunk: {backend.spi_bufsiz} bytes")
+
+    epd = epd7in5_V2.EPD()
+    rng = np.random.default_rng(0)
+    frame = rng.integers(0, 256, epd.width // 8 * epd.height, dtype=np.uint8).tobytes()
+    window = frame[:epd.width // 8 * 64]
+
+    _measure("init", epd.init)
+    _measure("full", lambda: epd.display(frame))
+    _measure("init_part", epd.init_part)
+    _measure("partial", lambda: epd.display_Partial(window, 0, 0, epd.width, 64))
+    epd.sleep()
+    print(f"  BUSY: {epd.busy_stats.summary()['by_label']}")
+    if hasattr(epdconfig, "virtual_stats"):
+        # 仮想パネル（EPD_BACKEND=virtual）ではリフレッシュ回数も表示する
+        print(f"  refreshes: {epdconfig.virtual_stats()['refreshes']}")
+
+
+# テスト用のメイン処理
+if __name__ == "__main__":
+    speeds = [int(arg) for arg in sys.argv[1:]] or [None]
+    for speed in speeds:
+        run(speed)
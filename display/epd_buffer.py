@@ -0,0 +1,217 @@
+"""
+電子ペーパー用フレームバッファのパック処理
+
+PIL画像またはNumPy配列を受け取り、パネルにそのまま送信できる
+1bitパック済み・白黒反転済みのバッファ（bytes）に変換する。
+回転・2値化・反転・ビットパックはすべてPIL/NumPy側で行い、
+Pythonで1バイトずつ処理するループは使わない。
+"""
+import logging
+import time
+
+import numpy as np
+from PIL import Image
+
+# パネル解像度（横向き）
+PANEL_WIDTH = 800
+PANEL_HEIGHT = 480
+
+logger = logging.getLogger(__name__)
+
+try:
+    # Pillow 9.1.0以降
+    _ROTATE_90 = Image.Transpose.ROTATE_90
+except AttributeError:
+    # 古いバージョンのPillow
+    _ROTATE_90 = Image.ROTATE_90
+
+
+def to_image(source):
+    """
+    PIL画像またはNumPy配列をPIL画像に変換する
+    - bool配列: PILと同じく True=白, False=黒
+    - 2次元の数値配列: グレースケール（0=黒, 255=白）
+    - 3次元の数値配列: RGB / RGBA
+    """
+    if isinstance(source, Image.Image):
+        return source
+
+    array = np.asarray(source)
+    if array.dtype == np.bool_:
+        return Image.fromarray(array)
+    if array.dtype != np.uint8:
+        array = np.clip(array, 0, 255).astype(np.uint8)
+    return Image.fromarray(array)
+
+
+def orient(image, width=PANEL_WIDTH, height=PANEL_HEIGHT):
+    """
+    画像をパネルの向き（横向き）に揃える
+    縦向き（height x width）の画像は90度回転する。サイズが合わない場合はNoneを返す。
+    """
+    if image.size == (width, height):
+        return image
+    if image.size == (height, width):
+        return image.transpose(_ROTATE_90)
+    return None
+
+
+def pack_1bit(source, width=PANEL_WIDTH, height=PANEL_HEIGHT):
+    """
+    画像をパネル用の1bitバッファに変換する（1=黒, 0=白, MSBが左端の画素）
+    PILの '1;I' パッカーで2値化済み画像の反転とビットパックを1回で行う。
+    """
+    image = orient(to_image(source), width, height)
+    if image is None:
+        logger.warning("Wrong image dimensions: must be %dx%d", width, height)
+        # 空白（白）のバッファを返す
+        return bytes(width // 8 * height)
+
+    if image.mode != "1":
+        # グレースケール/カラーはPIL標準のディザリングで2値化
+        image = image.convert("1")
+    return image.tobytes("raw", "1;I")
+
+
+def _build_gray_code_lut():
+    """
+    L値(0-255) -> 4階調コード(0=黒, 1, 2, 3=白) の変換表
+    従来の getbuffer_4Gray と同じく 0xC0->0x80, 0x80->0x40 に寄せてから上位2bitを取る。
+    """
+    lut = np.arange(256, dtype=np.uint8)
+    lut[0xC0] = 0x80
+    lut[0x80] = 0x40
+    return lut >> 6
+
+
+_GRAY_CODE_LUT = _build_gray_code_lut()
+# 4階調コード -> 各プレーンのビット（0x10: 黒と濃いグレー, 0x13: 黒と薄いグレー）
+_GRAY_OLD_PLANE_LUT = np.array([1, 0, 1, 0], dtype=np.uint8)
+_GRAY_NEW_PLANE_LUT = np.array([1, 1, 0, 0], dtype=np.uint8)
+
+
+def gray_codes(source, width=PANEL_WIDTH, height=PANEL_HEIGHT):
+    """
+    画像を4階調コードの2次元配列（height x width）に変換する
+    サイズが合わない場合はNoneを返す。
+    """
+    image = orient(to_image(source), width, height)
+    if image is None:
+        logger.warning("Wrong image dimensions: must be %dx%d", width, height)
+        return None
+    gray = np.asarray(image.convert("L"), dtype=np.uint8)
+    return _GRAY_CODE_LUT[gray]
+
+
+def pack_gray_codes(codes):
+    """4階調コード配列を2bit/画素（MSBが左端の画素）のバッファに詰める"""
+    quads = codes.reshape(-1, 4)
+    packed = (quads[:, 0] << 6) | (quads[:, 1] << 4) | (quads[:, 2] << 2) | quads[:, 3]
+    return packed.astype(np.uint8).tobytes()
+
+
+def gray_code_planes(codes):
+    """4階調コード配列から 0x10 / 0x13 の2枚の1bitプレーンを作る"""
+    codes = codes.reshape(-1)
+    old_plane = np.packbits(_GRAY_OLD_PLANE_LUT[codes]).tobytes()
+    new_plane = np.packbits(_GRAY_NEW_PLANE_LUT[codes]).tobytes()
+    return old_plane, new_plane
+
+
+def pack_4gray(source, width=PANEL_WIDTH, height=PANEL_HEIGHT):
+    """
+    画像を4階調用の2bit/画素バッファに変換する（EPD.getbuffer_4Gray と同じ形式）
+    """
+    codes = gray_codes(source, width, height)
+    if codes is None:
+        # 空白（白）のバッファを返す
+        return b"\xff" * (width // 4 * height)
+    return pack_gray_codes(codes)
+
+
+def pack_4gray_planes(source, width=PANEL_WIDTH, height=PANEL_HEIGHT):
+    """
+    画像から4階調表示用の 0x10 / 0x13 プレーンを直接作る
+    2bitバッファを経由しないので、画像から送信データまで1回の変換で済む。
+    """
+    codes = gray_codes(source, width, height)
+    if codes is None:
+        codes = np.full((height, width), 3, dtype=np.uint8)
+    return gray_code_planes(codes)
+
+
+def split_4gray(buf):
+    """
+    2bit/画素バッファを 0x10 / 0x13 の2枚の1bitプレーンに分解する
+    """
+    packed = as_array(buf)
+    codes = np.empty((packed.size, 4), dtype=np.uint8)
+    codes[:, 0] = packed >> 6
+    codes[:, 1] = (packed >> 4) & 0x03
+    codes[:, 2] = (packed >> 2) & 0x03
+    codes[:, 3] = packed & 0x03
+    return gray_code_planes(codes)
+
+
+def as_array(data):
+    """
+    パック済みバッファ（bytes / bytearray / memoryview / list）をuint8配列として参照する
+    バッファプロトコルを持つものはコピーせずにビューを返す。
+    """
+    if isinstance(data, np.ndarray):
+        return data.reshape(-1).view(np.uint8)
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return np.frombuffer(data, dtype=np.uint8)
+    return np.asarray(data, dtype=np.int64).astype(np.uint8)
+
+
+def invert_into(data, out):
+    """
+    バッファの全ビットを反転し、事前確保済みのbytearray out の先頭に書き込む
+    戻り値は書き込んだ範囲のmemoryview（新しいバッファは確保しない）。
+    """
+    src = as_array(data)
+    length = src.size
+    if length > len(out):
+        raise ValueError(f"buffer too large: {length} > {len(out)}")
+    dst = np.frombuffer(out, dtype=np.uint8, count=length)
+    np.invert(src, out=dst)
+    return memoryview(out)[:length]
+
+
+def _legacy_getbuffer(image):
+    """ベンチマーク比較用: 従来の EPD.getbuffer と同じ処理"""
+    img = image
+    imwidth, imheight = img.size
+    if imwidth == PANEL_WIDTH and imheight == PANEL_HEIGHT:
+        img = img.convert('1')
+    elif imwidth == PANEL_HEIGHT and imheight == PANEL_WIDTH:
+        img = img.rotate(90, expand=True).convert('1')
+    buf = bytearray(img.tobytes('raw'))
+    for i in range(len(buf)):
+        buf[i] ^= 0xFF
+    return buf
+
+
+def _benchmark(func, image, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func(image)
+    elapsed = (time.perf_counter() - start) / repeat
+    return elapsed * 1000, result
+
+
+# テスト用のメイン処理（800x480フレームでのベンチマーク）
+if __name__ == "__main__":
+    repeat = 20
+    rng = np.random.default_rng(0)
+    frames = {
+        "横向き 800x480": Image.fromarray(rng.integers(0, 256, (PANEL_HEIGHT, PANEL_WIDTH), dtype=np.uint8), "L"),
+        "縦向き 480x800": Image.fromarray(rng.integers(0, 256, (PANEL_WIDTH, PANEL_HEIGHT), dtype=np.uint8), "L"),
+    }
+    frames["2値化済み 800x480"] = frames["横向き 800x480"].convert("1")
+    for name, frame in frames.items():
+        legacy_ms, legacy_buf = _benchmark(_legacy_getbuffer, frame, repeat)
+        packed_ms, packed_buf = _benchmark(pack_1bit, frame, repeat)
+        print(f"{name}: 従来 {legacy_ms:.2f} ms / 新方式 {packed_ms:.2f} ms "
+              f"({legacy_ms / packed_ms:.1f}倍), 出力一致: {bytes(legacy_buf) == packed_buf}")
@@ -1,87 +1,85 @@
-import sys
-sys.path.append('/home/yutapi/scripts')
-from auto_speaker.display import epd7in5_V2  # 使っている電子ペーパーのライブラリ
-from PIL import Image, ImageDraw, ImageFont
-import time
-from PIL import Image, ImageDraw, ImageFont
-
-def wrap_text(text, font, max_width, draw):
+from display import epd_manager  # 差分部分更新による表示管理
+from display import epd_session  # パネルの電源状態管理
+from display import display_worker  # 描画を会話スレッドから切り離すワーカー
+from display import refresh_policy  # リフレッシュモードの選択
+from display import text_layout  # 日本語テキストの折り返し（禁則処理あり）
+from display import glyph_atlas  # フォントキャッシュと1bitグリフアトラス
+from display import pager  # 長文のページ送り表示
+from display import stream_display  # 生成中の応答の逐次表示
+from display import frame_cache  # 描画済みフレームのディスクキャッシュ
+from display import dither  # 写真・生成画像のディザリング
+from PIL import Image
+
+def wrap_text(text, font, max_width, draw=None):
     """
     指定された幅に収まるように1文字ずつチェックしながらテキストを折り返す（ピクセル単位）。
+    文字ごとの送り幅はフォント単位でキャッシュされ、禁則処理も行う（text_layout を参照）。
+    draw は従来の呼び出しとの互換のために残している。
     """
-    lines = []
-    current_line = ""
-    
-    for char in text:  # 日本語は単語ではなく文字単位で処理
-        test_line = current_line + char
-        bbox = draw.textbbox((0, 0), test_line, font=font)  # 幅を取得
-        line_width = bbox[2] - bbox[0]  # x2 - x1 で幅を計算
-
-        if line_width <= max_width:
-            current_line = test_line  # 幅内ならそのまま追加
-        else:
-            lines.append(current_line)  # 幅を超えたら折り返し
-            current_line = char  # 新しい行を開始
-
-    if current_line:  # 最後の行を追加
-        lines.append(current_line)
+    return text_layout.layout_text(text, font, max_width).lines
 
-    return lines
-
-def display_text(text):
+def display_text(text, preference=None):
     """
     電子ペーパーにテキストを表示する（ピクセル単位で折り返し）
+    preference: "fastest" / "balanced" / "cleanest"（省略時はマネージャの既定値）
     """
-    epd = epd7in5_V2.EPD()  # 電子ペーパーの初期化
-    epd.init()
-
-    # 画面をクリア
-    epd.Clear()
-
-    # 画像作成（白背景）
-    image = Image.new('1', (epd.width, epd.height), 255)
-    draw = ImageDraw.Draw(image)
+    manager = epd_manager.get_manager()
+    epd = manager.epd
 
     # フォント設定（日本語対応フォント）
     font_path = "/usr/share/fonts/truetype/fonts-japanese-gothic.ttf"
     font_size = 24  # フォントサイズ
-    font = ImageFont.truetype(font_path, font_size)
-
-    # 折り返し処理（ピクセル単位）
-    max_width = epd.width - 40  # 左右に10pxずつ余白
-    wrapped_lines = wrap_text(text, font, max_width, draw)
 
-    # フォントの高さを取得（「あ」の高さを基準にする）
-    _, _, _, line_height = draw.textbbox((0, 0), "あ", font=font)  
-    line_spacing = line_height + 5  # 適切な行間
+    def render():
+        # フォントとグリフのビットマップはプロセス内で使い回す（初回はディスク上のアトラスを mmap で読む）
+        atlas = glyph_atlas.get_atlas(font_path, font_size)
 
-    # テキストを描画
-    y_position = 10
+        # 折り返し処理（ピクセル単位、禁則処理あり）
+        max_width = epd.width - 40  # 左右に10pxずつ余白
+        layout = text_layout.layout_text(text, atlas.font, max_width)
 
-    for line in wrapped_lines:
-        bbox = draw.textbbox((0, 0), line, font=font)  # 行の高さを取得
-        actual_line_height = bbox[3] - bbox[1]  # y2 - y1 で高さを計算
+        # テキストを描画（白背景のパネル形式バッファへグリフを直接書き込む）
+        # 全面更新では新しいフレームで画面全体を書き換えるため、事前の Clear() は不要
+        # 行の位置はレイアウト時に求めたものを使い、画面からはみ出す行は描かない
+        return atlas.render(layout.positions(x=24, y=10, bottom=epd.height), epd.width, epd.height)
 
-        draw.text((24, y_position), line, font=font, fill=0)
-        y_position += actual_line_height + 5  # 行の高さ+余白を適用
+    # 同じテキストを表示したことがあれば、保存済みのフレームをそのまま使う
+    key = frame_cache.text_key(text, font_path, font_size, layout="text")
+    frame = frame_cache.get_cache().get_or_render(key, render)
 
-        # 画面からはみ出したら途中で終了
-        if y_position > epd.height - actual_line_height:
-            break
+    # 画像を電子ペーパーに転送（前回と同じなら更新しない、変化が小さければ部分更新）
+    # パネルは続けて更新できるよう起こしたままにし、一定時間後に自動でスリープする
+    decision = manager.show(frame, content=refresh_policy.CONTENT_TEXT, preference=preference)
 
-    # 画像を電子ペーパーに転送
-    epd.display(epd.getbuffer(image))
-    epd.sleep()
+    print(f"電子ペーパーに表示しました！ ({decision.mode}, 約{decision.expected_ms}ms)")
+    return decision
 
-    print("電子ペーパーに表示しました！")
-
-def display_image(image):
+def display_image(image, preference=None, dither_method=None, levels=2, cache_key=None):
     """
     電子ペーパーに画像を表示
+    preference: "fastest" / "balanced" / "cleanest"（省略時はマネージャの既定値）
+    dither_method: "pillow" / "threshold" / "bayer" / "floyd_steinberg" / "atkinson"（dither.py を参照）
+    levels: 2 なら白黒、4 なら4階調モード（init_4Gray）で表示
+    cache_key: 同じ画像を何度も表示する場合の安定した識別子。指定したときだけフレームをキャッシュする
+    （撮影した写真などは指定しない。1回きりの画像でキャッシュが埋まらないように）
     """
+    if dither_method is None:
+        dither_method = dither.DEFAULT_METHOD if levels == 2 else "bayer"
     # 電子ペーパーのサイズ
     EPD_WIDTH = 800
     EPD_HEIGHT = 480
+
+    # 同じ画像を表示したことがあれば、保存済みのフレームをそのまま使う（リサイズ・2値化も不要）
+    cache = frame_cache.get_cache()
+    key = None
+    if cache_key is not None and levels == 2:
+        key = frame_cache.image_key(cache_key, layout=f"image:{dither_method}")
+    frame = cache.get(key) if key is not None else None
+    if frame is not None:
+        manager = epd_manager.get_manager()
+        decision = manager.show(frame, content=refresh_policy.CONTENT_PHOTO, preference=preference)
+        print(f"画像を電子ペーパーに表示しました！ ({decision.mode}, 約{decision.expected_ms}ms, キャッシュ)")
+        return decision
     
     # 画像サイズを確認
     if image.size != (EPD_WIDTH, EPD_HEIGHT):
@@ -93,21 +91,133 @@ def display_image(image):
         except (ImportError, AttributeError):
             image = image.resize((EPD_WIDTH, EPD_HEIGHT), Image.LANCZOS)
     
-    epd = epd7in5_V2.EPD()
-    epd.init()
-
-    # 画像をグレースケール変換 & 1bit変換（電子ペーパー用）
-    image = image.convert("L").convert("1")  
-
     # 画像サイズの最終確認
     if image.size != (EPD_WIDTH, EPD_HEIGHT):
         raise ValueError(f"Wrong image dimensions: must be {EPD_WIDTH}x{EPD_HEIGHT}")
 
-    # 画像を電子ペーパーに表示
-    epd.display(epd.getbuffer(image))
-    epd.sleep()
+    # ディザリング・反転・パックはパネル形式のバッファまで一括して行う
+    # 写真・生成画像は既定では全面更新、速度優先なら高速全面更新で表示する
+    manager = epd_manager.get_manager()
+    if levels == 4:
+        planes = dither.dither_4gray(image, dither_method)
+        decision = manager.show(planes, content=refresh_policy.CONTENT_GRAY, preference=preference)
+    else:
+        frame = dither.dither_1bit(image, dither_method)
+        if key is not None:
+            cache.put(key, frame)
+        decision = manager.show(frame, content=refresh_policy.CONTENT_PHOTO, preference=preference)
     
-    print("画像を電子ペーパーに表示しました！")
+    print(f"画像を電子ペーパーに表示しました！ ({decision.mode}, 約{decision.expected_ms}ms)")
+    return decision
+
+def display_buffer(frame, preference=None):
+    """
+    パック済みの1bitバッファ（getbuffer と同じ形式）をそのまま表示する
+    保存済みの生成画像など、ディザリングまで済んでいる画像に使う
+    """
+    manager = epd_manager.get_manager()
+    decision = manager.show(frame, content=refresh_policy.CONTENT_PHOTO, preference=preference)
+    print(f"画像を電子ペーパーに表示しました！ ({decision.mode}, 約{decision.expected_ms}ms)")
+    return decision
+
+# ページ送り中の Pager / 逐次表示中の StreamingDisplay（新しい表示を依頼したら止める）
+_active_view = None
+
+def stop_paging():
+    """ページ送り表示・逐次表示の途中なら止める"""
+    global _active_view
+    active, _active_view = _active_view, None
+    if active is not None:
+        active.stop()
+
+def display_text_paged(text, interval=pager.PAGE_INTERVAL, use_sensor=True):
+    """
+    長いテキストをページに分けて表示する（画面に収まらない部分も切り捨てない）
+    1ページ目をすぐに描画ワーカーへ依頼し、残りのページはバックグラウンドで準備する。
+    ページはタイマー（interval 秒ごと）か、超音波センサーへの手かざしで部分更新により送る。
+    戻り値: 1ページ目の表示完了で結果が入る Future
+    """
+    global _active_view
+    stop_paging()
+    manager = epd_manager.get_manager()
+    epd = manager.epd
+    atlas = glyph_atlas.get_atlas("/usr/share/fonts/truetype/fonts-japanese-gothic.ttf", 24)
+    paged = pager.Pager(text, atlas, epd.width, epd.height, manager=manager)
+    future = display_worker.get_worker().submit(paged.show_page, 0)
+    if paged.page_count > 1:
+        print(f"{paged.page_count}ページに分けて表示します")
+        distance_func = pager.sensor_distance_func() if use_sensor else None
+        paged.start(interval, distance_func)
+    _active_view = paged
+    return future
+
+def display_text_stream(interval=pager.PAGE_INTERVAL, use_sensor=True):
+    """
+    生成中の応答を逐次表示する StreamingDisplay を返す
+    応答の断片を stream.feed(delta) で渡すと、文の区切りごとに部分更新で追記される。
+    最後に stream.finish() を呼ぶと全面更新で仕上げる（長ければページ送り表示になる）。
+    """
+    global _active_view
+    stop_paging()
+    manager = epd_manager.get_manager()
+    epd = manager.epd
+    atlas = glyph_atlas.get_atlas("/usr/share/fonts/truetype/fonts-japanese-gothic.ttf", 24)
+    stream = stream_display.StreamingDisplay(atlas, epd.width, epd.height, manager=manager,
+                                             page_interval=interval, use_sensor=use_sensor)
+    _active_view = stream
+    return stream
+
+def display_text_async(text, preference=None):
+    """
+    テキスト表示をバックグラウンドの描画ワーカーに依頼し、すぐに戻る
+    戻り値: 表示完了で結果が入る Future（後から来た表示に置き換えられた場合も、その完了時に完了する）
+    """
+    stop_paging()
+    return display_worker.get_worker().submit(display_text, text, preference)
+
+def display_image_async(image, preference=None, dither_method=None, levels=2, cache_key=None):
+    """
+    画像表示をバックグラウンドの描画ワーカーに依頼し、すぐに戻る
+    戻り値: 表示完了で結果が入る Future
+    """
+    stop_paging()
+    return display_worker.get_worker().submit(display_image, image, preference, dither_method, levels, cache_key)
+
+def display_buffer_async(frame, preference=None):
+    """
+    パック済みバッファの表示をバックグラウンドの描画ワーカーに依頼し、すぐに戻る
+    戻り値: 表示完了で結果が入る Future
+    """
+    stop_paging()
+    return display_worker.get_worker().submit(display_buffer, frame, preference)
+
+# 終了時にページ送りが最後のページに届くのを待つ上限（秒）。
+# 終了処理の間は次の会話を聞けないので短くする（パネルはスリープ後も表示を保つ）
+PAGING_EXIT_TIMEOUT = 2.0
+
+def close(paging_timeout=PAGING_EXIT_TIMEOUT):
+    """
+    依頼済みの表示をすべて描き終えてから、パネルをスリープさせる（プロセス終了時に呼ぶ）
+    ページ送り中なら最後のページに届くのを最大 paging_timeout 秒だけ待ち、
+    その後は描画中の更新だけを終えて止める
+    """
+    active = _active_view
+    if active is not None:
+        active.wait_done(paging_timeout)
+    stop_paging()
+    display_worker.shutdown()
+    session = epd_session.get_session()
+    session.close()
+    cache = frame_cache.get_cache().stats()
+    if cache["hits"] or cache["misses"]:
+        print(f"フレームキャッシュ: ヒット {cache['hits']}回 / ミス {cache['misses']}回 "
+              f"({cache['entries']}枚 {cache['bytes'] // 1024}KB)")
+    busy = session.busy_summary()
+    if busy["count"]:
+        print(f"電子ペーパーのBUSY待ち: {busy['count']}回 計{busy['total_s']:.1f}秒 (タイムアウト {busy['timeouts']}回)")
+        for label, stat in busy["by_label"].items():
+            print(f"  {label}: {stat['count']}回 平均{stat['avg_s']:.2f}秒 最大{stat['max_s']:.2f}秒")
 
 if __name__ == "__main__":
     display_text("こんにちは、電子ペーパー！")
+    close()
@@ -0,0 +1,193 @@
+"""
+差分部分更新による電子ペーパー表示管理
+
+最後にパネルへ送ったフレームの控え（シャドウ）を保持し、新しいフレームとの差分から
+バイト境界に揃えた更新矩形を求めて、その範囲だけを display_Partial で書き換える。
+フレームが変わっていなければ更新そのものを省略する。部分更新 / 高速全面更新 /
+全面更新 / 4階調のどれを使うかは refresh_policy が内容の種類・変化面積・残像の
+蓄積量から決める。
+"""
+import logging
+
+import numpy as np
+
+from display import epd_buffer
+from display import epd_session
+from display import refresh_policy
+from display.epd_session import PanelState
+
+logger = logging.getLogger(__name__)
+
+# 差分のある行がこの行数以内で離れている場合は同じ矩形にまとめる
+ROW_GAP = 16
+# 1回の更新で送る矩形の最大数（超えた場合は外接矩形1つにまとめる）
+MAX_REGIONS = 2
+
+
+def _bounding_box(rects):
+    """矩形リストの外接矩形を返す"""
+    return (
+        min(r[0] for r in rects),
+        min(r[1] for r in rects),
+        max(r[2] for r in rects),
+        max(r[3] for r in rects),
+    )
+
+
+def dirty_rects(previous, current, row_gap=ROW_GAP, max_regions=MAX_REGIONS):
+    """
+    2つのパック済みフレーム（height x width/8 のuint8配列）の差分矩形を求める
+    戻り値: [(x_start, y_start, x_end, y_end), ...]
+    x は8の倍数（バイト境界）、end は含まない。差分がなければ空リスト。
+    """
+    diff = previous != current
+    rows = np.flatnonzero(diff.any(axis=1))
+    if rows.size == 0:
+        return []
+
+    # 差分のある行を、row_gap より大きい隙間で帯に分ける
+    breaks = np.flatnonzero(np.diff(rows) > row_gap)
+    starts = np.concatenate(([rows[0]], rows[breaks + 1]))
+    ends = np.concatenate((rows[breaks], [rows[-1]])) + 1
+
+    rects = []
+    for y_start, y_end in zip(starts, ends):
+        cols = np.flatnonzero(diff[y_start:y_end].any(axis=0))
+        rects.append((int(cols[0]) * 8, int(y_start), (int(cols[-1]) + 1) * 8, int(y_end)))
+
+    if len(rects) > max_regions:
+        rects = [_bounding_box(rects)]
+    return rects
+
+
+class DisplayManager:
+    """
+    最後に表示したフレームを覚えておき、差分だけを部分更新する表示マネージャ
+    """
+
+    def __init__(self, session=None, policy=None, max_regions=MAX_REGIONS,
+                 preference=refresh_policy.PREFER_BALANCED):
+        self.session = session if session is not None else epd_session.get_session()
+        self.epd = self.session.epd
+        self.policy = policy if policy is not None else refresh_policy.RefreshPolicy()
+        self.max_regions = max_regions
+        self.preference = preference  # show() で指定がないときの優先度
+        self.last_decision = None     # 直近の show() で選んだ更新内容
+        self._shadow = None           # 最後に送ったフレーム（height x width/8）
+
+    @property
+    def shadow(self):
+        """最後にパネルへ送ったフレーム（パック済みbytes）。未表示ならNone"""
+        return None if self._shadow is None else self._shadow.tobytes()
+
+    def _to_frame(self, image):
+        """PIL画像/NumPy配列/パック済みバッファを height x width/8 の配列にする"""
+        if isinstance(image, (bytes, bytearray, memoryview)):
+            frame = image
+        else:
+            frame = self.epd.getbuffer(image)
+        return epd_buffer.as_array(frame).reshape(self.epd.height, self.epd.width // 8)
+
+    def plan(self, image, content=refresh_policy.CONTENT_TEXT, preference=None, force_full=False):
+        """
+        実際には描画せず、show() が行う更新内容を返す
+        戻り値: (RefreshDecision, 矩形リスト, フレーム配列)
+        矩形リストは部分更新のときだけ入る。4階調（content="gray"）ではフレーム配列は None。
+        """
+        if force_full:
+            preference = refresh_policy.PREFER_CLEANEST
+        elif preference is None:
+            preference = self.preference
+        if content == refresh_policy.CONTENT_GRAY:
+            # 4階調は1bitのシャドウと比べられないので、差分を取らずに毎回描く
+            return self.policy.decide(content, 1.0, preference), [], None
+        current = self._to_frame(image)
+
+        rects = []
+        if self._shadow is None:
+            changed = 1.0  # 画面の内容が分からないので全体が変わったものとして扱う
+        elif np.array_equal(self._shadow, current):
+            # force_full は内容が同じでも全面更新する（残像を消すための仕上げの更新）
+            changed = 1.0 if force_full else 0.0
+        else:
+            rects = dirty_rects(self._shadow, current, max_regions=self.max_regions)
+            area = sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in rects)
+            changed = max(area / (self.epd.width * self.epd.height), 1e-6)
+
+        # スリープ後はコントローラのRAMが失われるので部分更新はできない
+        partial_available = self._shadow is not None and self.session.is_awake
+        decision = self.policy.decide(content, changed, preference, partial_available)
+        if decision.mode != "partial":
+            rects = []
+        return decision, rects, current
+
+    def show(self, image, content=refresh_policy.CONTENT_TEXT, preference=None, force_full=False):
+        """
+        フレームを表示する
+        - content: 表示内容の種類（refresh_policy.CONTENT_*）
+        - preference: "fastest" / "balanced" / "cleanest"（省略時は self.preference）
+        - force_full: True なら必ず通常の全面更新（preference="cleanest" と同じ）
+        表示後もパネルは起きたままで、セッションのアイドルタイマー経過後にスリープする。
+        戻り値: 実際に選んだ RefreshDecision（mode / expected_ms / reason）
+        """
+        with self.session.lock:
+            decision, rects, current = self.plan(image, content, preference, force_full)
+            logger.debug("refresh %s (~%d ms): %s", decision.mode, decision.expected_ms, decision.reason)
+            try:
+                if decision.mode == "skip":
+                    logger.debug("frame unchanged, refresh skipped")
+                elif decision.mode == "partial":
+                    self._refresh_partial(current, rects)
+                elif decision.mode == "4gray":
+                    self._refresh_4gray(image)
+                else:
+                    self._refresh_full(current, decision.mode)
+            except Exception:
+                # 画面の状態が分からなくなったので、次回は再初期化して全面更新する
+                self.session.invalidate()
+                self._shadow = None
+                raise
+            self.policy.record(decision.mode)
+            if decision.mode != "skip":
+                # 実測のBUSY時間で次回以降の想定所要時間を更新する
+                self.policy.calibrate(self.session.busy_summary())
+            if decision.mode == "4gray":
+                # 4階調の画面は1bitのシャドウと一致しないので、次回は差分を取らない
+                self._shadow = None
+            elif decision.mode != "skip":
+                self._shadow = current.copy()
+            self.last_decision = decision
+            self.session.release()
+        return decision
+
+    def _refresh_full(self, current, mode="full"):
+        self.session.ensure(PanelState.FAST_INIT if mode == "fast" else PanelState.INITIALIZED)
+        self.epd.display(current.tobytes())
+
+    def _refresh_partial(self, current, rects):
+        self.session.ensure(PanelState.PARTIAL_INIT)
+        for x_start, y_start, x_end, y_end in rects:
+            window = current[y_start:y_end, x_start // 8:x_end // 8]
+            logger.debug("partial refresh x=%d-%d y=%d-%d", x_start, x_end, y_start, y_end)
+            self.epd.display_Partial(window.tobytes(), x_start, y_start, x_end, y_end)
+
+    def _refresh_4gray(self, image):
+        # image は画像か、dither.dither_4gray() などで作った (0x10, 0x13) プレーン
+        planes = image if isinstance(image, tuple) else epd_buffer.pack_4gray_planes(image)
+        self.session.ensure(PanelState.GRAY4_INIT)
+        self.epd.display_4Gray(planes)
+
+    def sleep(self):
+        """アイドルタイマーを待たずにパネルをディープスリープに入れる（表示内容はシャドウとして保持）"""
+        self.session.sleep()
+
+
+_manager = None
+
+
+def get_manager():
+    """プロセス共通の DisplayManager を返す"""
+    global _manager
+    if _manager is None:
+        _manager = DisplayManager()
+    return _manager
@@ -0,0 +1,161 @@
+"""
+電子ペーパーの電源状態を管理する長寿命セッション
+
+表示のたびに init() → 表示 → sleep() を繰り返すと、sleep() だけで約4秒、
+さらに SPI/GPIO の開き直しが毎回発生する。セッションは初期化済みのパネルを
+連続した更新で使い回し、最後の更新から一定時間（IDLE_TIMEOUT）操作がなければ
+バックグラウンドでディープスリープに入れる。
+"""
+import enum
+import logging
+import threading
+
+from display import epd7in5_V2
+
+logger = logging.getLogger(__name__)
+
+# 最後の更新からディープスリープに入るまでの待ち時間（秒）
+IDLE_TIMEOUT = 60.0
+
+
+class PanelState(enum.Enum):
+    OFF = "off"                    # 一度も初期化していない
+    INITIALIZED = "initialized"    # init()（通常の全面更新）
+    FAST_INIT = "fast_init"        # init_fast()（高速全面更新）
+    PARTIAL_INIT = "partial_init"  # init_part()（部分更新）
+    GRAY4_INIT = "gray4_init"      # init_4Gray()（4階調表示）
+    DEEP_SLEEP = "deep_sleep"      # sleep() 済み。次の表示には再初期化が必要
+
+
+# 各状態に入るための初期化メソッド名
+_INIT_METHODS = {
+    PanelState.INITIALIZED: "init",
+    PanelState.FAST_INIT: "init_fast",
+    PanelState.PARTIAL_INIT: "init_part",
+    PanelState.GRAY4_INIT: "init_4Gray",
+}
+
+
+class EPDSession:
+    """
+    パネルの電源状態（OFF / 各初期化モード / DEEP_SLEEP）を管理するセッション
+    ensure() で必要なモードに遷移し、release() で使用終了を通知するとアイドルタイマーが動く。
+    """
+
+    def __init__(self, epd=None, idle_timeout=IDLE_TIMEOUT):
+        self.epd = epd if epd is not None else epd7in5_V2.EPD()
+        self.idle_timeout = idle_timeout
+        self._state = PanelState.OFF
+        self._lock = threading.RLock()
+        self._idle_timer = None
+
+    @property
+    def state(self):
+        return self._state
+
+    @property
+    def is_awake(self):
+        """パネルが初期化済み（コントローラのRAMが有効）かどうか"""
+        return self._state in _INIT_METHODS
+
+    @property
+    def lock(self):
+        """パネル操作を直列化するためのロック（ensure ～ release の間で保持する）"""
+        return self._lock
+
+    def ensure(self, state):
+        """
+        パネルを指定の初期化状態にする（既にその状態なら何もしない）
+        アイドルタイマーは止まり、release() まで自動スリープしない。
+        """
+        if state not in _INIT_METHODS:
+            raise ValueError(f"初期化状態ではありません: {state}")
+        with self._lock:
+            self._cancel_idle_timer()
+            if self._state == state:
+                return
+            logger.debug("panel state %s -> %s", self._state.value, state.value)
+            try:
+                result = getattr(self.epd, _INIT_METHODS[state])()
+            except Exception:
+                self._state = PanelState.OFF
+                raise
+            if result != 0:
+                self._state = PanelState.OFF
+                raise RuntimeError(f"電子ペーパーの初期化に失敗しました: {state.value}")
+            self._state = state
+
+    def release(self):
+        """
+        更新が終わったことを通知する
+        idle_timeout 秒以内に次の ensure() がなければディープスリープに入る。
+        idle_timeout が None の場合は自動ではスリープしない。
+        """
+        with self._lock:
+            self._cancel_idle_timer()
+            if not self.is_awake or self.idle_timeout is None:
+                return
+            if self.idle_timeout <= 0:
+                self.sleep()
+                return
+            self._idle_timer = threading.Timer(self.idle_timeout, self._on_idle)
+            self._idle_timer.daemon = True
+            self._idle_timer.start()
+
+    def sleep(self):
+        """パネルをディープスリープに入れる（初期化済みの場合のみ）"""
+        with self._lock:
+            self._cancel_idle_timer()
+            if not self.is_awake:
+                return
+            logger.debug("panel state %s -> %s", self._state.value, PanelState.DEEP_SLEEP.value)
+            try:
+                self.epd.sleep()
+            except Exception:
+                self._state = PanelState.OFF
+                raise
+            self._state = PanelState.DEEP_SLEEP
+
+    def invalidate(self):
+        """
+        パネル操作が失敗したとき（BUSYタイムアウトなど）に呼ぶ
+        コントローラの状態は不明とみなし、次の ensure() で必ず再初期化する。
+        """
+        with self._lock:
+            self._cancel_idle_timer()
+            self._state = PanelState.OFF
+
+    def busy_summary(self):
+        """ReadBusy の待ち時間の統計（モード別の回数・平均・最大）を返す"""
+        return self.epd.busy_stats.summary()
+
+    def close(self):
+        """プロセス終了時に呼ぶ: 起きていればスリープさせる"""
+        self.sleep()
+
+    def _cancel_idle_timer(self):
+        if self._idle_timer is not None:
+            self._idle_timer.cancel()
+            self._idle_timer = None
+
+    def _on_idle(self):
+        with self._lock:
+            # キャンセルと競合した場合（既に次の ensure() が走った後）は何もしない
+            if self._idle_timer is None or threading.current_thread() is not self._idle_timer:
+                return
+            self._idle_timer = None
+            logger.debug("panel idle for %.1f s, entering deep sleep", self.idle_timeout)
+            self.sleep()
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """プロセス共通の EPDSession を返す"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = EPDSession()
+        return _session
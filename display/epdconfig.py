@@ -29,16 +29,95 @@
 
 import os
 import logging
+import struct
 import sys
+import threading
 import time
-import subprocess
 
 from ctypes import *
 
 logger = logging.getLogger(__name__)
 
-
-class RaspberryPi:
+# Pin definition shared by all backends (BCM numbering). Defined at module
+# level so that creating an EPD object does not select or claim the hardware.
+RST_PIN  = 17
+DC_PIN   = 25
+CS_PIN   = 8
+BUSY_PIN = 24
+PWR_PIN  = 18
+
+# SPI clock in Hz (override with the EPD_SPI_HZ environment variable)
+SPI_SPEED_HZ = int(os.environ.get('EPD_SPI_HZ', 4000000))
+# Transfer size used when the spidev buffer limit cannot be read
+SPI_DEFAULT_BUFSIZ = 4096
+
+
+def _read_spidev_bufsiz():
+    try:
+        with open('/sys/module/spidev/parameters/bufsiz') as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return SPI_DEFAULT_BUFSIZ
+
+
+class FramedSPI:
+    """Command/data framing shared by the SPI backends.
+
+    A command byte and its parameter bytes are written as one command transfer
+    and one data transfer instead of one transfer per byte, the DC line is only
+    driven when its level changes, and large planes are streamed as
+    memoryview chunks no larger than the spidev buffer.
+    Subclasses implement _spi_transfer() and call _init_framing().
+    """
+
+    def _init_framing(self):
+        self.spi_bufsiz = _read_spidev_bufsiz()
+        self._dc_level = None
+        self.spi_reset_stats()
+
+    def _spi_transfer(self, data):
+        raise NotImplementedError
+
+    def _set_dc(self, level):
+        if self._dc_level != level:
+            self.digital_write(self.DC_PIN, level)
+            self._dc_level = level
+
+    def _write_chunks(self, data):
+        if not isinstance(data, (bytes, bytearray, memoryview)):
+            data = bytes(data)
+        view = memoryview(data).cast('B')
+        for offset in range(0, len(view), self.spi_bufsiz):
+            self._spi_transfer(view[offset:offset + self.spi_bufsiz])
+            self.spi_stats['transactions'] += 1
+        self.spi_stats['bytes'] += len(view)
+
+    def spi_write_command(self, command, data=None):
+        start = time.perf_counter()
+        self._set_dc(0)
+        self._write_chunks((command,))
+        self.spi_stats['commands'] += 1
+        if data is not None and len(data):
+            self._set_dc(1)
+            self._write_chunks(data)
+        self.spi_stats['seconds'] += time.perf_counter() - start
+
+    def spi_write_data(self, data):
+        start = time.perf_counter()
+        self._set_dc(1)
+        self._write_chunks(data)
+        self.spi_stats['seconds'] += time.perf_counter() - start
+
+    def spi_reset_stats(self):
+        # Updated in place: the dict is also exported as epdconfig.spi_stats
+        stats = self.__dict__.setdefault('spi_stats', {})
+        stats.update(bytes=0, transactions=0, commands=0, seconds=0.0)
+
+    def spi_get_stats(self):
+        return dict(self.spi_stats)
+
+
+class RaspberryPi(FramedSPI):
     # Pin definition
     RST_PIN  = 17
     DC_PIN   = 25
@@ -50,16 +129,23 @@ class RaspberryPi:
 
     def __init__(self):
         import spidev
-        import gpiozero
         
         self.SPI = spidev.SpiDev()
+        self.spi_speed_hz = SPI_SPEED_HZ
+        self._spi_open = False
+        self._init_framing()
+        self._claim_pins()
+
+    def _claim_pins(self):
+        import gpiozero
+
         self.GPIO_RST_PIN    = gpiozero.LED(self.RST_PIN)
         self.GPIO_DC_PIN     = gpiozero.LED(self.DC_PIN)
         # self.GPIO_CS_PIN     = gpiozero.LED(self.CS_PIN)
         self.GPIO_PWR_PIN    = gpiozero.LED(self.PWR_PIN)
         self.GPIO_BUSY_PIN   = gpiozero.Button(self.BUSY_PIN, pull_up = False)
+        self._dc_level = None
 
-        
 
     def digital_write(self, pin, value):
         if pin == self.RST_PIN:
@@ -95,6 +181,20 @@ class RaspberryPi:
         elif pin == self.PWR_PIN:
             return self.PWR_PIN.value
 
+    def digital_wait(self, pin, value, timeout):
+        # Block until the pin reaches value without polling (gpiozero waits on
+        # the edge event). Returns False if timeout (seconds) expires first.
+        if pin == self.BUSY_PIN:
+            if value:
+                return self.GPIO_BUSY_PIN.wait_for_press(timeout)
+            return self.GPIO_BUSY_PIN.wait_for_release(timeout)
+        deadline = time.monotonic() + timeout
+        while self.digital_read(pin) != value:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.001)
+        return True
+
     def delay_ms(self, delaytime):
         time.sleep(delaytime / 1000.0)
 
@@ -104,6 +204,14 @@ class RaspberryPi:
     def spi_writebyte2(self, data):
         self.SPI.writebytes2(data)
 
+    def _spi_transfer(self, data):
+        self.SPI.writebytes2(data)
+
+    def spi_set_speed(self, hz):
+        self.spi_speed_hz = hz
+        if self._spi_open:
+            self.SPI.max_speed_hz = hz
+
     def DEV_SPI_write(self, data):
         self.DEV_SPI.DEV_SPI_SendData(data)
 
@@ -114,6 +222,10 @@ class RaspberryPi:
         return self.DEV_SPI.DEV_SPI_ReadData()
 
     def module_init(self, cleanup=False):
+        # Pins are released by module_exit(); claim them again when the
+        # panel is woken up after deep sleep in the same process.
+        if self.GPIO_PWR_PIN.closed:
+            self._claim_pins()
         self.GPIO_PWR_PIN.on()
         
         if cleanup:
@@ -123,9 +235,10 @@ class RaspberryPi:
                 '/usr/lib',
             ]
             self.DEV_SPI = None
+            # Pointer size of this interpreter instead of forking `getconf LONG_BIT`
+            val = struct.calcsize('P') * 8
+            logging.debug("System is %d bit"%val)
             for find_dir in find_dirs:
-                val = int(os.popen('getconf LONG_BIT').read())
-                logging.debug("System is %d bit"%val)
                 if val == 64:
                     so_filename = os.path.join(find_dir, 'DEV_Config_64.so')
                 else:
@@ -134,20 +247,25 @@ class RaspberryPi:
                     self.DEV_SPI = CDLL(so_filename)
                     break
             if self.DEV_SPI is None:
-                RuntimeError('Cannot find DEV_Config.so')
+                raise RuntimeError('Cannot find DEV_Config.so')
 
             self.DEV_SPI.DEV_Module_Init()
 
-        else:
+        elif not self._spi_open:
             # SPI device, bus = 0, device = 0
             self.SPI.open(0, 0)
-            self.SPI.max_speed_hz = 4000000
+            self.SPI.max_speed_hz = self.spi_speed_hz
             self.SPI.mode = 0b00
+            self._spi_open = True
         return 0
 
     def module_exit(self, cleanup=False):
+        if self.GPIO_PWR_PIN.closed:
+            # Already released (e.g. the panel was put to sleep before exit)
+            return
         logger.debug("spi end")
         self.SPI.close()
+        self._spi_open = False
 
         self.GPIO_RST_PIN.off()
         self.GPIO_DC_PIN.off()
@@ -163,6 +281,202 @@ class RaspberryPi:
 
 
 
+class Virtual(FramedSPI):
+    """In-memory e-paper panel for running the display pipeline without hardware.
+
+    The SPI command stream is decoded into controller RAM (0x10/0x13 planes,
+    partial window 0x90/0x91), every refresh (0x12) is rendered into a
+    grayscale frame that can be saved as PNG, and BUSY stays low for the
+    typical duration of the selected refresh mode. Delays and BUSY times are
+    multiplied by EPD_VIRTUAL_TIME_SCALE (0 makes everything instantaneous).
+    """
+    # Pin definition (same numbering as the Raspberry Pi HAT)
+    RST_PIN  = 17
+    DC_PIN   = 25
+    CS_PIN   = 8
+    BUSY_PIN = 24
+    PWR_PIN  = 18
+
+    WIDTH  = 800
+    HEIGHT = 480
+
+    # Typical BUSY durations in ms, by refresh mode / operation
+    BUSY_MS = {
+        'full': 3800,
+        'fast': 1500,
+        'partial': 600,
+        '4gray': 2300,
+        'power_on': 100,
+        'power_off': 80,
+    }
+    # 0xE5 values written by the init_* sequences
+    MODE_BY_E5 = {0x5A: 'fast', 0x6E: 'partial', 0x5F: '4gray'}
+    # Rendered gray level for each 4-gray code (black, dark gray, light gray, white)
+    GRAY_LEVELS = (0x00, 0x80, 0xC0, 0xFF)
+
+    def __init__(self, time_scale=None, history=16):
+        import collections
+        import numpy
+
+        self._np = numpy
+        if time_scale is None:
+            time_scale = float(os.environ.get('EPD_VIRTUAL_TIME_SCALE', 1.0))
+        self.time_scale = time_scale
+        self.spi_speed_hz = SPI_SPEED_HZ
+        self.frames = collections.deque(maxlen=history)    # (mode, window, frame array)
+        self.refresh_counts = collections.Counter()
+        self.panel = numpy.full((self.HEIGHT, self.WIDTH), 0xFF, dtype=numpy.uint8)
+        self._ram = {
+            0x10: numpy.zeros((self.HEIGHT, self.WIDTH // 8), dtype=numpy.uint8),
+            0x13: numpy.zeros((self.HEIGHT, self.WIDTH // 8), dtype=numpy.uint8),
+        }
+        self._pins = {self.RST_PIN: 0, self.DC_PIN: 0, self.PWR_PIN: 0}
+        self._busy_until = 0.0
+        self._command = None
+        self._data = bytearray()
+        self._init_framing()
+        self._reset_controller()
+
+    def _reset_controller(self):
+        self._mode = 'full'
+        self._partial = False
+        self._window = (0, 0, self.WIDTH, self.HEIGHT)
+        self._invert = False
+
+    # --- pins ---
+    def digital_write(self, pin, value):
+        if pin == self.RST_PIN and value and not self._pins[pin]:
+            self._reset_controller()
+        if pin == self.DC_PIN:
+            self._dc_level = value
+        if pin in self._pins:
+            self._pins[pin] = 1 if value else 0
+
+    def digital_read(self, pin):
+        if pin == self.BUSY_PIN:
+            return 0 if time.monotonic() < self._busy_until else 1
+        return self._pins.get(pin, 0)
+
+    def digital_wait(self, pin, value, timeout):
+        deadline = time.monotonic() + timeout
+        while self.digital_read(pin) != value:
+            now = time.monotonic()
+            if now >= deadline:
+                return False
+            wake = self._busy_until if pin == self.BUSY_PIN else now + 0.001
+            time.sleep(max(0.0, min(wake, deadline) - now))
+        return True
+
+    def delay_ms(self, delaytime):
+        time.sleep(delaytime * self.time_scale / 1000.0)
+
+    # --- SPI ---
+    def spi_writebyte(self, data):
+        self._feed(bytes(data))
+
+    def spi_writebyte2(self, data):
+        self._feed(bytes(data))
+
+    def _spi_transfer(self, data):
+        self._feed(data)
+
+    def spi_set_speed(self, hz):
+        self.spi_speed_hz = hz
+
+    def module_init(self, cleanup=False):
+        self._pins[self.PWR_PIN] = 1
+        return 0
+
+    def module_exit(self, cleanup=False):
+        self._finish_command()
+        self._pins[self.PWR_PIN] = 0
+        self._dc_level = None
+
+    # --- command decoding ---
+    def _feed(self, data):
+        if self._pins[self.DC_PIN]:
+            self._data += data
+            return
+        for command in bytes(data):
+            self._finish_command()
+            self._command = command
+            if command == 0x12:
+                self._refresh()
+            elif command == 0x91:
+                self._partial = True
+            elif command == 0x92:
+                self._partial = False
+            elif command == 0x04:
+                self._set_busy('power_on')
+            elif command == 0x02:
+                self._set_busy('power_off')
+
+    def _finish_command(self):
+        command, data = self._command, bytes(self._data)
+        self._command = None
+        self._data.clear()
+        if command in self._ram and data:
+            self._write_ram(command, data)
+        elif command == 0x90 and len(data) >= 8:
+            x_start = data[0] << 8 | data[1]
+            x_end = (data[2] << 8 | data[3]) + 1
+            y_start = data[4] << 8 | data[5]
+            y_end = (data[6] << 8 | data[7]) + 1
+            self._window = (x_start, y_start, x_end, y_end)
+        elif command == 0x50 and data:
+            # DDX bit: the partial sequence (0xA9) sends inverted data
+            self._invert = bool(data[0] & 0x01)
+        elif command == 0xE5 and data:
+            self._mode = self.MODE_BY_E5.get(data[0], 'full')
+
+    def _region(self):
+        if not self._partial:
+            return (0, 0, self.WIDTH, self.HEIGHT)
+        x_start, y_start, x_end, y_end = self._window
+        return (x_start // 8 * 8, y_start, min(self.WIDTH, -(-x_end // 8) * 8), min(self.HEIGHT, y_end))
+
+    def _write_ram(self, command, data):
+        np = self._np
+        x_start, y_start, x_end, y_end = self._region()
+        rows, cols = y_end - y_start, (x_end - x_start) // 8
+        plane = np.frombuffer(data[:rows * cols].ljust(rows * cols, b'\0'), dtype=np.uint8)
+        self._ram[command][y_start:y_end, x_start // 8:x_end // 8] = plane.reshape(rows, cols)
+
+    def _set_busy(self, kind):
+        self._busy_until = time.monotonic() + self.BUSY_MS[kind] * self.time_scale / 1000.0
+
+    def _refresh(self):
+        np = self._np
+        mode = 'partial' if self._partial else self._mode
+        x_start, y_start, x_end, y_end = self._region()
+        window = (slice(y_start, y_end), slice(x_start // 8, x_end // 8))
+        old_bits = np.unpackbits(self._ram[0x10][window], axis=1)
+        new_bits = np.unpackbits(self._ram[0x13][window], axis=1)
+        if mode == '4gray':
+            codes = np.array([3, 1, 2, 0], dtype=np.uint8)[old_bits * 2 + new_bits]
+            pixels = np.array(self.GRAY_LEVELS, dtype=np.uint8)[codes]
+        else:
+            black = new_bits ^ (1 if self._invert else 0)
+            pixels = np.where(black, 0x00, 0xFF).astype(np.uint8)
+        self.panel[y_start:y_end, x_start:x_end] = pixels
+        self.refresh_counts[mode] += 1
+        self.frames.append((mode, (x_start, y_start, x_end, y_end), self.panel.copy()))
+        self._set_busy(mode)
+
+    # --- inspection ---
+    def virtual_stats(self):
+        stats = self.spi_get_stats()
+        stats['refreshes'] = dict(self.refresh_counts)
+        return stats
+
+    def save_frame_png(self, path, index=-1):
+        from PIL import Image
+
+        frame = self.frames[index][2] if self.frames else self.panel
+        Image.fromarray(frame, 'L').save(path)
+        return path
+
+
 # class JetsonNano:
 #     # Pin definition
 #     RST_PIN  = 17
@@ -299,22 +613,77 @@ class RaspberryPi:
 #         self.GPIO.cleanup([self.RST_PIN, self.DC_PIN, self.CS_PIN, self.BUSY_PIN], self.PWR_PIN)
 
 
-if sys.version_info[0] == 2:
-    process = subprocess.Popen("cat /proc/cpuinfo | grep Raspberry", shell=True, stdout=subprocess.PIPE)
-else:
-    process = subprocess.Popen("cat /proc/cpuinfo | grep Raspberry", shell=True, stdout=subprocess.PIPE, text=True)
-output, _ = process.communicate()
-if sys.version_info[0] == 2:
-    output = output.decode(sys.stdout.encoding)
+_implementation = None
+_implementation_lock = threading.Lock()
+
+
+def _read_text(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read().decode('utf-8', 'ignore')
+    except OSError:
+        return ''
+
+
+_is_raspberry_pi = None
+
+
+def is_raspberry_pi():
+    """Detects a Raspberry Pi from the device tree (or /proc/cpuinfo); cached."""
+    global _is_raspberry_pi
+    if _is_raspberry_pi is None:
+        model = (_read_text('/proc/device-tree/model')
+                 or _read_text('/sys/firmware/devicetree/base/model')
+                 or _read_text('/proc/cpuinfo'))
+        _is_raspberry_pi = 'Raspberry' in model
+    return _is_raspberry_pi
+
+
+def _create_implementation():
+    # EPD_BACKEND=virtual selects the in-memory panel (also used when no Raspberry Pi is found)
+    if os.environ.get('EPD_BACKEND', '').lower() == 'virtual':
+        return Virtual()
+    if is_raspberry_pi():
+        return RaspberryPi()
+    # elif os.path.exists('/sys/bus/platform/drivers/gpio-x3'):
+    #     return SunriseX3()
+    # else:
+    #     return JetsonNano()
+    logger.warning("Raspberry Pi not detected, using the virtual e-paper backend")
+    return Virtual()
+
+
+def get_implementation():
+    """Selects the backend and claims SPI/GPIO on first use (not at import)."""
+    global _implementation
+    with _implementation_lock:
+        if _implementation is None:
+            implementation = _create_implementation()
+            for func in [x for x in dir(implementation) if not x.startswith('_')]:
+                setattr(sys.modules[__name__], func, getattr(implementation, func))
+            _implementation = implementation
+    return _implementation
+
+
+def is_initialized():
+    return _implementation is not None
+
+
+def module_exit(cleanup=False):
+    # Replaced by the backend's module_exit() once the hardware is in use.
+    # Until then nothing has been claimed, so there is nothing to release.
+    pass
 
-if "Raspberry" in output:
-    implementation = RaspberryPi()
-# elif os.path.exists('/sys/bus/platform/drivers/gpio-x3'):
-#     implementation = SunriseX3()
-# else:
-#     implementation = JetsonNano()
 
-for func in [x for x in dir(implementation) if not x.startswith('_')]:
-    setattr(sys.modules[__name__], func, getattr(implementation, func))
+def __getattr__(name):
+    # Any backend function (digital_write, spi_write_command, module_init, ...)
+    # accessed before the backend exists triggers its creation.
+    if name.startswith('_'):
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    get_implementation()
+    try:
+        return globals()[name]
+    except KeyError:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name)) from None
 
 ### END OF FILE ###
@@ -0,0 +1,178 @@
+"""
+描画済みフレームのディスクキャッシュ
+
+挨拶・別れの言葉・エラー画面・同じ要約などは、表示のたびにレイアウト・
+ラスタライズ・パックを最初からやり直していた。ここでは (テキストのダイジェストまたは
+呼び出し側が決めた画像の識別子, フォント, サイズ, レイアウト, パネルのモード) のハッシュをキーに、
+そのままパネルへ送れるパック済みバッファをディスクに保存する。
+合計サイズに上限があり、超えたら最も長く使われていないものから消す（LRU）。
+ヒットしたフレームは mmap で読み込むので Pillow を一切通らない。
+"""
+import collections
+import hashlib
+import mmap
+import os
+import threading
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# フレームの保存先
+FRAME_CACHE_DIR = os.path.join(PROJECT_ROOT, "cache", "frames")
+# キャッシュ全体の上限（バイト）。800x480 の1bitフレームは1枚 48000 バイト
+MAX_CACHE_BYTES = 32 * 1024 * 1024
+# 描画方法を変えたときに古いフレームを使わないためのバージョン
+LAYOUT_VERSION = 2
+
+FRAME_SUFFIX = ".frame"
+
+
+def _digest(*parts):
+    h = hashlib.sha256()
+    for part in parts:
+        if not isinstance(part, (bytes, bytearray, memoryview)):
+            part = str(part).encode("utf-8")
+        h.update(len(part).to_bytes(8, "little"))
+        h.update(part)
+    return h.hexdigest()
+
+
+def _font_id(font_path):
+    """フォントファイルが差し替えられたら別のキーになるようにする"""
+    try:
+        st = os.stat(font_path)
+        return f"{font_path}:{st.st_size}:{int(st.st_mtime)}"
+    except OSError:
+        return str(font_path)
+
+
+def text_key(text, font_path, font_size, layout="text", panel="1bit"):
+    """テキスト画面のキャッシュキー"""
+    return _digest("text", LAYOUT_VERSION, text, _font_id(font_path), font_size, layout, panel)
+
+
+def image_key(source_key, layout="image", panel="1bit"):
+    """
+    画像のキャッシュキー
+    source_key は呼び出し側が決める画像の安定した識別子（生成画像ストアのキーなど）。
+    画素データはハッシュしない（撮影した写真のような1回きりの画像はキャッシュしない）
+    """
+    return _digest("image", LAYOUT_VERSION, source_key, layout, panel)
+
+
+class FrameCache:
+    """
+    パック済みフレームを1キー1ファイルで保存する、サイズ上限付きのLRUキャッシュ
+    """
+
+    def __init__(self, directory=None, max_bytes=MAX_CACHE_BYTES):
+        self.directory = directory if directory is not None else FRAME_CACHE_DIR
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()  # キー → サイズ（古い順）
+        self._total = 0
+        self._scan()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + FRAME_SUFFIX)
+
+    def _scan(self):
+        """既存のフレームを最終使用時刻（mtime）の古い順に読み込む"""
+        try:
+            names = [n for n in os.listdir(self.directory) if n.endswith(FRAME_SUFFIX)]
+        except OSError:
+            return
+        found = []
+        for name in names:
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            found.append((st.st_mtime, name[:-len(FRAME_SUFFIX)], st.st_size))
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._total += size
+
+    def get(self, key):
+        """
+        フレームを返す（mmap 上の memoryview）。なければ None
+        """
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            path = self._path(key)
+            try:
+                with open(path, "rb") as f:
+                    frame = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+                os.utime(path)  # 最終使用時刻を更新（次回起動時のLRU順に使う）
+            except (OSError, ValueError):
+                # ファイルが消された・空になったなどの場合は無かったことにする
+                self._total -= self._entries.pop(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return frame
+
+    def put(self, key, frame):
+        """フレームを保存し、上限を超えた分を古いものから消す（保存に失敗しても例外にしない）"""
+        data = bytes(frame)
+        with self._lock:
+            path = self._path(key)
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                tmp_path = path + ".tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                print(f"フレームキャッシュに保存できませんでした: {e}")
+                return
+            if key in self._entries:
+                self._total -= self._entries.pop(key)
+            self._entries[key] = len(data)
+            self._total += len(data)
+            while self._total > self.max_bytes and len(self._entries) > 1:
+                old_key, size = self._entries.popitem(last=False)
+                self._total -= size
+                self.evictions += 1
+                try:
+                    os.remove(self._path(old_key))
+                except OSError:
+                    pass
+
+    def get_or_render(self, key, render):
+        """キャッシュにあればそれを、なければ render() の結果を保存して返す"""
+        frame = self.get(key)
+        if frame is None:
+            frame = render()
+            self.put(key, frame)
+        return frame
+
+    def stats(self):
+        """ヒット・ミス数などの統計"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._total,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """プロセス共通の FrameCache を返す"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = FrameCache()
+        return _cache
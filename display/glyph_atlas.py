@@ -0,0 +1,295 @@
+"""
+フォントキャッシュと1bitグリフアトラス
+
+display_text は呼び出しのたびに ImageFont.truetype() でフォントを読み込み、
+FreeType で全文字をラスタライズし直していた。ここではフォントをプロセス内で
+使い回し、よく使うかな・漢字・記号をあらかじめ1bitのビットマップにしたアトラスを
+作っておく。テキスト画面はアトラスのビットマップをパネル形式のバッファへ
+直接書き込むだけで組み立てられる。
+アトラスはディスクに保存でき、次に起動したプロセスは mmap で読み込むだけで済む
+（事前作成: python -m display.glyph_atlas）。
+"""
+import functools
+import json
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# アトラスの保存先
+GLYPH_CACHE_DIR = os.path.join(PROJECT_ROOT, "cache", "glyphs")
+
+# display_text で使うフォント
+FONT_PATH = "/usr/share/fonts/truetype/fonts-japanese-gothic.ttf"
+FONT_SIZE = 24
+
+# ファイル形式: MAGIC + ヘッダ長(uint32) + ヘッダ(JSON) + グリフのビットマップ（1bitパック）
+MAGIC = b"EPDGLYF2"
+_HEADER_LEN = struct.Struct("<I")
+
+# アトラスにあらかじめ入れておく文字
+ASCII_CHARS = "".join(chr(c) for c in range(0x20, 0x7F))
+HIRAGANA = "".join(chr(c) for c in range(0x3041, 0x3097))
+KATAKANA = "".join(chr(c) for c in range(0x30A1, 0x30FB)) + "ー"
+PUNCTUATION = "、。，．・：；？！「」『』（）［］【】〈〉《》〜…‥々〇　＋－＝％＆＃＠／"
+COMMON_KANJI = (
+    "日一国会人年大十二本中長出三同時政事自行社見月分議後前民生連五発間対上部東者党地合市業内相方四定今回新場金員九入選立開手"
+    "米力学問高代明実円関決子動京全目表戦経通外最言氏現理調体化田当八六約主題下首意法不来作性的要用制治度務強気小七成期公持野協"
+    "取都和統以機平総加山思家話世受区領多県続進正安設保改数記院女初北午指権心界支第産結百派点教報済書府活原先共得解名交資予川向"
+    "際査勝面委告軍文反元重近千考判認画海参売利組知案道信策集在件団別物側任引使求所次水半品昨論計死官増係感特情投示変打男基私各"
+    "始島直両朝革価式確村提運終挙果西勢減台広容必応演電歳住争談能無再位置企真流格有疑口過局少放税検藤町常校料沢裁状工建語球営空"
+    "職証土与急止送援供可役構木割聞身費付施切由説転食比難防補車優夫研収断井何南石足違消境神番規術護展態導鮮備宅害配副算視条幹独"
+    "警宮究育席輸訪楽起万着乗店述残想線率病農州武声質念待試族象銀域助労例衛然早張映限親額監環験追審商葉義伝働形景落欧担好退準賞"
+    "訴辺造英被株頭技低毎医復仕去姿味負閣韓渡失移差衆個門写評課末守若脳極種美岡影命含福蔵量望松非撃佐核観察整段横融型白深字答夜"
+    "製票況音申様財港識注呼渉達良響阪帰針専推雨天晴曇雪風温暑寒色黒赤青春夏秋冬朝昼晩週曜火木土何誰私僕君彼皆写真絵歌曲"
+)
+DEFAULT_CHARS = "".join(dict.fromkeys(ASCII_CHARS + HIRAGANA + KATAKANA + PUNCTUATION + COMMON_KANJI))
+
+
+@functools.lru_cache(maxsize=16)
+def get_font(path=FONT_PATH, size=FONT_SIZE):
+    """プロセス共通のフォントオブジェクトを返す（同じフォント・サイズは1回だけ読み込む）"""
+    return ImageFont.truetype(path, size)
+
+
+def _font_signature(font):
+    """フォントファイルが差し替えられたらアトラスを作り直すための識別情報"""
+    path = getattr(font, "path", None)
+    try:
+        st = os.stat(path)
+        file_id = [st.st_size, int(st.st_mtime)]
+    except (OSError, TypeError):
+        file_id = None
+    return {"font": str(path), "size": getattr(font, "size", None), "file": file_id}
+
+
+class GlyphAtlas:
+    """
+    1文字ずつ固定サイズのセルにラスタライズした1bitビットマップの集まり
+    セルの左上は draw.text((x, y), ...) に渡す座標と同じ位置に当たる。
+    """
+
+    def __init__(self, font, signature, cell_width, cell_height, pad, chars, advances, bitmaps):
+        self.font = font
+        self.signature = signature
+        self.cell_width = cell_width
+        self.cell_height = cell_height
+        self.pad = pad                  # 左にはみ出すグリフ用の余白
+        self.row_bytes = (cell_width + 7) // 8
+        self._index = {c: i for i, c in enumerate(chars)}
+        self._advances = advances
+        self._bitmaps = bitmaps         # (文字数, cell_height, row_bytes) の uint8 配列（mmap の場合あり）
+        self._unpacked = {}             # 文字 → (cell_height, cell_width) の bool 配列
+        self._extra = {}                # アトラスにない文字をその場でラスタライズしたもの
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def build(cls, font, chars=DEFAULT_CHARS):
+        """font で chars をラスタライズしてアトラスを作る"""
+        chars = "".join(dict.fromkeys(chars))
+        ascent, descent = font.getmetrics()
+        boxes = [font.getbbox(c) for c in chars]
+        pad = max(0, -min(b[0] for b in boxes))
+        cell_width = pad + max(max(b[2] for b in boxes), math.ceil(max(font.getlength(c, mode="1") for c in chars)))
+        cell_height = max(ascent + descent, max(b[3] for b in boxes))
+        atlas = cls(font, _font_signature(font), cell_width, cell_height, pad, "", [], None)
+        bitmaps = np.zeros((len(chars), cell_height, atlas.row_bytes), dtype=np.uint8)
+        advances = []
+        for i, char in enumerate(chars):
+            ink, advance = atlas._rasterize(char)
+            bitmaps[i] = np.packbits(ink, axis=1)
+            advances.append(advance)
+        atlas._index = {c: i for i, c in enumerate(chars)}
+        atlas._advances = advances
+        atlas._bitmaps = bitmaps
+        return atlas
+
+    def _rasterize(self, char):
+        """1文字をセルに描き、(インクのbool配列, 送り幅) を返す"""
+        cell = Image.new("1", (self.cell_width, self.cell_height), 0)
+        ImageDraw.Draw(cell).text((self.pad, 0), char, font=self.font, fill=1)
+        # 送り幅は1bit描画でのヒンティング後の値（draw.text が "1" の画像で使う値）
+        return np.asarray(cell, dtype=bool), self.font.getlength(char, mode="1")
+
+    def save(self, path):
+        """アトラスをファイルに保存する（その場でラスタライズした文字も含める）"""
+        chars = list(self._index) + list(self._extra)
+        advances = list(self._advances) + [self._extra[c][1] for c in self._extra]
+        extra = [np.packbits(self._extra[c][0], axis=1) for c in self._extra]
+        header = dict(self.signature, cell_width=self.cell_width, cell_height=self.cell_height,
+                      pad=self.pad, chars="".join(chars), advances=advances)
+        header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(MAGIC)
+            f.write(_HEADER_LEN.pack(len(header_bytes)))
+            f.write(header_bytes)
+            f.write(np.ascontiguousarray(self._bitmaps).tobytes())
+            for bitmap in extra:
+                f.write(bitmap.tobytes())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, font):
+        """
+        保存済みのアトラスを mmap で読み込む（ビットマップは使う文字だけ展開する）
+        フォントが保存時と違う場合は ValueError
+        """
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"グリフアトラスのファイルではありません: {path}")
+        offset = len(MAGIC) + _HEADER_LEN.size
+        (header_len,) = _HEADER_LEN.unpack_from(mm, len(MAGIC))
+        header = json.loads(mm[offset:offset + header_len].decode("utf-8"))
+        signature = _font_signature(font)
+        if any(header.get(k) != v for k, v in signature.items()):
+            raise ValueError(f"グリフアトラスのフォントが一致しません: {path}")
+        chars = header["chars"]
+        row_bytes = (header["cell_width"] + 7) // 8
+        bitmaps = np.frombuffer(mm, dtype=np.uint8, count=len(chars) * header["cell_height"] * row_bytes,
+                                offset=offset + header_len)
+        bitmaps = bitmaps.reshape(len(chars), header["cell_height"], row_bytes)
+        return cls(font, signature, header["cell_width"], header["cell_height"], header["pad"],
+                   chars, header["advances"], bitmaps)
+
+    def __len__(self):
+        return len(self._index) + len(self._extra)
+
+    def glyph(self, char):
+        """文字のビットマップ（bool配列）と送り幅を返す"""
+        glyph = self._unpacked.get(char)
+        if glyph is not None:
+            self.hits += 1
+            return glyph
+        i = self._index.get(char)
+        if i is not None:
+            self.hits += 1
+            ink = np.unpackbits(self._bitmaps[i], axis=1)[:, :self.cell_width].astype(bool)
+            glyph = self._unpacked[char] = (ink, self._advances[i])
+            return glyph
+        # アトラスにない文字はその場でラスタライズして覚えておく
+        self.misses += 1
+        glyph = self._unpacked[char] = self._extra[char] = self._rasterize(char)
+        return glyph
+
+    def draw_text(self, canvas, x, y, text):
+        """
+        canvas（height x width の bool配列、True がインク）に1行のテキストを書き込む
+        座標は draw.text((x, y), text) と同じ意味。文字は1bit描画のヒンティング後の送り幅
+        （draw.text が "1" の画像で使うのと同じ値）を足した位置に置くので、draw.text と同じ画素になる。
+        """
+        height, width = canvas.shape
+        cursor = 0.0
+        for char in text:
+            ink, advance = self.glyph(char)
+            left = x + math.floor(cursor) - self.pad
+            cursor += advance
+            if char == " " or char == "　":
+                continue
+            x0, y0 = max(left, 0), max(y, 0)
+            x1, y1 = min(left + self.cell_width, width), min(y + self.cell_height, height)
+            if x0 >= x1 or y0 >= y1:
+                continue
+            canvas[y0:y1, x0:x1] |= ink[y0 - y:y1 - y, x0 - left:x1 - left]
+
+    def render(self, positions, width, height):
+        """
+        [(x, y, 行の文字列), ...] を描いたパネル形式のバッファ（getbuffer と同じ形式）を返す
+        """
+        canvas = np.zeros((height, width), dtype=bool)
+        for x, y, line in positions:
+            self.draw_text(canvas, x, y, line)
+        return np.packbits(canvas, axis=1).tobytes()
+
+
+def atlas_path(font):
+    """フォントに対応するアトラスファイルのパス"""
+    name = os.path.splitext(os.path.basename(str(getattr(font, "path", "font"))))[0]
+    return os.path.join(GLYPH_CACHE_DIR, f"{name}-{getattr(font, 'size', 0)}.glyphs")
+
+
+_atlases = {}
+_atlas_lock = threading.Lock()
+
+
+def get_atlas(path=FONT_PATH, size=FONT_SIZE):
+    """
+    プロセス共通のグリフアトラスを返す
+    保存済みのアトラスがあれば mmap で読み込み、なければ作成して保存する。
+    """
+    with _atlas_lock:
+        key = (path, size)
+        atlas = _atlases.get(key)
+        if atlas is None:
+            font = get_font(path, size)
+            atlas = _atlases[key] = load_or_build(font)
+        return atlas
+
+
+def load_or_build(font, chars=DEFAULT_CHARS):
+    """保存済みのアトラスを読み込む。使えなければ作成して保存する（保存に失敗しても続行）"""
+    cache_path = atlas_path(font)
+    try:
+        return GlyphAtlas.load(cache_path, font)
+    except (OSError, ValueError, KeyError):
+        pass
+    atlas = GlyphAtlas.build(font, chars)
+    try:
+        atlas.save(cache_path)
+    except OSError as e:
+        print(f"グリフアトラスを保存できませんでした: {e}")
+    return atlas
+
+
+# テスト用のメイン処理（アトラスの事前作成と、FreeType描画とのベンチマーク）
+if __name__ == "__main__":
+    import sys
+
+    font_path = sys.argv[1] if len(sys.argv) > 1 else FONT_PATH
+    if not os.path.exists(font_path):
+        font_path = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
+    font = get_font(font_path, FONT_SIZE)
+
+    start = time.perf_counter()
+    atlas = GlyphAtlas.build(font)
+    build_ms = (time.perf_counter() - start) * 1000
+    cache_path = atlas_path(font)
+    atlas.save(cache_path)
+    start = time.perf_counter()
+    loaded = GlyphAtlas.load(cache_path, font)
+    load_ms = (time.perf_counter() - start) * 1000
+    print(f"アトラス: {len(atlas)}文字 セル {atlas.cell_width}x{atlas.cell_height} "
+          f"作成 {build_ms:.0f} ms / mmap読み込み {load_ms:.2f} ms ({os.path.getsize(cache_path)} bytes)")
+
+    from display import text_layout
+
+    text = ("吾輩は猫である。名前はまだ無い。The quick brown fox jumps over the lazy dog. " * 20)[:600]
+    positions = text_layout.layout_text(text, font, 760).positions(x=24, y=10, bottom=480)
+    repeat = 10
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        image = Image.new("1", (800, 480), 255)
+        draw = ImageDraw.Draw(image)
+        for x, y, line in positions:
+            draw.text((x, y), line, font=font, fill=0)
+        reference = np.packbits(~np.asarray(image, dtype=bool), axis=1).tobytes()
+    freetype_ms = (time.perf_counter() - start) * 1000 / repeat
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        frame = loaded.render(positions, 800, 480)
+    atlas_ms = (time.perf_counter() - start) * 1000 / repeat
+
+    diff = np.unpackbits(np.frombuffer(reference, np.uint8) ^ np.frombuffer(frame, np.uint8)).sum()
+    print(f"{len(text)}文字の画面: FreeType {freetype_ms:.1f} ms / アトラス {atlas_ms:.1f} ms "
+          f"({freetype_ms / atlas_ms:.1f}倍), 異なる画素 {diff}, ヒット {loaded.hits} ミス {loaded.misses}")
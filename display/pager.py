@@ -0,0 +1,182 @@
+"""
+長文のページ送り表示
+
+display_text は画面の下端で描画をやめるため、長い応答は途中で切れていた。
+Pager は応答全体をページに分け、1ページ目だけをすぐに描き、残りのページは
+バックグラウンドでパネル形式のバッファまで作っておく。ページ送りはタイマーか、
+超音波センサーへの手かざしで行い、作成済みのバッファを部分更新で送るだけで済む。
+プロセスを終える前には wait_done() で、最後のページの表示中ならその描画を待つ。
+"""
+import logging
+import threading
+import time
+
+from display import display_worker
+from display import epd_manager
+from display import frame_cache
+from display import refresh_policy
+from display import text_layout
+
+logger = logging.getLogger(__name__)
+
+# タイマーでページを送る間隔（秒）
+PAGE_INTERVAL = 10.0
+# 手をかざしたとみなす距離（cm）
+WAVE_DISTANCE = 15.0
+# 超音波センサーの測定間隔（秒）
+SENSOR_POLL = 0.2
+
+# ページの余白（display_text と同じ位置に文字を置く）
+MARGIN_LEFT = 24
+MARGIN_TOP = 10
+# ページ番号を表示する下端の領域の高さ
+FOOTER_HEIGHT = 30
+
+
+def sensor_distance_func():
+    """
+    超音波センサーの距離測定関数を返す（voice/detector.py と同じセンサー）
+    センサーが使えない環境では None
+    """
+    try:
+        from voice import detector
+        detector.setup_distance_sensor()
+    except Exception as e:
+        print(f"超音波センサーが使えないため、ページ送りはタイマーのみで行います: {e}")
+        return None
+    return detector.get_distance
+
+
+class Pager:
+    """
+    テキストをページに分けて、ページごとのパネル用バッファを用意するページャ
+    """
+
+    def __init__(self, text, atlas, width, height, max_width=None, manager=None):
+        self.text = text
+        self.atlas = atlas
+        self.width = width
+        self.height = height
+        self.manager = manager if manager is not None else epd_manager.get_manager()
+        layout = text_layout.layout_text(text, atlas.font, max_width or width - 40)
+        self.line_pitch = layout.line_pitch
+        per_page = max(1, (height - MARGIN_TOP - FOOTER_HEIGHT) // self.line_pitch)
+        lines = layout.lines or [""]
+        self.pages = [lines[i:i + per_page] for i in range(0, len(lines), per_page)]
+        self.current = 0
+        self._frames = [None] * len(self.pages)
+        self._frames_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_shown = threading.Event()  # 最後のページを描き終えた
+        # 1ページ目はすぐに使うのでここで作り、残りはバックグラウンドで作る
+        self.frame(0)
+        if len(self.pages) > 1:
+            threading.Thread(target=self._prerender, name="epd-pager-render", daemon=True).start()
+
+    @property
+    def page_count(self):
+        return len(self.pages)
+
+    def _render(self, index):
+        """ページをパネル形式のバッファに描く（下端にページ番号）"""
+        positions = [(MARGIN_LEFT, MARGIN_TOP + i * self.line_pitch, line)
+                     for i, line in enumerate(self.pages[index])]
+        if len(self.pages) > 1:
+            label = f"{index + 1}/{len(self.pages)}"
+            x = self.width - MARGIN_LEFT - int(self.atlas.font.getlength(label, mode="1"))
+            positions.append((x, self.height - FOOTER_HEIGHT + 2, label))
+        return self.atlas.render(positions, self.width, self.height)
+
+    def frame(self, index):
+        """ページのバッファを返す（まだ作られていなければその場で作る）"""
+        with self._frames_lock:
+            frame = self._frames[index]
+        if frame is None:
+            # 同じ応答のページは保存済みのフレームを使う
+            key = frame_cache.text_key(self.text, self.atlas.signature["font"], self.atlas.signature["size"],
+                                       layout=f"page:{index}/{len(self.pages)}:{self.width}x{self.height}")
+            frame = frame_cache.get_cache().get_or_render(key, lambda: self._render(index))
+            with self._frames_lock:
+                self._frames[index] = frame
+        return frame
+
+    def _prerender(self):
+        start = time.perf_counter()
+        for index in range(1, len(self.pages)):
+            if self._stop.is_set():
+                return
+            self.frame(index)
+        logger.debug("pre-rendered %d pages in %.1f ms", len(self.pages) - 1,
+                     (time.perf_counter() - start) * 1000)
+
+    def show_page(self, index, force_full=False):
+        """
+        ページを表示する（描画ワーカーのスレッドから呼ぶ）
+        ページ送りは文字の枠だけが変わるので部分更新になる。force_full=True なら全面更新。
+        """
+        self.current = index % len(self.pages)
+        decision = self.manager.show(self.frame(self.current), content=refresh_policy.CONTENT_PAGE,
+                                     force_full=force_full)
+        if self.current == len(self.pages) - 1:
+            self._last_shown.set()
+        return decision
+
+    def flip(self, step=1):
+        """次（step=-1 なら前）のページの表示を描画ワーカーに依頼する"""
+        index = (self.current + step) % len(self.pages)
+        self.current = index
+        return display_worker.get_worker().submit(self.show_page, index)
+
+    def start(self, interval=PAGE_INTERVAL, distance_func=None):
+        """
+        ページ送りを始める
+        - interval: タイマーで送る間隔（秒）。最後のページになったらタイマー送りは止まる。None なら使わない
+        - distance_func: 距離(cm)を返す関数。手をかざすたびに次のページへ（最後の次は1ページ目）
+        """
+        if len(self.pages) <= 1 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, args=(interval, distance_func),
+                                        name="epd-pager", daemon=True)
+        self._thread.start()
+
+    def wait_done(self, timeout):
+        """
+        最後のページまで送られるのを最大 timeout 秒だけ待つ（プロセス終了前に呼ぶ）
+        全ページの表示は待たない。パネルはスリープ後も最後の画像を保つので、
+        ここで待つのは終了の直前に最後のページに届きそうな場合だけのためのもの。
+        戻り値: 最後のページを描き終えたか（ページ送りをしていなければ True）
+        """
+        if self._thread is None or self._stop.is_set():
+            return True
+        return self._last_shown.wait(timeout)
+
+    def stop(self):
+        """ページ送りとバックグラウンドの準備を止める"""
+        self._stop.set()
+        thread, self._thread = self._thread, None
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout=1.0)
+
+    def _run(self, interval, distance_func):
+        poll = SENSOR_POLL if distance_func is not None else interval
+        if poll is None:
+            return
+        last_flip = time.monotonic()
+        timer_active = interval is not None
+        hand_near = False
+        while not self._stop.wait(poll):
+            if distance_func is not None:
+                near = distance_func() <= WAVE_DISTANCE
+                if near and not hand_near:
+                    logger.debug("hand wave detected, flipping page")
+                    self.flip()
+                    last_flip = time.monotonic()  # タイマー送りは次の間隔まで待つ
+                hand_near = near
+            if timer_active and time.monotonic() - last_flip >= interval:
+                self.flip()
+                last_flip = time.monotonic()
+            if self.current == len(self.pages) - 1:
+                timer_active = False
+            if not timer_active and distance_func is None:
+                return
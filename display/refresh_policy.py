@@ -0,0 +1,111 @@
+"""
+電子ペーパーのリフレッシュモード選択ポリシー
+
+表示内容の種類（テキスト / 写真 / 4階調画像 / ステータス表示）、変化した面積、
+残像の蓄積量（ゴーストバジェット）から、init / init_fast / init_part / init_4Gray の
+どれで更新するかを決める。決定結果には想定所要時間と理由が付くので、
+呼び出し側は「最速で許容できるもの」か「最もきれいなもの」かを選べる。
+"""
+import collections
+
+# 表示内容の種類
+CONTENT_TEXT = "text"      # 会話テキスト
+CONTENT_PHOTO = "photo"    # ディザリング済みの写真・生成画像
+CONTENT_GRAY = "gray"      # 4階調で表示したい画像
+CONTENT_STATUS = "status"  # 小さなステータス表示の変化
+CONTENT_PAGE = "page"      # 長文のページ送り（同じ枠の中の文字だけが変わる）
+CONTENT_STREAM = "stream"  # 生成中の応答の逐次表示（文単位で文字が増える）
+
+# 優先度
+PREFER_FASTEST = "fastest"    # 許容できる範囲で最速
+PREFER_BALANCED = "balanced"  # 既定: テキストは速さ、写真は画質を優先
+PREFER_CLEANEST = "cleanest"  # 残像が最も少ない全面更新
+
+# モードごとの想定所要時間（初期化 + 転送 + BUSY、ミリ秒）
+# 更新のたびに DisplayManager が実測のBUSY時間で置き換える（RefreshPolicy.calibrate）
+MODE_COST_MS = {
+    "skip": 0,
+    "partial": 700,
+    "fast": 1800,
+    "4gray": 2600,
+    "full": 4200,
+}
+
+# 1回の更新で増える残像の量（full / 4gray はリセット、fast は画面全体を書き換えるので
+# それまでの残像を半分にしてから加える）
+GHOST_COST = {"partial": 1.0, "fast": 0.5}
+# 残像の許容量（超えたら全面更新で消す）
+GHOST_BUDGET = 8.0
+# 変化面積がこの割合以下なら部分更新を使う
+PARTIAL_AREA_LIMIT = 0.35
+
+RefreshDecision = collections.namedtuple("RefreshDecision", ["mode", "expected_ms", "reason"])
+
+
+class RefreshPolicy:
+    """
+    更新ごとにリフレッシュモードを決め、残像の蓄積を記録するポリシー
+    """
+
+    def __init__(self, ghost_budget=GHOST_BUDGET, partial_area_limit=PARTIAL_AREA_LIMIT, costs=None):
+        self.ghost_budget = ghost_budget
+        self.partial_area_limit = partial_area_limit
+        self.costs = dict(MODE_COST_MS if costs is None else costs)
+        # 直近の全面更新以降に溜まった残像の量
+        # 起動直後は前回の表示が残っている可能性があるので、上限に達した状態から始める
+        self.ghost = float(ghost_budget)
+
+    def _decision(self, mode, reason):
+        return RefreshDecision(mode, self.costs[mode], reason)
+
+    def decide(self, content=CONTENT_TEXT, changed_fraction=1.0, preference=PREFER_BALANCED,
+               partial_available=True):
+        """
+        リフレッシュモードを決める（状態は変えない。実際に更新したら record() を呼ぶ）
+        - changed_fraction: 画面全体に対する変化した面積の割合（0.0 - 1.0）
+        - partial_available: パネルが起きていて部分更新できる状態か
+        """
+        if changed_fraction <= 0:
+            return self._decision("skip", "画面に変化なし")
+        if content == CONTENT_GRAY:
+            return self._decision("4gray", "4階調の画像")
+        if preference == PREFER_CLEANEST:
+            return self._decision("full", "画質優先")
+
+        if self.ghost >= self.ghost_budget:
+            if preference == PREFER_FASTEST:
+                return self._decision("fast", "残像が上限に達したため高速全面更新")
+            return self._decision("full", "残像が上限に達したため全面更新")
+
+        if content == CONTENT_PHOTO:
+            if preference == PREFER_FASTEST:
+                return self._decision("fast", "写真を速度優先で表示")
+            return self._decision("full", "写真は全面更新で表示")
+
+        # テキスト / ステータス表示 / ページ送り / 逐次表示
+        small_change = (changed_fraction <= self.partial_area_limit
+                        or content in (CONTENT_STATUS, CONTENT_PAGE, CONTENT_STREAM))
+        if small_change and partial_available:
+            return self._decision("partial", f"変化面積 {changed_fraction:.0%} のみ部分更新")
+        if not partial_available and small_change:
+            return self._decision("fast", "パネル再初期化が必要なため高速全面更新")
+        return self._decision("fast", f"変化面積 {changed_fraction:.0%} のため高速全面更新")
+
+    def record(self, mode):
+        """実際に行った更新を記録し、残像の蓄積量を更新する"""
+        if mode in ("full", "4gray"):
+            self.ghost = 0.0
+        elif mode == "fast":
+            self.ghost = self.ghost / 2 + GHOST_COST["fast"]
+        else:
+            self.ghost += GHOST_COST.get(mode, 0.0)
+
+    def calibrate(self, busy_summary, init_ms=150):
+        """
+        EPDSession.busy_summary() の実測BUSY時間で想定所要時間を更新する
+        init_ms は初期化と転送にかかる時間の目安。
+        """
+        for mode in ("full", "fast", "partial", "4gray"):
+            stat = busy_summary.get("by_label", {}).get("refresh_" + mode)
+            if stat and stat["count"]:
+                self.costs[mode] = int(stat["avg_s"] * 1000 + init_ms)
@@ -0,0 +1,164 @@
+"""
+生成中の応答を電子ペーパーに逐次表示するストリーミング表示
+
+チャットの応答を受け取りながら、文の区切り（。！？ など）ごとに本文の領域へ
+追記して部分更新する。パネルが実際に更新できる間隔（部分更新1回分の時間）より
+短い間隔では更新せず、その間に届いた文はまとめて次の更新で描く。
+応答が終わったら1回だけ全面更新して残像を消す。画面に収まらない長さなら
+そのままページ送り表示に切り替える。
+"""
+import logging
+import threading
+import time
+
+from display import display_worker
+from display import epd_manager
+from display import pager
+from display import refresh_policy
+from display import text_layout
+
+logger = logging.getLogger(__name__)
+
+# 文の区切りとみなす文字（ここまで届いたら画面に追記する）
+SENTENCE_END = "。！？!?\n"
+# 区切りが来なくても、この文字数たまったら追記する
+MAX_PENDING_CHARS = 60
+# 更新の最短間隔（秒）。実際には部分更新の想定所要時間と大きい方を使う
+MIN_UPDATE_INTERVAL = 1.0
+# 応答の生成中であることを示す下端の表示
+TYPING_LABEL = "…"
+
+
+class StreamingDisplay:
+    """
+    feed() で受け取った応答を文単位で画面に追記し、finish() で仕上げの全面更新を行う
+    """
+
+    def __init__(self, atlas, width, height, manager=None, min_interval=None,
+                 page_interval=pager.PAGE_INTERVAL, use_sensor=True):
+        self.atlas = atlas
+        self.width = width
+        self.height = height
+        self.manager = manager if manager is not None else epd_manager.get_manager()
+        if min_interval is None:
+            min_interval = max(MIN_UPDATE_INTERVAL, self.manager.policy.costs["partial"] / 1000)
+        self.min_interval = min_interval
+        self.page_interval = page_interval
+        self.use_sensor = use_sensor
+        self.layout = text_layout.TextLayout(atlas.font, width - 40)
+        self.lines_per_page = max(1, (height - pager.MARGIN_TOP - pager.FOOTER_HEIGHT) // self.layout.line_pitch)
+        self.text = ""              # 受け取った全文
+        self.pager = None           # 画面に収まらなかった場合のページ送り
+        self.updates = 0            # 実際に描いた回数
+        self.first_shown = None     # 開始から最初の表示までの秒数
+        self._pending = ""          # まだ文の区切りが来ていない文字
+        self._lock = threading.Lock()
+        self._timer = None
+        self._last_submit = 0.0
+        self._closed = False
+        self._started = time.monotonic()
+
+    def feed(self, delta):
+        """応答の続きを受け取る（チャットのストリーミングのコールバックとして渡す）"""
+        with self._lock:
+            if self._closed or not delta:
+                return
+            self.text += delta
+            self._pending += delta
+            cut = max(self._pending.rfind(c) for c in SENTENCE_END)
+            if cut < 0:
+                if len(self._pending) < MAX_PENDING_CHARS:
+                    return
+                cut = len(self._pending) - 1
+            self.layout.feed(self._pending[:cut + 1])
+            self._pending = self._pending[cut + 1:]
+            self._schedule()
+
+    def _schedule(self):
+        """更新を依頼する（前回の依頼から min_interval 経っていなければ、その時点まで遅らせる）"""
+        wait = self._last_submit + self.min_interval - time.monotonic()
+        if wait <= 0:
+            self._submit()
+        elif self._timer is None:
+            self._timer = threading.Timer(wait, self._on_timer)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _on_timer(self):
+        with self._lock:
+            self._timer = None
+            if not self._closed:
+                self._submit()
+
+    def _submit(self):
+        self._last_submit = time.monotonic()
+        display_worker.get_worker().submit(self._show)
+
+    def _frame(self, lines, footer=None):
+        """本文の行（最後の1画面分）と下端の表示をパネル形式のバッファに描く"""
+        positions = [(pager.MARGIN_LEFT, pager.MARGIN_TOP + i * self.layout.line_pitch, line)
+                     for i, line in enumerate(lines)]
+        if footer:
+            x = self.width - pager.MARGIN_LEFT - int(self.atlas.font.getlength(footer, mode="1"))
+            positions.append((x, self.height - pager.FOOTER_HEIGHT + 2, footer))
+        return self.atlas.render(positions, self.width, self.height)
+
+    def _show(self):
+        """描画ワーカーのスレッドで、その時点までに届いた文を描く"""
+        with self._lock:
+            if self._closed:
+                return None
+            lines = self.layout.lines[-self.lines_per_page:]
+        decision = self.manager.show(self._frame(lines, TYPING_LABEL), content=refresh_policy.CONTENT_STREAM,
+                                     preference=refresh_policy.PREFER_FASTEST)
+        self.updates += 1
+        if self.first_shown is None:
+            self.first_shown = time.monotonic() - self._started
+            print(f"応答の表示を開始しました（{self.first_shown:.1f}秒）")
+        return decision
+
+    def finish(self):
+        """
+        応答の終わりを通知する
+        残りの文字を追記して1回だけ全面更新する。画面に収まらない場合はページ送り表示にする。
+        戻り値: 仕上げの表示の Future
+        """
+        with self._lock:
+            if self._closed:
+                return None
+            self._closed = True
+            self._cancel_timer()
+            self.layout.feed(self._pending)
+            self._pending = ""
+            lines = self.layout.lines
+        worker = display_worker.get_worker()
+        if len(lines) <= self.lines_per_page:
+            return worker.submit(self.manager.show, self._frame(lines), content=refresh_policy.CONTENT_TEXT,
+                                 force_full=True)
+        self.pager = pager.Pager(self.text, self.atlas, self.width, self.height, manager=self.manager)
+        future = worker.submit(self.pager.show_page, 0, force_full=True)
+        distance_func = pager.sensor_distance_func() if self.use_sensor else None
+        self.pager.start(self.page_interval, distance_func)
+        return future
+
+    def wait_done(self, timeout):
+        """
+        仕上げがページ送り表示になった場合、最後のページに届くのを最大 timeout 秒待つ（Pager.wait_done を参照）
+        戻り値: 最後のページを描き終えたか（ページ送りをしていなければ True）
+        """
+        if self.pager is None:
+            return True
+        return self.pager.wait_done(timeout)
+
+    def stop(self):
+        """表示を打ち切る（新しい表示が依頼されたとき）"""
+        with self._lock:
+            self._closed = True
+            self._cancel_timer()
+        if self.pager is not None:
+            self.pager.stop()
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
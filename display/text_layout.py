@@ -0,0 +1,216 @@
+"""
+日本語テキストの折り返しレイアウト
+
+従来の wrap_text は1文字追加するたびに行全体を textbbox で測り直すため、
+行の長さに対して2乗の計算量になっていた。ここではフォントごとに1文字の送り幅を
+キャッシュし、文字を1回ずつ足していくだけで折り返す（テキスト長に対して線形）。
+禁則処理（行頭に「。」「、」「」」など、行末に「「」「（」などを置かない）を行い、
+描画位置も返すので、描画側で行ごとに測り直す必要がない。
+TextLayout は feed() で後から文字を追加でき、確定済みの行は再計算しない。
+"""
+import time
+
+from PIL import Image, ImageDraw, ImageFont
+
+# 行頭に置かない文字（句読点・閉じ括弧・小書き文字・長音など）
+NO_LINE_START = frozenset(
+    "、。，．・：；？！゛゜ヽヾゝゞ々ー〜）］｝」』〕〉》】〙〗〟’”｠»"
+    "ぁぃぅぇぉっゃゅょゎゕゖァィゥェォッャュョヮヵヶ"
+    ",.:;?!)]}…‥"
+)
+# 行末に置かない文字（開き括弧など）
+NO_LINE_END = frozenset("（［｛「『〔〈《【〘〖〝‘“｟«([{")
+
+# 行間の余白（ピクセル）
+LINE_GAP = 5
+# 行の高さの基準にする文字
+REFERENCE_GLYPH = "あ"
+
+# フォントごとの文字送り幅・行の高さのキャッシュ
+_advance_cache = {}
+_line_height_cache = {}
+
+
+def _font_key(font):
+    """同じフォントファイル・サイズなら別インスタンスでもキャッシュを共有する"""
+    path = getattr(font, "path", None)
+    size = getattr(font, "size", None)
+    if path is None or size is None:
+        return id(font)
+    return (path, size, getattr(font, "index", 0))
+
+
+def glyph_advances(font):
+    """フォントの 文字 → 送り幅（ピクセル）のキャッシュ辞書を返す"""
+    key = _font_key(font)
+    cache = _advance_cache.get(key)
+    if cache is None:
+        cache = _advance_cache[key] = {}
+    return cache
+
+
+def line_height(font):
+    """基準文字「あ」の高さ（行送りは この値 + LINE_GAP）"""
+    key = _font_key(font)
+    height = _line_height_cache.get(key)
+    if height is None:
+        bbox = font.getbbox(REFERENCE_GLYPH)
+        height = _line_height_cache[key] = bbox[3] - bbox[1]
+    return height
+
+
+class TextLayout:
+    """
+    文字送り幅のキャッシュを使って日本語テキストを折り返すレイアウト
+    feed() で文字を追加するたびに、最後の行だけを更新する。
+    """
+
+    def __init__(self, font, max_width, line_gap=LINE_GAP):
+        self.font = font
+        self.max_width = max_width
+        self.line_gap = line_gap
+        self._advances = glyph_advances(font)
+        self._lines = []        # 確定した行
+        self._chars = []        # 組み立て中の行の文字
+        self._widths = []       # 組み立て中の行の各文字の送り幅
+        self._width = 0.0       # 組み立て中の行の幅
+
+    def _advance(self, char):
+        width = self._advances.get(char)
+        if width is None:
+            width = self._advances[char] = self.font.getlength(char, mode="1")
+        return width
+
+    def _break_line(self, chars, widths):
+        """組み立て中の行を確定し、chars / widths で次の行を始める"""
+        self._lines.append("".join(self._chars))
+        self._chars = chars
+        self._widths = widths
+        self._width = sum(widths)
+
+    def _add(self, char):
+        if char == "\n":
+            self._break_line([], [])
+            return
+        if char == "\r":
+            return
+        width = self._advance(char)
+        if not self._chars or self._width + width <= self.max_width:
+            self._chars.append(char)
+            self._widths.append(width)
+            self._width += width
+            return
+
+        # 幅を超えた: 禁則処理をして次の行へ送る文字を決める
+        carry = [char]
+        carry_widths = [width]
+        if char in NO_LINE_START:
+            # 追い出し: 行頭禁則文字の前の文字も一緒に次の行へ送る
+            while len(self._chars) > 1 and carry[0] in NO_LINE_START:
+                carry.insert(0, self._chars.pop())
+                carry_widths.insert(0, self._widths.pop())
+            if carry[0] in NO_LINE_START:
+                # 送れる文字がない（1文字だけの行）場合はぶら下げる
+                self._chars.extend(carry)
+                self._widths.extend(carry_widths)
+                self._width = sum(self._widths)
+                return
+        # 行末禁則: 開き括弧で終わらないよう、次の行へ送る
+        while len(self._chars) > 1 and self._chars[-1] in NO_LINE_END:
+            carry.insert(0, self._chars.pop())
+            carry_widths.insert(0, self._widths.pop())
+        self._break_line(carry, carry_widths)
+
+    def feed(self, text):
+        """テキストを末尾に追加する（戻り値は self）"""
+        for char in text:
+            self._add(char)
+        return self
+
+    @property
+    def lines(self):
+        """折り返し後の行のリスト（組み立て中の最後の行を含む）"""
+        if self._chars:
+            return self._lines + ["".join(self._chars)]
+        return list(self._lines)
+
+    @property
+    def line_pitch(self):
+        """行送り（ピクセル）"""
+        return line_height(self.font) + self.line_gap
+
+    def positions(self, x=0, y=0, bottom=None):
+        """
+        各行の描画位置を返す: [(x, y, 行の文字列), ...]
+        bottom を指定すると、そこに収まる行だけを返す（1行目は必ず含む）。
+        """
+        height = line_height(self.font)
+        pitch = height + self.line_gap
+        placed = []
+        for line in self.lines:
+            if placed and bottom is not None and y + height > bottom:
+                break
+            placed.append((x, y, line))
+            y += pitch
+        return placed
+
+
+def layout_text(text, font, max_width, line_gap=LINE_GAP):
+    """テキストを折り返した TextLayout を返す"""
+    return TextLayout(font, max_width, line_gap).feed(text)
+
+
+def _legacy_wrap_text(text, font, max_width, draw):
+    """ベンチマーク比較用: 従来の epd_display.wrap_text と同じ処理"""
+    lines = []
+    current_line = ""
+    for char in text:
+        test_line = current_line + char
+        bbox = draw.textbbox((0, 0), test_line, font=font)
+        line_width = bbox[2] - bbox[0]
+        if line_width <= max_width:
+            current_line = test_line
+        else:
+            lines.append(current_line)
+            current_line = char
+    if current_line:
+        lines.append(current_line)
+    return lines
+
+
+def _load_benchmark_font(size=24):
+    for path in ("/usr/share/fonts/truetype/fonts-japanese-gothic.ttf",
+                 "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"):
+        try:
+            return ImageFont.truetype(path, size)
+        except OSError:
+            continue
+    return ImageFont.load_default(size)
+
+
+# テスト用のメイン処理（長文での従来方式とのベンチマーク）
+if __name__ == "__main__":
+    font = _load_benchmark_font()
+    draw = ImageDraw.Draw(Image.new("1", (800, 480), 255))
+    max_width = 800 - 40
+    sample = "吾輩は猫である。名前はまだ無い。「どこで生れたか」とんと見当がつかぬ、何でも薄暗い所でニャーニャー泣いていた事だけは記憶している。"
+    for length in (100, 500, 2000):
+        text = (sample * (length // len(sample) + 1))[:length]
+        start = time.perf_counter()
+        legacy = _legacy_wrap_text(text, font, max_width, draw)
+        legacy_ms = (time.perf_counter() - start) * 1000
+
+        _advance_cache.clear()
+        start = time.perf_counter()
+        cold = layout_text(text, font, max_width).lines
+        cold_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        warm = layout_text(text, font, max_width).lines
+        warm_ms = (time.perf_counter() - start) * 1000
+
+        print(f"{length}文字: 従来 {legacy_ms:.1f} ms ({len(legacy)}行) / "
+              f"新方式 初回 {cold_ms:.2f} ms・キャッシュ済み {warm_ms:.2f} ms ({len(warm)}行), "
+              f"{legacy_ms / warm_ms:.0f}倍")
+    head = layout_text(sample * 3, font, max_width).lines
+    print("行頭禁則に違反した行:", [line for line in head[1:] if line[0] in NO_LINE_START])
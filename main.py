@@ -2,10 +2,14 @@ import os
 from dotenv import load_dotenv
 import subprocess
 from voice import get_voice
-from api import chat, generate_image, chat_with_gpt, download_and_resize_image, save_image
+from api import chat, generate_image, chat_with_gpt
 from api import tts_voice
+from api import tts_stream
+from api import image_download, image_store
 from display import epd_display
+from display import dither
 from camera import camera_control
+from storage import media_writer
 from PIL import Image
 import re
 import sys
@@ -15,7 +19,6 @@ from display import epdconfig  # EPDリソース解放のためにインポー
 from api import tts_voice, chat_with_gpt
 from api.chat import (
     SYSTEM_PROMPT,
-    summarize_text_for_display,
     generate_greeting,
     generate_farewell,
 )  # generate_farewell をインポート
@@ -65,6 +68,41 @@ def check_for_camera_command(text):
     return False
 
 
+def respond(text, conversation_history):
+    """
+    応答を生成しながら、文ごとに電子ペーパーへ表示して読み上げる
+    逐次読み上げができなかった場合は、応答の全文を従来の方法で読み上げる
+    応答の生成が途中で失敗して作り直された場合は、表示と読み上げも最初からやり直す
+    """
+    stream = epd_display.display_text_stream()
+    speech = tts_stream.SpeechStream()
+
+    def on_delta(delta):
+        stream.feed(delta)
+        speech.feed(delta)
+
+    def on_reset():
+        nonlocal stream, speech
+        speech.stop()  # 途中まで読み上げた応答は打ち切る
+        stream = epd_display.display_text_stream()  # 途中まで表示した応答は新しい表示に置き換える
+        speech = tts_stream.SpeechStream()
+
+    try:
+        response, is_question, conversation_history = chat_with_gpt(
+            text, conversation_history, on_delta=on_delta, on_reset=on_reset
+        )  # 履歴を渡し、更新された履歴を受け取る
+    except BaseException:
+        speech.stop()
+        raise
+    stream.finish()  # 全面更新で仕上げ（長い応答はページ送り表示）
+    if not speech.finish() and response:
+        tts_voice.text_to_speech(response)
+    elif speech.missed:
+        # 逐次読み上げで合成できなかった文は、最後にまとめて従来の方法で読み上げる
+        tts_voice.text_to_speech("".join(speech.missed))
+    return response, is_question, conversation_history
+
+
 # 一時ファイルのパスを定義 (web_trigger.py と合わせる)
 TRIGGER_FILE_PATH = os.path.join(tempfile.gettempdir(), "conversation_starter.txt")
 
@@ -171,32 +209,34 @@ if __name__ == "__main__":
                 print("写真撮影コマンドを検出しました！")
                 # 写真を撮影
                 photo_path, photo_image = camera_control.capture_photo()
-                print(f"写真を保存しました: {photo_path}")
-                # 撮影した写真を電子ペーパーに表示
-                epd_display.display_image(photo_image)
-                print("写真を電子ペーパーに表示しました")
+                # 撮影した写真を電子ペーパーに表示（描画も保存もバックグラウンドで行う）
+                epd_display.display_image_async(photo_image)
+                print("写真の表示を開始しました")
                 processed_special_command = True # カメラコマンドを処理した
             elif is_image_request(text):
                 # 画像生成
-                print("画像生成モード: DALL·E を使用")
-                image_url = generate_image(text)
-                image = download_and_resize_image(image_url)
-                save_image(image, text)
-                epd_display.display_image(image)
+                store = image_store.get_store()
+                entry = store.lookup(text)
+                if entry is not None:
+                    # 同じ依頼の画像が保存されていれば、生成せずにすぐ表示する
+                    print(f"保存済みの画像を表示します: {entry.original_path}")
+                    epd_display.display_buffer_async(store.read_buffer(entry))
+                else:
+                    print("画像生成モード: DALL·E を使用")
+                    image_url = generate_image(text)
+                    original = image_download.fetch_bytes(image_url)
+                    image = image_download.decode_and_resize(original)
+                    # ディザリングは1回だけ行い、表示と保存で同じバッファを使う
+                    buffer = dither.dither_1bit(image)
+                    epd_display.display_buffer_async(buffer)
+                    store.add(text, original, image, source_url=image_url, buffer=buffer)  # 保存はバックグラウンド
                 processed_special_command = True # 画像生成コマンドを処理した
 
             # --- 通常の会話処理 (特殊コマンドが処理されなかった場合) ---
             if not processed_special_command:
                 print("テキスト応答モード: GPT-4o-mini を使用")
-                response, is_question, conversation_history = chat_with_gpt(
-                    text, conversation_history
-                )  # 履歴を渡し、更新された履歴を受け取る
-                tts_voice.text_to_speech(response)
-                if not is_question:
-                    print("応答を要約して表示します...")
-                    summary = summarize_text_for_display(response)  # 応答を要約
-                    print("要約:", summary)
-                    epd_display.display_text(summary)  # 要約を表示
+                # 応答は生成されながら文ごとに電子ペーパーへ表示され、読み上げられる
+                response, is_question, conversation_history = respond(text, conversation_history)
                 # GPTの応答が質問の場合、会話を継続
                 while is_question:
                     print("GPTが質問をしました。会話を継続します。")
@@ -208,37 +248,28 @@ if __name__ == "__main__":
                     # 音声録音 & Whisper でテキスト化
                     audio_file = get_voice.record_audio()
                     if audio_file is None:
-                        print("音声入力がタイムアウトしました。最後の応答を要約して表示します。")
+                        print("音声入力がタイムアウトしました。最後の応答を表示します。")
                         farewell_text = generate_farewell()  # 別れの挨拶を生成
                         print(f"生成された別れの挨拶: {farewell_text}")
                         tts_voice.text_to_speech(farewell_text)  # 音声合成して再生
-                        # タイムアウト前の最後の応答 (response) を要約して表示
-                        summary = summarize_text_for_display(response)
-                        print("要約:", summary)
-                        epd_display.display_text(summary)
+                        # タイムアウト前の最後の応答 (response) は表示済み
                         break
                     text = get_voice.transcribe_audio()
                     print("認識結果:", text)
-                    response, is_question, conversation_history = chat_with_gpt(
-                        text, conversation_history
-                    )  # 履歴を渡し、更新された履歴を受け取る
-                    tts_voice.text_to_speech(response)
-                    if not is_question:
-                        print("応答を要約して表示します...")
-                        summary = summarize_text_for_display(response)  # 応答を要約
-                        print("要約:", summary)
-                        epd_display.display_text(summary)  # 要約を表示
+                    response, is_question, conversation_history = respond(text, conversation_history)
         except Exception as e:
             print(f"エラーが発生しました: {str(e)}")
             # エラーメッセージを表示
             try:
-                epd_display.display_text(f"エラーが発生しました。\n{str(e)}")
+                epd_display.display_text_async(f"エラーが発生しました。\n{str(e)}")
             except:
                 pass
     # --- finally ブロックで EPD リソースを解放 ---
     finally:
         print("Cleaning up EPD resources...")
         try:
+            media_writer.shutdown()  # 保存待ちの画像を書き終える
+            epd_display.close()  # 残りの表示を描き終えてからパネルをディープスリープへ
             epdconfig.module_exit()  # GPIOピンとSPIを解放
             print("EPD resources cleaned up.")
         except Exception as cleanup_e:
@@ -0,0 +1 @@
+# 保存関連モジュールのパッケージ
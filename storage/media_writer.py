@@ -0,0 +1,236 @@
+"""
+画像の保存をバックグラウンドで行うメディアライター
+
+生成画像（image_store）や撮影した写真の保存は、SDカードへの PNG/JPEG の
+エンコードと書き込みに数百ms〜数秒かかり、そのあいだ表示が待たされていた。
+ここでは保存ジョブを上限付きのキューに入れ、1本のワーカースレッドが
+エンコード → 一時ファイルに書き込み → fsync → 置き換え の順に処理する。
+キューが一杯のときは submit() が空くまで待つ（バックプレッシャー）ので、
+保存が追いつかないほど依頼が続いてもメモリ上に画像がたまり続けることはない。
+"""
+import io
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+# 拡張子 → Pillow の保存形式
+FORMATS = {
+    ".png": "PNG",
+    ".jpg": "JPEG",
+    ".jpeg": "JPEG",
+    ".webp": "WEBP",
+}
+# 拡張子から判断できないときの形式
+DEFAULT_FORMAT = "PNG"
+# 形式ごとの画質（JPEG / WebP）と PNG の圧縮レベル
+QUALITY = {"JPEG": 90, "WEBP": 85}
+PNG_COMPRESS_LEVEL = 6
+# キューに入れておける保存ジョブの数（これを超えると submit() が待つ）
+MAX_QUEUE = 4
+
+# fsync の方針
+FSYNC_NONE = "none"      # OS に任せる（最速。電源断で直近のファイルが失われることがある）
+FSYNC_FILE = "file"      # ファイルの内容を fsync してから置き換える
+FSYNC_FULL = "full"      # さらにディレクトリも fsync して置き換えを確定させる
+DEFAULT_FSYNC = FSYNC_FILE
+
+
+def format_for_path(path):
+    """ファイル名の拡張子から保存形式を決める"""
+    return FORMATS.get(os.path.splitext(path)[1].lower(), DEFAULT_FORMAT)
+
+
+def encode(image, fmt, quality=None):
+    """PIL画像を指定の形式でエンコードしたバイト列を返す"""
+    buf = io.BytesIO()
+    if fmt == "PNG":
+        image.save(buf, fmt, compress_level=PNG_COMPRESS_LEVEL)
+    else:
+        if fmt == "JPEG" and image.mode not in ("RGB", "L", "CMYK"):
+            image = image.convert("RGB")
+        image.save(buf, fmt, quality=quality if quality is not None else QUALITY.get(fmt, 85))
+    return buf.getvalue()
+
+
+def write_file(path, data, fsync=DEFAULT_FSYNC):
+    """一時ファイルに書き込んでから置き換える（書きかけのファイルが残らない）"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        if fsync != FSYNC_NONE:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    if fsync == FSYNC_FULL and directory:
+        fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+class MediaWriter:
+    """
+    保存ジョブを1本のスレッドで順に処理するライター
+    キューが一杯のときは submit() が待たされる（バックプレッシャー）。
+    """
+
+    def __init__(self, max_queue=MAX_QUEUE, fsync=DEFAULT_FSYNC, name="media-writer"):
+        if fsync not in (FSYNC_NONE, FSYNC_FILE, FSYNC_FULL):
+            raise ValueError(f"未対応の fsync 方針です: {fsync}")
+        self.fsync = fsync
+        self.written = 0
+        self.failed = 0
+        self.bytes_written = 0
+        self.write_s = 0.0       # エンコードと書き込みにかかった合計時間
+        self.blocked_s = 0.0     # キューが一杯で submit() が待たされた合計時間
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        # 受付終了の判定とキューへの追加をまとめるロック。キューが一杯のときはこれを
+        # 持ったまま待つので、ワーカーが統計の更新に使う _lock とは分けている
+        self._submit_lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, image, path, fmt=None, quality=None, timeout=None):
+        """
+        保存ジョブを登録し、完了で保存先のパスが入る Future を返す
+        - image: PIL画像、またはエンコード済みのバイト列（そのまま書き込む）
+        - fmt: "PNG" / "JPEG" / "WEBP"（省略時は拡張子から判断）
+        - quality: JPEG / WebP の画質（省略時は QUALITY）
+        キューが一杯なら空くまで待ち、timeout 秒を過ぎたら queue.Full を送出する。
+        登録した画像は保存が終わるまで変更しないこと。
+        """
+        future = Future()
+        job = (image, path, fmt or format_for_path(path), quality, future)
+        # 終了要求（None）より後ろにジョブが入って処理されずに残ることがないよう、
+        # 判定と追加の間に shutdown() が割り込めないようにする
+        with self._submit_lock:
+            if self._closed:
+                raise RuntimeError("MediaWriter は終了しています")
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                logger.debug("media queue full, waiting")
+                start = time.monotonic()
+                try:
+                    self._queue.put(job, timeout=timeout)
+                finally:
+                    with self._lock:
+                        self.blocked_s += time.monotonic() - start
+        return future
+
+    def flush(self):
+        """登録済みの保存ジョブがすべて終わるまで待つ"""
+        self._queue.join()
+
+    def shutdown(self, wait=True):
+        """新しいジョブの受付を止める。wait=True なら残りのジョブの完了を待つ"""
+        with self._submit_lock:
+            if not self._closed:
+                self._closed = True
+                self._queue.put(None)
+        if wait:
+            self._thread.join()
+
+    def stats(self):
+        """保存件数などの統計"""
+        with self._lock:
+            return {
+                "written": self.written,
+                "failed": self.failed,
+                "bytes": self.bytes_written,
+                "write_s": self.write_s,
+                "blocked_s": self.blocked_s,
+                "queued": self._queue.qsize(),
+            }
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return  # 終了要求（それより前のジョブは処理済み）
+                self._write(*job)
+            finally:
+                self._queue.task_done()
+
+    def _write(self, image, path, fmt, quality, future):
+        if not future.set_running_or_notify_cancel():
+            return
+        start = time.monotonic()
+        try:
+            data = image if isinstance(image, (bytes, bytearray, memoryview)) else encode(image, fmt, quality)
+            write_file(path, data, self.fsync)
+        except Exception as e:
+            logger.debug("media write failed: %s", path, exc_info=True)
+            print(f"画像を保存できませんでした: {path} ({e})")
+            with self._lock:
+                self.failed += 1
+            future.set_exception(e)
+            return
+        with self._lock:
+            self.written += 1
+            self.bytes_written += len(data)
+            self.write_s += time.monotonic() - start
+        future.set_result(path)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    """プロセス共通の MediaWriter を返す（初回呼び出し時にスレッドを起動）"""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = MediaWriter()
+        return _writer
+
+
+def shutdown():
+    """ライターが起動していれば、残りの保存を終えてから終了させる"""
+    global _writer
+    with _writer_lock:
+        writer, _writer = _writer, None
+    if writer is not None:
+        writer.shutdown(wait=True)
+        stats = writer.stats()
+        if stats["written"] or stats["failed"]:
+            print(f"画像の保存: {stats['written']}件 {stats['bytes'] // 1024}KB "
+                  f"(失敗 {stats['failed']}件, 待ち {stats['blocked_s']:.1f}秒)")
+
+
+# テスト用のメイン処理（1920x1080 の写真を同期保存した場合と、キューに入れた場合の待ち時間を比べる）
+if __name__ == "__main__":
+    import tempfile
+
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(0)
+    photo = Image.fromarray(rng.integers(0, 256, (1080, 1920, 3), dtype=np.uint8), "RGB")
+    with tempfile.TemporaryDirectory() as tmp:
+        for ext in (".png", ".jpg", ".webp"):
+            start = time.perf_counter()
+            photo.save(os.path.join(tmp, "sync" + ext))
+            sync_ms = (time.perf_counter() - start) * 1000
+
+            writer = MediaWriter()
+            start = time.perf_counter()
+            future = writer.submit(photo, os.path.join(tmp, "async" + ext))
+            submit_ms = (time.perf_counter() - start) * 1000
+            future.result()
+            writer.shutdown()
+            print(f"{ext:6s}: 同期保存 {sync_ms:7.1f} ms / submit() から戻るまで {submit_ms:5.2f} ms "
+                  f"(バックグラウンドの保存 {writer.stats()['write_s'] * 1000:7.1f} ms)")
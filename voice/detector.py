@@ -110,6 +110,45 @@ def keyword_detection_thread():
             except Exception as e_porc:
                 log_print(f"Porcupine解放エラー: {e_porc}")
 
+# --- 超音波センサー距離測定 ---
+def setup_distance_sensor():
+    """超音波センサーのGPIOを設定する（失敗時は例外）"""
+    GPIO.setmode(GPIO.BCM)
+    GPIO.setup(TRIG_PIN, GPIO.OUT)
+    GPIO.setup(ECHO_PIN, GPIO.IN)
+
+def get_distance():
+    """
+    超音波センサーで距離(cm)を測定
+    setup_distance_sensor() の後に呼ぶ。表示のページ送り（手かざし）からも使う。
+    """
+    try:
+        # Trigピンを10μsだけHIGHにして超音波の発信開始
+        GPIO.output(TRIG_PIN, GPIO.HIGH)
+        time.sleep(0.000010)
+        GPIO.output(TRIG_PIN, GPIO.LOW)
+
+        # 超音波が発信されるまで待機
+        timeout_start = time.time()
+        while not GPIO.input(ECHO_PIN):
+            if time.time() - timeout_start > 0.1:  # 100ms以上待機したらタイムアウト
+                return float('inf')
+            pass
+        t1 = time.time()  # 超音波発信時刻（EchoピンがHIGHになった時刻）格納
+
+        # 超音波が受信されるまで待機
+        timeout_start = time.time()
+        while GPIO.input(ECHO_PIN):
+            if time.time() - timeout_start > 0.1:  # 100ms以上待機したらタイムアウト
+                return float('inf')
+            pass
+        t2 = time.time()  # 超音波受信時刻（EchoピンがLOWになった時刻）格納
+
+        return (t2 - t1) * SPEED_OF_SOUND / 2  # 時間差から対象物までの距離計算
+    except Exception as dist_e:
+        # log_print(f"距離計算中のエラー: {dist_e}") # デバッグ用
+        return float('inf') # エラー時は無限大を返す
+
 # --- 超音波センサー距離検出スレッド ---
 def distance_detection_thread():
     """超音波センサーで距離を測定するスレッド"""
@@ -118,43 +157,12 @@ def distance_detection_thread():
 
     # GPIOの設定
     try:
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setup(TRIG_PIN, GPIO.OUT)
-        GPIO.setup(ECHO_PIN, GPIO.IN)
+        setup_distance_sensor()
     except Exception as e:
         log_print(f"GPIO設定エラー: {e}", flush=True)
         log_print("距離検出を無効化します。", flush=True)
         return
 
-    def get_distance():
-        """超音波センサーで距離を測定"""
-        try:
-            # Trigピンを10μsだけHIGHにして超音波の発信開始
-            GPIO.output(TRIG_PIN, GPIO.HIGH)
-            time.sleep(0.000010)
-            GPIO.output(TRIG_PIN, GPIO.LOW)
-
-            # 超音波が発信されるまで待機
-            timeout_start = time.time()
-            while not GPIO.input(ECHO_PIN):
-                if time.time() - timeout_start > 0.1:  # 100ms以上待機したらタイムアウト
-                    return float('inf')
-                pass
-            t1 = time.time()  # 超音波発信時刻（EchoピンがHIGHになった時刻）格納
-
-            # 超音波が受信されるまで待機
-            timeout_start = time.time()
-            while GPIO.input(ECHO_PIN):
-                if time.time() - timeout_start > 0.1:  # 100ms以上待機したらタイムアウト
-                    return float('inf')
-                pass
-            t2 = time.time()  # 超音波受信時刻（EchoピンがLOWになった時刻）格納
-
-            return (t2 - t1) * SPEED_OF_SOUND / 2  # 時間差から対象物までの距離計算
-        except Exception as dist_e:
-            # log_print(f"距離計算中のエラー: {dist_e}") # デバッグ用
-            return float('inf') # エラー時は無限大を返す
-
     try:
         while True:
             # 検出イベントがセットされたらスレッド終了